@@ -1,206 +1,129 @@
 import streamlit as st
 import pandas as pd
 import os
-from datetime import datetime
-from recommend import hybrid_recommend, save_user_log, load_user_logs
-from utils.cleaner import clean_news_data, clean_api_news
-from utils.visualizer import plot_category_bar, plot_category_pie, plot_topic_wordcloud
-import requests
+from datetime import date, datetime, timedelta
+from recommend import get_recommendations, save_user_log, load_user_analytics, load_user_activity, start_warm_up
+from utils.article_store import load_articles, ingest_articles, NEWS_COLUMNS
+from utils.ingest import fetch_headlines, NEWSAPI_CATEGORIES
+from utils.visualizer import category_bar_image, category_pie_figure, topic_wordcloud_image, activity_figure, preload as preload_charts
+from utils.instrument import capture, registry, span
 
 # Paths
 NEWS_PATH = os.path.join('data', 'news_dataset.csv')
-USER_LOGS_PATH = os.path.join('user_logs', 'user_logs.csv')
 
 # User ID (simulate single user for demo)
 USER_ID = 'user_1'
 
 # News API configuration
-NEWSAPI_KEY = 'e6e5c39f7a09461f98750f7dc6ad45bd'
-NEWSAPI_URL = 'https://newsapi.org/v2/top-headlines?country=us&pageSize=10&apiKey=' + NEWSAPI_KEY
+NEWSAPI_KEY = os.environ.get('NEWSAPI_KEY', 'e6e5c39f7a09461f98750f7dc6ad45bd')
+NEWSAPI_COUNTRIES = ['us']
+NEWSAPI_PAGE_SIZE = 20
+NEWSAPI_MAX_PAGES = 2
 
-# Load and clean data
+# Always show the debug panel (otherwise it is opened with ?debug=1)
+DEBUG = os.environ.get('CARVED_DEBUG') == '1'
+
+# Load and clean data (parsed and cleaned once per dataset version, then served from the columnar cache)
+@span('app.load_data')
 def load_data():
-    try:
-        # Try with tab delimiter and Python engine to handle inconsistent field counts
-        df = pd.read_csv(NEWS_PATH, delimiter='\t', engine='python', on_bad_lines='skip')
-    except Exception as e:
-        st.error(f"Error loading data with tab delimiter: {e}")
-        try:
-            # Fallback to C engine with flexible field count
-            df = pd.read_csv(NEWS_PATH, delimiter='\t', engine='c', on_bad_lines='skip')
-        except Exception as e2:
-            st.error(f"Error loading data with fallback method: {e2}")
-            # Last resort: try to infer delimiter
-            try:
-                df = pd.read_csv(NEWS_PATH, sep=None, engine='python', on_bad_lines='skip')
-            except Exception as e3:
-                st.error(f"Failed to load data: {e3}")
-                # Return empty DataFrame with expected columns
-                return pd.DataFrame(columns=['category', 'title', 'summary', 'topic', 'date'])
-    
-    df = clean_news_data(df)
+    df = load_articles(NEWS_PATH, columns=NEWS_COLUMNS, on_error=st.error)
+    if df is None:
+        # Return empty DataFrame with expected columns
+        return pd.DataFrame(columns=NEWS_COLUMNS)
     # Ensure all required columns exist
-    required_columns = ['category', 'title', 'summary', 'topic', 'date']
-    for col in required_columns:
+    for col in NEWS_COLUMNS:
         if col not in df.columns:
             st.error(f"Missing required column: {col}")
-    df = df.reset_index(drop=True)
     return df
 
 def fetch_latest_news():
+    # All categories and countries are fetched concurrently over a pooled, rate-limited session.
+    # Returns (articles, error when nothing was fetched, failed requests when some were)
     try:
-        response = requests.get(NEWSAPI_URL)
-        if response.status_code == 200:
-            articles = response.json().get('articles', [])
-            if not articles:
-                return None, 'No articles found.'
-            df_api = pd.DataFrame(articles)
-            df_api = clean_api_news(df_api)
-            return df_api, None
-        else:
-            return None, f'API error: {response.status_code}'
+        df_api, errors = fetch_headlines(
+            NEWSAPI_KEY,
+            categories=NEWSAPI_CATEGORIES,
+            countries=NEWSAPI_COUNTRIES,
+            page_size=NEWSAPI_PAGE_SIZE,
+            max_pages=NEWSAPI_MAX_PAGES,
+        )
+        if df_api is None:
+            return None, errors[0] if errors else 'No articles found.', []
+        return df_api, None, errors
     except Exception as e:
-        return None, f'Error: {e}'
+        return None, f'Error: {e}', []
 
-def load_logs():
-    if os.path.exists(USER_LOGS_PATH):
-        return pd.read_csv(USER_LOGS_PATH)
-    else:
-        return pd.DataFrame(columns=['user_id', 'news_id', 'action', 'timestamp'])
+# Date ranges offered by the dashboard: (start, end) for today, None meaning unbounded
+DASHBOARD_PERIODS = {
+    'All time': lambda today: (None, None),
+    'This year': lambda today: (today.replace(month=1, day=1), today),
+    'Last 12 months': lambda today: (today - timedelta(days=364), today),
+    'Last 30 days': lambda today: (today - timedelta(days=29), today),
+}
 
 # --- Carved Dashboard (Spotify Wrapped style) ---
-def carved_dashboard(news_df, logs_df):
+@span('app.dashboard')
+def carved_dashboard(analytics, news_df):
     st.subheader('🪓 Carved Dashboard: Your News Year in Review')
-    user_logs = logs_df[logs_df['user_id'] == USER_ID]
-    total_seen = user_logs['news_id'].nunique()
-    liked = user_logs[user_logs['action'] == 'like']
-    most_liked_cat = None
-    top_topics = []
-    
-    if not liked.empty:
-        # Get indices of liked news, handling potential errors
-        try:
-            # Get the most recent liked news first
-            liked = liked.sort_values('timestamp', ascending=False)
-            liked_indices = liked['news_id'].astype(int).tolist()
-            
-            # Filter only valid indices
-            valid_indices = [idx for idx in liked_indices if idx < len(news_df)]
-            if valid_indices:
-                liked_news = news_df.iloc[valid_indices]
-                
-                # Get most liked category if category column exists
-                if 'category' in liked_news.columns and not liked_news['category'].empty:
-                    # Use the most recent liked category (first row after sorting)
-                    most_liked_cat = liked_news['category'].iloc[0]
-                
-                # Get top topics if topic column exists
-                if 'topic' in liked_news.columns:
-                    # Filter out numeric-only topics
-                    topics = liked_news['topic'].astype(str)
-                    non_numeric_topics = topics[~topics.str.match(r'^\d+$')]
-                    
-                    if not non_numeric_topics.empty:
-                        top_topics = non_numeric_topics.value_counts().head(3).index.tolist()
-                    elif 'category' in liked_news.columns:  # Use category as fallback
-                        top_topics = liked_news['category'].value_counts().head(3).index.tolist()
-                elif 'category' in liked_news.columns:  # Use category as fallback
-                    top_topics = liked_news['category'].value_counts().head(3).index.tolist()
-        except Exception as e:
-            st.warning(f"Error processing liked news: {e}")
-    
+    # Any period is answered from the daily / monthly rollups, not the raw log; both use local calendar days
+    period = st.selectbox('Period', list(DASHBOARD_PERIODS), key='dashboard_period')
+    start, end = DASHBOARD_PERIODS[period](date.today())
+    if period != 'All time':
+        analytics = load_user_analytics(USER_ID, news_df, start, end)
     col1, col2, col3 = st.columns(3)
-    col1.metric('Total News Seen', total_seen)
-    col2.metric('Most Liked Category', most_liked_cat if most_liked_cat else '-')
-    col3.metric('Top 3 Topics', ', '.join(top_topics) if top_topics else '-')
+    # Rollups count an article in the bucket where it was first seen, so a period shows new articles only
+    col1.metric('Total News Seen' if period == 'All time' else 'New Articles Seen', analytics.new_seen)
+    col2.metric('Most Liked Category', analytics.most_liked_category or '-')
+    col3.metric('Top 3 Topics', ', '.join(analytics.top_topics) if analytics.top_topics else '-')
     st.markdown('---')
     st.write('**Your News Preferences Visualized:**')
     
-    # Generate visualizations based on user's liked articles
-    if valid_indices and not liked_news.empty:
+    # Charts are rendered from the aggregates and cached until the liked set changes
+    if not analytics.category_counts.empty:
         try:
-            fig_dashboard = plot_category_bar(liked_news)
-            st.pyplot(fig_dashboard)
+            st.image(category_bar_image(analytics.category_counts))
             st.caption("Category distribution of your liked articles")
         except Exception as e:
             st.warning(f"Could not generate category bar chart: {e}")
         
         try:
-            st.plotly_chart(plot_category_pie(liked_news))
+            st.plotly_chart(category_pie_figure(analytics.category_counts))
             st.caption("Proportion of categories you've liked")
         except Exception as e:
             st.warning(f"Could not generate category pie chart: {e}")
         
         try:
-            fig_wordcloud = plot_topic_wordcloud(liked_news)
-            st.pyplot(fig_wordcloud)
+            # Topics of liked articles, or their categories when no topic is usable
+            topic_counts = analytics.topic_counts if not analytics.topic_counts.empty else analytics.category_counts
+            st.image(topic_wordcloud_image(topic_counts))
             st.caption("Word cloud of your favorite topics")
         except Exception as e:
             st.warning(f"Could not generate topic word cloud: {e}")
     else:
         st.info("Like some articles to see your news preferences visualized")
-
-# --- Main App ---
-def main():
-    st.set_page_config(page_title='Google Carved', layout='wide')
-    st.title('Google Carved')
-    st.caption('A personalized news recommendation system inspired by Google Discover & Spotify Wrapped.')
-
-    # Load data
-    news_df = load_data()
-    logs_df = load_logs()
-
-    # Sidebar analytics
-    st.sidebar.header('📊 Your Analytics')
-    user_logs = logs_df[logs_df['user_id'] == USER_ID]
-    total_seen = user_logs['news_id'].nunique()
-    liked = user_logs[user_logs['action'] == 'like']
-    most_liked_cat = None
-    top_topics = []
     
-    if not liked.empty:
-        # Get indices of liked news, handling potential errors
+    timeline = load_user_activity(USER_ID, news_df, start, end, 'day' if period == 'Last 30 days' else 'month')
+    if not timeline.empty:
         try:
-            # Get the most recent liked news first
-            liked = liked.sort_values('timestamp', ascending=False)
-            liked_indices = liked['news_id'].astype(int).tolist()
-            
-            # Filter only valid indices
-            valid_indices = [idx for idx in liked_indices if idx < len(news_df)]
-            if valid_indices:
-                liked_news = news_df.iloc[valid_indices]
-                
-                # Get most liked category if category column exists
-                if 'category' in liked_news.columns and not liked_news['category'].empty:
-                    # Use the most recent liked category (first row after sorting)
-                    most_liked_cat = liked_news['category'].iloc[0]
-                
-                # Get top topics if topic column exists
-                if 'topic' in liked_news.columns:
-                    # Filter out numeric-only topics
-                    topics = liked_news['topic'].astype(str)
-                    non_numeric_topics = topics[~topics.str.match(r'^\d+$')]
-                    
-                    if not non_numeric_topics.empty:
-                        top_topics = non_numeric_topics.value_counts().head(3).index.tolist()
-                    elif 'category' in liked_news.columns:  # Use category as fallback
-                        top_topics = liked_news['category'].value_counts().head(3).index.tolist()
-                elif 'category' in liked_news.columns:  # Use category as fallback
-                    top_topics = liked_news['category'].value_counts().head(3).index.tolist()
+            st.plotly_chart(activity_figure(timeline))
+            st.caption("Articles you liked, discarded and saw for the first time")
         except Exception as e:
-            st.sidebar.warning(f"Error processing liked news: {e}")
-    
-    st.sidebar.metric('Total News Seen', total_seen)
-    st.sidebar.metric('Most Liked Category', most_liked_cat if most_liked_cat else '-')
-    st.sidebar.metric('Top 3 Topics', ', '.join(top_topics) if top_topics else '-')
+            st.warning(f"Could not generate activity chart: {e}")
+
+# --- Sidebar Analytics ---
+@span('app.sidebar')
+def sidebar_analytics(analytics):
+    st.sidebar.header('📊 Your Analytics')
+    st.sidebar.metric('Total News Seen', analytics.new_seen)
+    st.sidebar.metric('Most Liked Category', analytics.most_liked_category or '-')
+    st.sidebar.metric('Top 3 Topics', ', '.join(analytics.top_topics) if analytics.top_topics else '-')
     st.sidebar.markdown('---')
     st.sidebar.write('**Visualizations:**')
     
     # Generate visualizations based on user's liked articles
     try:
-        if valid_indices and not liked_news.empty:
-            fig_sidebar = plot_category_bar(liked_news)
-            st.sidebar.pyplot(fig_sidebar)
+        if not analytics.category_counts.empty:
+            st.sidebar.image(category_bar_image(analytics.category_counts))
             st.sidebar.caption("Category distribution of your liked articles")
         else:
             st.sidebar.info("Like some articles to see your category preferences")
@@ -208,23 +131,25 @@ def main():
         st.sidebar.warning(f"Could not generate category bar chart: {e}")
     
     try:
-        if valid_indices and not liked_news.empty:
-            st.sidebar.plotly_chart(plot_category_pie(liked_news))
+        if not analytics.category_counts.empty:
+            st.sidebar.plotly_chart(category_pie_figure(analytics.category_counts))
             st.sidebar.caption("Proportion of categories you've liked")
         else:
             st.sidebar.info("Like some articles to see your category distribution")
     except Exception as e:
         st.sidebar.warning(f"Could not generate category pie chart: {e}")
 
-    # Carved Dashboard
-    carved_dashboard(news_df, logs_df)
-
+# --- News Feed ---
+@span('app.feed')
+def news_feed(news_df):
     st.header('🧠 Your Personalized News Feed')
-    recs, explanations = hybrid_recommend(USER_ID, news_df, top_n=5)
+    # Precomputed by precompute.py when current, otherwise computed inline
+    recs, explanations = get_recommendations(USER_ID, news_df, top_n=5)
     for idx, (row, expl) in enumerate(zip(recs.itertuples(), explanations)):
         with st.container():
             st.subheader(row.title)
-            st.write(f"**Category:** {row.category} | **Date:** {row.date}")
+            date = row.date.strftime('%Y-%m-%d') if pd.notna(row.date) else 'unknown'
+            st.write(f"**Category:** {row.category} | **Date:** {date}")
             st.write(row.summary)
             st.info(f"_Why recommended:_ {expl}")
             col1, col2 = st.columns(2)
@@ -238,19 +163,74 @@ def main():
                     st.info('Discarded!')
     st.markdown('---')
     st.write('**Tip:** Like or discard news to improve your recommendations!')
+
+# --- Debug Panel (hidden: open the app with ?debug=1, add &profile=1 / &memory=1 for cProfile / tracemalloc) ---
+def debug_options():
+    params = st.query_params
+    enabled = DEBUG or params.get('debug') == '1'
+    return enabled, enabled and params.get('profile') == '1', enabled and params.get('memory') == '1'
+
+def debug_panel(trace):
+    with st.sidebar.expander('🛠️ Debug: render breakdown', expanded=True):
+        rows = trace.rows()
+        if rows:
+            breakdown = pd.DataFrame(rows)
+            breakdown['name'] = ['  ' * depth + name for depth, name in zip(breakdown['depth'], breakdown['name'])]
+            st.dataframe(breakdown.drop(columns='depth').round(2), hide_index=True)
+        st.write('**Process-wide span histograms (ms):**')
+        snapshot = registry.snapshot()
+        st.dataframe(pd.DataFrame.from_dict(snapshot['histograms'], orient='index').round(2))
+        if snapshot['counters']:
+            st.write(snapshot['counters'])
+        if trace.profile_text:
+            st.code(trace.profile_text)
+        if trace.top_allocations:
+            st.dataframe(pd.DataFrame(trace.top_allocations, columns=['location', 'size_kb', 'count']).round(1), hide_index=True)
+
+# --- Main App ---
+def render_page():
+    st.title('Google Carved')
+    st.caption('A personalized news recommendation system inspired by Google Discover & Spotify Wrapped.')
+
+    # Load data
+    news_df = load_data()
+
+    # Once the header is on screen, build the models and load the chart libraries in the background
+    start_warm_up(news_df, extra=[preload_charts])
+
+    # All-time aggregates from the rollups, shared by the sidebar and the dashboard
+    analytics = load_user_analytics(USER_ID, news_df)
+
+    # Sidebar analytics
+    sidebar_analytics(analytics)
+
+    # Carved Dashboard
+    carved_dashboard(analytics, news_df)
+
+    news_feed(news_df)
+
     # --- Real-time news fetch button (API integration next) ---
     st.sidebar.markdown('---')
     if st.sidebar.button('📰 Fetch Latest News (API)', key='fetch_news'):
-        df_api, err = fetch_latest_news()
+        df_api, err, failed = fetch_latest_news()
         if err:
             st.sidebar.error(f'Failed to fetch news: {err}')
         else:
-            # Merge new articles, deduplicate, and update CSV
-            news_df = pd.concat([news_df, df_api], ignore_index=True)
-            news_df = clean_news_data(news_df)
-            news_df = news_df.drop_duplicates(subset=['title', 'summary'])
-            news_df.to_csv(NEWS_PATH, index=False)
-            st.sidebar.success(f'Fetched and merged {len(df_api)} new articles! Refresh the page to see updates.')
+            # Clean, deduplicate and append only the new articles, with stable news ids
+            added = ingest_articles(df_api, NEWS_PATH)
+            st.sidebar.success(f'Fetched {len(df_api)} articles, {len(added)} new! Refresh the page to see updates.')
+            if failed:
+                st.sidebar.warning(f'{len(failed)} source(s) could not be fetched:\n' + '\n'.join(f'- {e}' for e in failed))
+
+def main():
+    st.set_page_config(page_title='Google Carved', layout='wide')
+    debug, profile, memory = debug_options()
+    # Every render is traced; the stage breakdown is only shown in debug mode
+    with capture(profile=profile, memory=memory) as trace:
+        with span('app.render'):
+            render_page()
+    if debug:
+        debug_panel(trace)
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,60 @@
+import argparse
+import os
+import tempfile
+import time
+import numpy as np
+import pandas as pd
+from utils.article_store import iter_news_csv, read_news_csv
+from utils.cleaner import CLEAN_BLOCK_SIZE, clean_news_data, clean_news_data_chunked
+
+# Benchmark: chunked, parallel cleaning (clean_news_data_chunked) against the
+# single-pass clean_news_data over a synthetic raw dataset with duplicates,
+# missing values and unnormalised categories. Checks that both give the same frame.
+#   python -m benchmarks.bench_cleaning --rows 2000000 --workers 4
+
+
+def make_raw(n_rows, n_categories=20, duplicate_rate=0.05, seed=0):
+    rng = np.random.default_rng(seed)
+    categories = np.array([f'  category {i} ' if i % 2 else f'CATEGORY {i}' for i in range(n_categories)])
+    ids = rng.integers(0, int(n_rows * (1 - duplicate_rate)), n_rows)
+    df = pd.DataFrame({
+        'category': categories[ids % n_categories],
+        'filename': pd.Series(ids % 1000).map('{:03d}.txt'.format),
+        'title': pd.Series(ids).map('Headline {}'.format),
+        'content': pd.Series(ids).map('Body of article {} '.format) * 8,
+    })
+    df.loc[rng.random(n_rows) < 0.001, 'title'] = np.nan
+    return df
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark chunked parallel cleaning against clean_news_data.')
+    parser.add_argument('--rows', type=int, default=500000)
+    parser.add_argument('--block-size', type=int, default=CLEAN_BLOCK_SIZE)
+    parser.add_argument('--workers', type=int, default=None)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'news_dataset.csv')
+        make_raw(args.rows).to_csv(path, sep='\t', index=False)
+
+        start = time.perf_counter()
+        expected = clean_news_data(read_news_csv(path))
+        single_s = time.perf_counter() - start
+
+        start = time.perf_counter()
+        actual = clean_news_data_chunked(iter_news_csv(path, args.block_size), workers=args.workers)
+        chunked_s = time.perf_counter() - start
+
+    try:
+        pd.testing.assert_frame_equal(expected, actual)
+        same = True
+    except AssertionError:
+        same = False
+    print(f"{args.rows} raw rows -> {len(expected)} cleaned, block size {args.block_size}, "
+          f"workers {args.workers or os.cpu_count()}")
+    print(f"single pass {single_s:.2f}s, chunked {chunked_s:.2f}s ({single_s / chunked_s:.1f}x), same result: {same}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,67 @@
+import argparse
+import os
+import tempfile
+import time
+import numpy as np
+from benchmarks.synthetic import make_corpus, make_logs
+from utils.article_model import ArticleModel
+from utils.log_store import SQLiteLogStore
+from utils.user_profiles import UserProfileStore
+
+# Rebuilding user profiles from the log chunk by chunk (one sparse product per
+# chunk) against folding the rows in one at a time, and loading the snapshot
+# instead of replaying. Checks that all three give the same profile vectors.
+#   python -m benchmarks.bench_profiles --users 5000 --interactions 200 --half-life 30
+
+
+def per_row(model, store, half_life):
+    profiles = UserProfileStore(model, half_life)
+    for chunk in store.iter_since(0):
+        for row in chunk[['user_id', 'news_id', 'action', 'timestamp']].itertuples(index=False, name=None):
+            profiles.apply(*row)
+    return profiles
+
+
+def same_vectors(a, b):
+    return a.profiles.keys() == b.profiles.keys() and all(
+        np.allclose(a.vector(user).toarray(), b.vector(user).toarray()) for user in a.profiles)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark rebuilding user profiles from the log.')
+    parser.add_argument('--articles', type=int, default=20000)
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--interactions', type=int, default=100, help='Interactions per user')
+    parser.add_argument('--half-life', type=float, default=None, help='Profile half-life in days')
+    args = parser.parse_args()
+
+    news_df = make_corpus(args.articles)
+    logs = make_logs(news_df, args.users, args.interactions)
+    # A tenth of the articles are unknown to the model, as before it is extended with ingested ones
+    model = ArticleModel.fit(news_df.iloc[:len(news_df) - len(news_df) // 10])
+    with tempfile.TemporaryDirectory() as tmp:
+        store = SQLiteLogStore(os.path.join(tmp, 'user_logs.db'))
+        store.append_many(logs)
+
+        start = time.perf_counter()
+        expected = per_row(model, store, args.half_life)
+        row_s = time.perf_counter() - start
+        start = time.perf_counter()
+        chunked = UserProfileStore(model, args.half_life)
+        chunked.refresh(store)
+        chunk_s = time.perf_counter() - start
+        path = os.path.join(tmp, 'user_profiles.npz')
+        chunked.save(path)
+        start = time.perf_counter()
+        loaded = UserProfileStore.load(model, path, args.half_life)
+        load_s = time.perf_counter() - start
+
+        print(f"{len(logs)} interactions, {args.users} users, {len(chunked._pending)} pending")
+        print(f"{'rebuild':<20}{'s':>8}  same vectors")
+        print(f"{'row by row':<20}{row_s:>8.2f}")
+        print(f"{'chunked':<20}{chunk_s:>8.2f}  {same_vectors(expected, chunked)}")
+        print(f"{'snapshot load':<20}{load_s:>8.2f}  {same_vectors(expected, loaded)}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,104 @@
+import argparse
+import random
+import time
+import numpy as np
+import pandas as pd
+from utils.ranking import select_diverse, sort_key
+
+# Micro-benchmark: vectorised candidate selection (utils/ranking.py) against the
+# per-category filter / sort / concat loops it replaced in recommend.py.
+#   python -m benchmarks.bench_ranking --articles 100000 --categories 200
+
+
+def make_frame(n_articles, n_categories, seed=0):
+    rng = np.random.default_rng(seed)
+    dates = pd.Timestamp('2025-01-01') + pd.to_timedelta(rng.integers(0, 365, n_articles), unit='D')
+    return pd.DataFrame({
+        'category': rng.choice([f'Category {i}' for i in range(n_categories)], n_articles),
+        'date': dates.strftime('%Y-%m-%d'),
+        'score': rng.random(n_articles).round(3),
+    })
+
+
+# The previous implementations, with stable sorts so ties resolve deterministically
+
+def loop_cold_start(news_df, top_n):
+    diverse_recs = pd.DataFrame()
+    for category in news_df['category'].unique():
+        category_news = news_df[news_df['category'] == category].sort_values('date', ascending=False, kind='stable').head(1)
+        diverse_recs = pd.concat([diverse_recs, category_news])
+    if len(diverse_recs) < top_n:
+        existing_categories = set(diverse_recs['category'])
+        remaining = news_df[~news_df['category'].isin(existing_categories)].sort_values('date', ascending=False, kind='stable')
+        diverse_recs = pd.concat([diverse_recs, remaining.head(top_n - len(diverse_recs))])
+    return diverse_recs.head(top_n)
+
+
+def loop_diverse(news_df, seen_ids, sorted_categories, top_n):
+    recs = pd.DataFrame()
+    for category in sorted_categories:
+        if len(recs) >= top_n:
+            break
+        category_recs = news_df[(news_df['category'] == category) &
+                                (~news_df.index.isin(seen_ids))].sort_values('score', ascending=False, kind='stable').head(1)
+        if not category_recs.empty:
+            recs = pd.concat([recs, category_recs])
+    if len(recs) < top_n:
+        remaining = news_df[~news_df.index.isin(seen_ids) & ~news_df.index.isin(recs.index)].sort_values('score', ascending=False, kind='stable')
+        recs = pd.concat([recs, remaining.head(top_n - len(recs))])
+    return recs
+
+
+def vectorised_cold_start(news_df, top_n):
+    picks = select_diverse(news_df['category'], sort_key(news_df['date']), top_n, fill_from_other_categories=True)
+    return news_df.iloc[picks]
+
+
+def vectorised_diverse(news_df, seen_ids, sorted_categories, top_n):
+    picks = select_diverse(news_df['category'], news_df['score'], top_n,
+                           category_order=sorted_categories, mask=~news_df.index.isin(seen_ids))
+    return news_df.iloc[picks]
+
+
+def best_of(fn, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        timings.append(time.perf_counter() - start)
+    return min(timings) * 1000, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark vectorised candidate selection against the old loops.')
+    parser.add_argument('--articles', type=int, default=20000)
+    parser.add_argument('--categories', type=int, default=50)
+    parser.add_argument('--top-n', type=int, default=5)
+    parser.add_argument('--seen', type=int, default=200)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    news_df = make_frame(args.articles, args.categories)
+    seen_ids = random.Random(0).sample(range(args.articles), min(args.seen, args.articles))
+    sorted_categories = list(news_df['category'].unique())
+    random.Random(1).shuffle(sorted_categories)
+
+    cases = [
+        ('cold start, top_n', lambda: loop_cold_start(news_df, args.top_n), lambda: vectorised_cold_start(news_df, args.top_n)),
+        ('cold start, all categories', lambda: loop_cold_start(news_df, args.categories), lambda: vectorised_cold_start(news_df, args.categories)),
+        ('diverse, top_n', lambda: loop_diverse(news_df, seen_ids, sorted_categories, args.top_n),
+         lambda: vectorised_diverse(news_df, seen_ids, sorted_categories, args.top_n)),
+        ('diverse + fill', lambda: loop_diverse(news_df, seen_ids, sorted_categories, args.categories * 2),
+         lambda: vectorised_diverse(news_df, seen_ids, sorted_categories, args.categories * 2)),
+    ]
+    print(f"{args.articles} articles, {args.categories} categories")
+    print(f"{'case':<28}{'loop ms':>10}{'vectorised ms':>16}{'speedup':>10}  same result")
+    for name, loop_fn, vec_fn in cases:
+        loop_ms, expected = best_of(loop_fn, args.repeat)
+        vec_ms, actual = best_of(vec_fn, args.repeat)
+        same = expected.index.tolist() == actual.index.tolist()
+        print(f"{name:<28}{loop_ms:>10.2f}{vec_ms:>16.2f}{loop_ms / vec_ms:>9.1f}x  {same}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,113 @@
+import argparse
+import time
+import numpy as np
+import pandas as pd
+from benchmarks.bench_ranking import best_of
+from benchmarks.synthetic import make_corpus
+from utils.article_store import compact_articles
+from utils.ranking import select_diverse, sort_key, top_per_category
+from utils.recency_index import RecencyIndex
+
+# Recency queries through the time-partitioned index (utils/recency_index.py)
+# against the full-corpus scans they replaced in recommend.py. Also checks that
+# an index extended with appended articles matches one built from scratch, and
+# that dates in formats other than ISO 8601 are parsed, not dropped as undated.
+#   python -m benchmarks.bench_recency --articles 500000 --categories 200
+
+
+def scan_cold_start(news_df, top_n):
+    return select_diverse(news_df['category'], sort_key(news_df['date']), top_n, fill_from_other_categories=True)
+
+
+def scan_latest(news_df, top_n):
+    return np.argsort(-sort_key(news_df['date']), kind='stable')[:top_n]
+
+
+def scan_sample(news_df, top_n, rng):
+    best = top_per_category(news_df['category'], rng.random(len(news_df)), k=1)
+    picks = np.array([positions[0] for positions in best.values()], dtype=np.int64)
+    return rng.choice(picks, size=min(len(picks), top_n), replace=False)
+
+
+def index_cold_start(index, top_n):
+    return np.array([rows[0] for rows in index.latest_per_category(1).values()][:top_n], dtype=np.int64)
+
+
+def index_sample(index, top_n, rng, days=None):
+    picks = np.array([rows[0] for rows in index.random_per_category(1, days, rng).values()], dtype=np.int64)
+    return rng.choice(picks, size=min(len(picks), top_n), replace=False)
+
+
+def same_index(a, b, hashes=True):
+    # Hashes cover the date column as given, so they differ for dates written as text
+    return (a.categories == b.categories and (not hashes or np.array_equal(a.hashes, b.hashes))
+            and all(np.array_equal(x, y) for x, y in zip(a._keys, b._keys))
+            and all(np.array_equal(x, y) for x, y in zip(a._rows, b._rows))
+            and all(np.array_equal(x, y) for x, y in zip(a._bucket_starts, b._bucket_starts)))
+
+
+def non_iso_dates(news_df):
+    """The corpus with its dates written as text, a third each ISO, 'DD Month YYYY' and 'MM/DD/YYYY'."""
+    text = news_df.copy()
+    formats = np.array(['%Y-%m-%d', '%d %B %Y', '%m/%d/%Y'])[np.arange(len(text)) % 3]
+    text['date'] = [day.strftime(fmt) for day, fmt in zip(news_df['date'], formats)]
+    return text
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the recency index against full-corpus scans.')
+    parser.add_argument('--articles', type=int, default=200000)
+    parser.add_argument('--categories', type=int, default=50)
+    parser.add_argument('--top-n', type=int, default=5)
+    parser.add_argument('--days', type=int, default=7, help='Window for the recent-sample and since queries')
+    parser.add_argument('--appended', type=float, default=0.05, help='Share of articles appended incrementally')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    news_df = make_corpus(args.articles, args.categories)
+    start = time.perf_counter()
+    index = RecencyIndex.build(news_df)
+    build_ms = (time.perf_counter() - start) * 1000
+
+    split = len(news_df) - int(len(news_df) * args.appended)
+    start = time.perf_counter()
+    extended = RecencyIndex.build(news_df.iloc[:split]).extend(news_df.iloc[split:])
+    extend_ms = (time.perf_counter() - start) * 1000
+    print(f"{args.articles} articles, {args.categories} categories: build {build_ms:.1f} ms, "
+          f"build + extend {len(news_df) - split} {extend_ms:.1f} ms, same as rebuild: {same_index(index, extended)}")
+
+    text = non_iso_dates(news_df)
+    parsed = compact_articles(text.copy())['date']
+    print(f"non-ISO dates: parsed the same {parsed.equals(news_df['date'])}, "
+          f"index the same {same_index(index, RecencyIndex.build(text), hashes=False)}")
+
+    since = news_df['date'].max() - pd.Timedelta(days=args.days - 1)
+    seen = np.arange(0, len(news_df), 97)
+    cases = [
+        ('cold start, top_n', lambda: scan_cold_start(news_df, args.top_n), lambda: index_cold_start(index, args.top_n)),
+        ('most recent, top_n', lambda: scan_latest(news_df, args.top_n), lambda: index.latest(args.top_n)),
+        ('unseen since T', lambda: np.flatnonzero((news_df['date'] >= since).to_numpy() & ~np.isin(np.arange(len(news_df)), seen)),
+         lambda: index.since(since, exclude=seen)),
+    ]
+    print(f"{'case':<28}{'scan ms':>10}{'index ms':>12}{'speedup':>10}  same result")
+    for name, scan_fn, index_fn in cases:
+        scan_ms, expected = best_of(scan_fn, args.repeat)
+        index_ms, actual = best_of(index_fn, args.repeat)
+        same = np.array_equal(np.sort(expected), np.sort(actual)) if name.startswith('unseen') else np.array_equal(expected, actual)
+        print(f"{name:<28}{scan_ms:>10.2f}{index_ms:>12.2f}{scan_ms / index_ms:>9.1f}x  {same}")
+
+    # Random picks differ by construction; compare timings and that picks stay one per category
+    for name, scan_fn, index_fn in [
+        ('random per category', lambda: scan_sample(news_df, args.top_n, np.random.default_rng(0)),
+         lambda: index_sample(index, args.top_n, np.random.default_rng(0))),
+        (f'random, last {args.days} days', lambda: scan_sample(news_df, args.top_n, np.random.default_rng(0)),
+         lambda: index_sample(index, args.top_n, np.random.default_rng(0), args.days)),
+    ]:
+        scan_ms, _ = best_of(scan_fn, args.repeat)
+        index_ms, actual = best_of(index_fn, args.repeat)
+        distinct = news_df['category'].iloc[actual].nunique() == len(actual)
+        print(f"{name:<28}{scan_ms:>10.2f}{index_ms:>12.2f}{scan_ms / index_ms:>9.1f}x  {distinct}")
+
+
+if __name__ == '__main__':
+    main()
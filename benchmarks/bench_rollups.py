@@ -0,0 +1,96 @@
+import argparse
+import os
+import random
+import tempfile
+import time
+from datetime import date, timedelta
+import pandas as pd
+from benchmarks.synthetic import START, make_corpus, make_logs
+from utils.log_store import SQLiteLogStore
+from utils.rollups import RollupStore
+
+# Dashboard aggregates from the per-user rollups (utils/rollups.py) against a
+# recomputation from the raw log joined with the articles, over random date
+# ranges. Checks that both agree, before and after compaction.
+#   python -m benchmarks.bench_rollups --users 2000 --interactions 200
+
+
+def raw_summary(logs, news_df, user_id, start, end):
+    """(seen, {category: likes}, {topic: likes}) for one user and range, straight from the log."""
+    rows = logs[logs['user_id'] == user_id]
+    # An article counts as seen in the range where the user first saw it
+    first = rows.drop_duplicates('news_id')
+    days = pd.to_datetime(first['timestamp']).dt.date
+    seen = int(((days >= start) & (days <= end)).sum())
+    days = pd.to_datetime(rows['timestamp']).dt.date
+    liked = rows[(rows['action'] == 'like') & (days >= start) & (days <= end)]
+    articles = news_df.loc[liked['news_id']]
+    categories = articles['category'].astype(str).value_counts()
+    topics = articles['topic'].astype(str).value_counts()
+    return seen, categories[categories > 0].to_dict(), topics[topics > 0].to_dict()
+
+
+def rollup_summary(rollups, user_id, start, end):
+    totals = rollups.totals(user_id, start, end)
+    counts = {metric: dict(zip(rows['key'], rows['count'])) for metric, rows in totals.groupby('metric')}
+    return sum(counts.get('new', {}).values()), counts.get('like', {}), counts.get('topic', {})
+
+
+def random_ranges(n, days, seed=0):
+    rng = random.Random(seed)
+    first = START.date()
+    ranges = []
+    for _ in range(n):
+        a, b = sorted(rng.randrange(days) for _ in range(2))
+        ranges.append((first + timedelta(days=a), first + timedelta(days=b)))
+    return ranges
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Check and time date-range aggregates from rollups against the raw log.')
+    parser.add_argument('--articles', type=int, default=10000)
+    parser.add_argument('--users', type=int, default=500)
+    parser.add_argument('--interactions', type=int, default=200, help='Interactions per user')
+    parser.add_argument('--days', type=int, default=365)
+    parser.add_argument('--queries', type=int, default=200)
+    args = parser.parse_args()
+
+    news_df = make_corpus(args.articles)
+    logs = make_logs(news_df, args.users, args.interactions, days=args.days)
+    with tempfile.TemporaryDirectory() as tmp:
+        store = SQLiteLogStore(os.path.join(tmp, 'user_logs.db'))
+        store.append_many(logs)
+        rollups = RollupStore(os.path.join(tmp, 'rollups.db'))
+        start = time.perf_counter()
+        rollups.refresh(store, news_df)
+        print(f"{len(logs)} interactions, {args.users} users: rolled up in {time.perf_counter() - start:.1f}s")
+
+        users = logs['user_id'].unique().tolist()
+        queries = [(random.Random(i).choice(users), *bounds) for i, bounds in enumerate(random_ranges(args.queries, args.days))]
+        start = time.perf_counter()
+        expected = [raw_summary(logs, news_df, *query) for query in queries]
+        raw_ms = (time.perf_counter() - start) * 1000 / len(queries)
+        start = time.perf_counter()
+        actual = [rollup_summary(rollups, *query) for query in queries]
+        rollup_ms = (time.perf_counter() - start) * 1000 / len(queries)
+        print(f"{'per query':<24}{'raw ms':>10}{'rollups ms':>12}  same result")
+        print(f"{'random ranges':<24}{raw_ms:>10.2f}{rollup_ms:>12.2f}  {expected == actual}")
+
+        # After compaction, ranges whose edges fall in compacted months are rounded out to whole months
+        today = START.date() + timedelta(days=args.days)
+        dropped, _, _ = rollups.compact(today=today, daily_days=args.days // 2)
+        daily_from = date.fromisoformat(rollups.daily_from())
+        rounded = []
+        for user_id, lo, hi in queries:
+            if lo < daily_from:
+                lo = lo.replace(day=1)
+            if hi < daily_from:
+                hi = (hi.replace(day=28) + timedelta(days=4)).replace(day=1) - timedelta(days=1)
+            rounded.append((user_id, lo, hi))
+        expected = [raw_summary(logs, news_df, *query) for query in rounded]
+        actual = [rollup_summary(rollups, *query) for query in queries]
+        print(f"{'after compaction':<24}{'':>10}{'':>12}  {expected == actual}  ({dropped} daily rows dropped)")
+
+
+if __name__ == '__main__':
+    main()
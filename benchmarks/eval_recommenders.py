@@ -0,0 +1,202 @@
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timezone
+import numpy as np
+from benchmarks.synthetic import make_corpus, make_logs, temporal_split
+
+# Offline evaluation of the recommenders on a synthetic corpus and log.
+# The log is split in time; the earlier part is written to a fresh log store in
+# a temporary working directory and every recommender is replayed for a sample
+# of users, measuring latency, throughput, peak traced memory and
+# precision/recall@k against the users' later likes.
+#   python -m benchmarks.eval_recommenders --users 10000 --articles 50000 --output results.json
+#   python -m benchmarks.eval_recommenders --compare results.json   # exits 1 on a regression
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_ROOT,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def recommenders(news_df, top_n):
+    """name -> function(user_id) returning the recommended news ids."""
+    from recommend import (collaborative_recommend, content_based_recommend, factor_recommend, hybrid_recommend,
+                           load_user_logs)
+    return {
+        'collaborative': lambda user_id: collaborative_recommend(user_id, news_df, top_n=top_n).index,
+        'factor': lambda user_id: factor_recommend(user_id, news_df, load_user_logs(user_id), top_n).index,
+        'content': lambda user_id: content_based_recommend(user_id, news_df, load_user_logs(user_id), top_n)[0].index,
+        'hybrid': lambda user_id: hybrid_recommend(user_id, news_df, top_n)[0].index,
+    }
+
+
+def evaluate(fn, user_ids, relevant, top_n, memory_calls):
+    latencies = []
+    hits = precision = recall = 0.0
+    for user_id in user_ids:
+        start = time.perf_counter()
+        recs = fn(user_id)
+        latencies.append(time.perf_counter() - start)
+        n_hits = len(relevant[user_id].intersection(recs))
+        hits += n_hits
+        precision += n_hits / top_n
+        recall += n_hits / len(relevant[user_id])
+    # Peak memory is traced over a separate, shorter run: tracing slows every allocation
+    tracemalloc.start()
+    for user_id in user_ids[:memory_calls]:
+        fn(user_id)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    latencies_ms = np.array(latencies) * 1000
+    return {
+        'calls': len(user_ids),
+        'p50_ms': float(np.percentile(latencies_ms, 50)),
+        'p95_ms': float(np.percentile(latencies_ms, 95)),
+        'mean_ms': float(latencies_ms.mean()),
+        'throughput_per_s': float(len(latencies) / sum(latencies)),
+        'peak_traced_mb': peak / 2 ** 20,
+        f'precision_at_{top_n}': precision / len(user_ids),
+        f'recall_at_{top_n}': recall / len(user_ids),
+        'hits': int(hits),
+    }
+
+
+def batch_throughput(news_df, user_ids, top_n):
+    from recommend import batch_recommend
+    start = time.perf_counter()
+    batch_recommend(user_ids, news_df, top_n)
+    elapsed = time.perf_counter() - start
+    return {'calls': len(user_ids), 'throughput_per_s': len(user_ids) / elapsed, 'total_s': elapsed}
+
+
+def run(args):
+    # The recommenders shuffle categories / sample articles through the global generators
+    random.seed(args.seed)
+    np.random.seed(args.seed)
+    news_df = make_corpus(args.articles, args.categories, seed=args.seed)
+    logs = make_logs(news_df, args.users, args.interactions, seed=args.seed)
+    train, test = temporal_split(logs, args.holdout)
+    liked_later = test[test['action'] == 'like'].groupby('user_id')['news_id'].agg(set)
+    candidates = liked_later.index.intersection(train['user_id'].unique())
+    rng = np.random.default_rng(args.seed)
+    user_ids = sorted(rng.choice(candidates, min(args.sample_users, len(candidates)), replace=False).tolist())
+    relevant = liked_later.to_dict()
+
+    # The stores and models live under relative paths, so run in a scratch directory
+    workdir = tempfile.mkdtemp(prefix='carved-eval-')
+    os.chdir(workdir)
+    os.makedirs('user_logs', exist_ok=True)
+    from recommend import warm_up
+    from utils.factorization import train_factor_model
+    from utils.log_store import get_log_store
+
+    start = time.perf_counter()
+    get_log_store().append_many(train)
+    load_s = time.perf_counter() - start
+    start = time.perf_counter()
+    warm_up(news_df)
+    build_s = time.perf_counter() - start
+    # The factor model is trained offline; once saved, hybrid_recommend uses it too
+    start = time.perf_counter()
+    train_factor_model(get_log_store(), cold=True)
+    factor_s = time.perf_counter() - start
+
+    results = {}
+    for name, fn in recommenders(news_df, args.top_n).items():
+        if args.only and name not in args.only:
+            continue
+        results[name] = evaluate(fn, user_ids, relevant, args.top_n, args.memory_calls)
+        print(f"{name:<14} p50 {results[name]['p50_ms']:8.2f} ms  p95 {results[name]['p95_ms']:8.2f} ms  "
+              f"{results[name]['throughput_per_s']:8.1f}/s  peak {results[name]['peak_traced_mb']:7.1f} MB  "
+              f"P@{args.top_n} {results[name][f'precision_at_{args.top_n}']:.3f}  "
+              f"R@{args.top_n} {results[name][f'recall_at_{args.top_n}']:.3f}")
+    if not args.only or 'batch' in args.only:
+        results['batch'] = batch_throughput(news_df, user_ids, args.top_n)
+        print(f"{'batch':<14} {results['batch']['throughput_per_s']:8.1f} users/s")
+
+    return {
+        'meta': {
+            'commit': git_commit(),
+            'time': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            'python': sys.version.split()[0],
+            'platform': platform.platform(),
+            'args': vars(args),
+        },
+        'dataset': {
+            'articles': len(news_df), 'users': args.users,
+            'train_interactions': len(train), 'test_interactions': len(test),
+            'evaluated_users': len(user_ids),
+        },
+        'setup': {'log_load_s': load_s, 'build_s': build_s, 'factor_train_s': factor_s},
+        'results': results,
+    }
+
+
+def compare(current, baseline, tolerance):
+    """Print metric ratios against a baseline run; returns True when something regressed."""
+    regressed = False
+    print(f"\nagainst {baseline['meta'].get('commit')} ({baseline['meta'].get('time')})")
+    for name, metrics in current['results'].items():
+        old = baseline['results'].get(name)
+        if not old:
+            continue
+        for metric, value in metrics.items():
+            if metric not in old or metric in ('calls', 'hits') or not old[metric]:
+                continue
+            ratio = value / old[metric]
+            # Latency and memory regress upwards; throughput and quality downwards
+            lower_is_better = metric.endswith(('_ms', '_mb')) or metric == 'total_s'
+            worse = ratio > 1 + tolerance if lower_is_better else ratio < 1 - tolerance
+            regressed |= worse
+            print(f"  {name:<14}{metric:<20}{old[metric]:>12.4g} -> {value:<12.4g}{ratio:>7.2f}x{'  REGRESSION' if worse else ''}")
+    return regressed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Evaluate recommender latency, memory and accuracy on synthetic data.')
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--articles', type=int, default=1000)
+    parser.add_argument('--categories', type=int, default=12)
+    parser.add_argument('--interactions', type=int, default=20, help='Interactions per user')
+    parser.add_argument('--holdout', type=float, default=0.2, help='Latest share of the log held out for scoring')
+    parser.add_argument('--sample-users', type=int, default=200, help='Users replayed per recommender')
+    parser.add_argument('--memory-calls', type=int, default=20)
+    parser.add_argument('--top-n', type=int, default=5)
+    parser.add_argument('--only', nargs='*', help='Subset of: collaborative factor content hybrid batch')
+    parser.add_argument('--neighbor-backend', choices=['exact', 'lsh'])
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='Write results as JSON')
+    parser.add_argument('--compare', help='Baseline JSON to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.2)
+    args = parser.parse_args()
+    if args.neighbor_backend:
+        os.environ['CARVED_NEIGHBOR_BACKEND'] = args.neighbor_backend
+    output = os.path.abspath(args.output) if args.output else None
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+
+    current = run(args)
+    if output:
+        with open(output, 'w') as f:
+            json.dump(current, f, indent=2)
+    if baseline is not None and compare(current, baseline, args.tolerance):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
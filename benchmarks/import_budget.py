@@ -0,0 +1,76 @@
+import argparse
+import os
+import subprocess
+import sys
+
+# Import-time regression check for the main entry points, measured with
+# `python -X importtime` in a fresh interpreter (best of --repeat runs).
+#   python -m benchmarks.import_budget            # exits 1 when over budget
+#   python -m benchmarks.import_budget --top 15   # also list the slowest imports
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Cumulative import time allowed per module, in milliseconds
+BUDGET_MS = {
+    'app': 1500,
+    'recommend': 900,
+    'precompute': 900,
+    'utils.visualizer': 50,
+    'utils.ingest': 700,
+}
+
+# Heavy packages an entry point must only import when a code path needs them
+DEFERRED = {
+    'app': ['sklearn', 'matplotlib', 'seaborn', 'wordcloud'],
+    'recommend': ['sklearn', 'matplotlib', 'plotly', 'requests'],
+    'precompute': ['sklearn', 'matplotlib', 'plotly', 'requests'],
+    'utils.visualizer': ['matplotlib', 'seaborn', 'plotly', 'wordcloud', 'pandas'],
+    'utils.ingest': ['requests', 'urllib3'],
+}
+
+
+def import_times(module):
+    """Map of module name -> cumulative import time (µs) for `import module`."""
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        cwd=REPO_ROOT, capture_output=True, text=True,
+        env=dict(os.environ, PYTHONPATH=REPO_ROOT),
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f'import {module} failed:\n{result.stderr}')
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        times[name.strip()] = int(cumulative)
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Check the import time of the entry points against a budget.')
+    parser.add_argument('modules', nargs='*', default=list(BUDGET_MS))
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--top', type=int, default=0)
+    args = parser.parse_args()
+
+    failed = False
+    print(f"{'module':<20}{'ms':>8}{'budget':>8}  deferred imports")
+    for module in args.modules:
+        runs = [import_times(module) for _ in range(args.repeat)]
+        best = min(runs, key=lambda times: times[module])
+        ms = best[module] / 1000
+        budget = BUDGET_MS.get(module)
+        leaked = [pkg for pkg in DEFERRED.get(module, []) if pkg in best]
+        over = budget is not None and ms > budget
+        failed |= over or bool(leaked)
+        status = 'ok' if not leaked else 'imported eagerly: ' + ', '.join(leaked)
+        print(f"{module:<20}{ms:>8.0f}{budget or '-':>8}  {status}{'  OVER BUDGET' if over else ''}")
+        if args.top:
+            for name, us in sorted(best.items(), key=lambda item: -item[1])[1:args.top + 1]:
+                print(f"    {us / 1000:>8.1f}  {name}")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
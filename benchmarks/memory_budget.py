@@ -0,0 +1,68 @@
+import argparse
+import os
+import sys
+import tempfile
+from benchmarks.bench_cleaning import make_raw
+from benchmarks.synthetic import make_corpus, make_logs
+from utils.article_store import ArticleStore
+from utils.log_store import compact_logs
+
+# Per-row memory check for the typed frames the app works with: articles as
+# returned by ArticleStore.frame() and interaction logs after compact_logs().
+# Free-text columns (title, summary, content) are left out since their size is
+# the data's own; the budget covers the columns and index the data model controls.
+#   python -m benchmarks.memory_budget            # exits 1 when over budget
+#   python -m benchmarks.memory_budget --rows 2000000
+
+# Bytes per row allowed, measured with memory_usage(deep=True)
+BUDGET_BYTES_PER_ROW = {
+    'articles': 20,
+    'logs': 24,
+}
+
+ARTICLE_COLUMNS = ['category', 'topic', 'date']
+
+
+def bytes_per_row(df):
+    return df.memory_usage(deep=True, index=True).sum() / max(len(df), 1)
+
+
+def measure_articles(n_rows):
+    """(compact, object-dtype) bytes per row of the article columns after a real cache build."""
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'news_dataset.csv')
+        make_raw(n_rows).to_csv(path, sep='\t', index=False)
+        store = ArticleStore(path, cache_dir=os.path.join(tmp, 'cache'), ingest_dir=os.path.join(tmp, 'ingested'))
+        frame = store.frame(ARTICLE_COLUMNS)
+        as_objects = frame.astype({'category': object, 'topic': object, 'date': str}).set_axis(
+            frame.index.astype('int64'), axis=0)
+        return bytes_per_row(frame), bytes_per_row(as_objects)
+
+
+def measure_logs(n_users, interactions_per_user):
+    logs = make_logs(make_corpus(10000), n_users, interactions_per_user)
+    return bytes_per_row(compact_logs(logs)), bytes_per_row(logs.astype(object))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Check the per-row memory of articles and logs against a budget.')
+    parser.add_argument('--rows', type=int, default=200000, help='Raw article rows')
+    parser.add_argument('--users', type=int, default=20000)
+    parser.add_argument('--interactions', type=int, default=20, help='Interactions per user')
+    args = parser.parse_args()
+
+    results = {
+        'articles': measure_articles(args.rows),
+        'logs': measure_logs(args.users, args.interactions),
+    }
+    failed = False
+    print(f"{'frame':<10}{'bytes/row':>10}{'budget':>8}{'as objects':>12}")
+    for name, (compact, objects) in results.items():
+        over = compact > BUDGET_BYTES_PER_ROW[name]
+        failed |= over
+        print(f"{name:<10}{compact:>10.1f}{BUDGET_BYTES_PER_ROW[name]:>8}{objects:>12.1f}{'  OVER BUDGET' if over else ''}")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,122 @@
+import argparse
+import json
+import os
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+# Check of the concurrent NewsAPI fetcher against a local stub server, reached
+# through NEWSAPI_BASE_URL like a real deployment would point it elsewhere.
+# The stub always fails one category (partial failure), answers another with
+# 429 + Retry-After and a third with a 503 before succeeding (retries), and
+# records when every request arrived and how many were in flight. Checks that
+# every other page arrives, that the failed one is reported, that concurrent
+# requests overlap, and that retries are rate limited with the first attempts.
+#   python -m benchmarks.stub_newsapi --rate 20 --burst 5 --workers 4
+
+ARTICLES_PER_PAGE = 10
+# category -> (status of the first failing attempts, how many attempts fail); -1 fails every attempt
+FAILURES = {'health': (500, -1), 'science': (429, 2), 'sports': (503, 1)}
+
+
+class StubNewsAPI(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, total_results, delay):
+        super().__init__(('127.0.0.1', 0), StubHandler)
+        self.total_results = total_results
+        self.delay = delay
+        self.arrivals = []
+        self.attempts = Counter()
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.lock = threading.Lock()
+
+
+class StubHandler(BaseHTTPRequestHandler):
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        server = self.server
+        query = {key: values[0] for key, values in parse_qs(urlparse(self.path).query).items()}
+        category, page = query.get('category', 'general'), int(query.get('page', 1))
+        with server.lock:
+            server.arrivals.append(time.monotonic())
+            server.attempts[category, page] += 1
+            attempt = server.attempts[category, page]
+            server.in_flight += 1
+            server.max_in_flight = max(server.max_in_flight, server.in_flight)
+        try:
+            time.sleep(server.delay)
+            status, failing = FAILURES.get(category, (200, 0))
+            if failing == -1 or attempt <= failing:
+                self.send_response(status)
+                if status == 429:
+                    self.send_header('Retry-After', '0')
+                self.end_headers()
+                return
+            articles = [{
+                'title': f'{category} headline {page}-{i}',
+                'description': f'Summary of {category} story {page}-{i}',
+                'publishedAt': '2025-08-01T12:00:00Z',
+            } for i in range(ARTICLES_PER_PAGE)]
+            body = json.dumps({'status': 'ok', 'totalResults': server.total_results, 'articles': articles}).encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        finally:
+            with server.lock:
+                server.in_flight -= 1
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Check the NewsAPI fetcher against a local stub server.')
+    parser.add_argument('--pages', type=int, default=2, help='Pages per category')
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--rate', type=float, default=20, help='Requests per second')
+    parser.add_argument('--burst', type=int, default=5)
+    parser.add_argument('--delay', type=float, default=0.05, help='Stub response time in seconds')
+    args = parser.parse_args()
+
+    server = StubNewsAPI(args.pages * ARTICLES_PER_PAGE, args.delay)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    os.environ['NEWSAPI_BASE_URL'] = f'http://127.0.0.1:{server.server_address[1]}/v2/top-headlines'
+    # Imported after NEWSAPI_BASE_URL is set, as the module reads it once
+    from utils.ingest import NEWSAPI_CATEGORIES, MAX_RETRIES, RateLimiter, fetch_headlines
+
+    start = time.perf_counter()
+    try:
+        df, errors = fetch_headlines('stub-key', categories=NEWSAPI_CATEGORIES, page_size=ARTICLES_PER_PAGE,
+                                     max_pages=args.pages, workers=args.workers,
+                                     limiter=RateLimiter(args.rate, args.burst))
+    finally:
+        server.shutdown()
+    elapsed = time.perf_counter() - start
+
+    ok_categories = [c for c in NEWSAPI_CATEGORIES if FAILURES.get(c, (200, 0))[1] != -1]
+    arrivals = sorted(server.arrivals)
+    # With a bucket of `burst` tokens refilled at `rate`, request i cannot start before (i + 1 - burst) / rate
+    too_early = sum(t - arrivals[0] < (i + 1 - args.burst) / args.rate - 0.01 for i, t in enumerate(arrivals))
+    checks = {
+        'every other page arrives': df is not None and len(df) == len(ok_categories) * args.pages * ARTICLES_PER_PAGE,
+        'failed category reported': len(errors) == 1 and 'health' in errors[0],
+        'failed page retried': server.attempts['health', 1] == MAX_RETRIES + 1,
+        'requests overlap': 1 < server.max_in_flight <= args.workers,
+        'retries rate limited': too_early == 0,
+    }
+    print(f"{len(arrivals)} requests in {elapsed:.2f}s at {args.rate:g}/s (burst {args.burst}), "
+          f"{server.max_in_flight} in flight at most, {0 if df is None else len(df)} articles")
+    for name, passed in checks.items():
+        print(f"{name:<28}{'ok' if passed else 'FAILED'}")
+    if not all(checks.values()):
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+import numpy as np
+import pandas as pd
+from utils.article_store import compact_articles
+
+# Synthetic news corpora and interaction logs for the benchmarks. Users prefer a
+# few categories and, within a category, popular (low-numbered) articles, so both
+# the content and the collaborative recommenders have signal to find.
+
+START = pd.Timestamp('2025-01-01')
+
+
+def make_corpus(n_articles, n_categories=12, n_topics=8, seed=0):
+    """Articles shaped like load_articles() output, indexed by news_id."""
+    rng = np.random.default_rng(seed)
+    words = np.array([f'w{i}' for i in range(2000)])
+    categories = np.sort(rng.integers(0, n_categories, n_articles))
+    topics = rng.integers(0, n_topics, n_articles)
+    # Half of each title and summary comes from its category's own slice of the vocabulary
+    # (wrapping for many categories), so the text carries some of the same signal
+    def draw(n_words):
+        shared = rng.integers(0, len(words), (n_articles, n_words - n_words // 2))
+        own = (categories[:, None] * 100 + rng.integers(0, 100, (n_articles, n_words // 2))) % len(words)
+        return words[np.hstack([own, shared])]
+    title_words = draw(6)
+    summary_words = draw(20)
+    days = rng.integers(0, 365, n_articles)
+    df = pd.DataFrame({
+        'category': pd.Series([f'Category{c}' for c in categories]),
+        'title': [' '.join(row) for row in title_words],
+        'summary': [' '.join(row) for row in summary_words],
+        'topic': [f'c{c}topic{t}' for c, t in zip(categories, topics)],
+        'date': (START + pd.to_timedelta(days, unit='D')).strftime('%Y-%m-%d'),
+    }, index=pd.Index(np.arange(n_articles, dtype=np.int64), name='news_id'))
+    df.attrs['corpus_key'] = f'synthetic:{n_articles}:{n_categories}:{seed}'
+    return compact_articles(df)
+
+
+def make_logs(news_df, n_users, interactions_per_user=20, prefer=0.8, like_preferred=0.7,
+              like_other=0.2, days=365, seed=0):
+    """
+    Interaction log (user_id, news_id, action, timestamp) for n_users users.
+    Each user has a favourite category; a `prefer` share of their interactions
+    come from it and are liked with probability `like_preferred`.
+    """
+    rng = np.random.default_rng(seed + 1)
+    codes, uniques = pd.factorize(news_df['category'], sort=True)
+    order = np.argsort(codes, kind='stable')
+    counts = np.bincount(codes, minlength=len(uniques))
+    starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+
+    n = n_users * interactions_per_user
+    users = np.repeat(np.arange(n_users), interactions_per_user)
+    favourite = rng.integers(0, len(uniques), n_users)
+    preferred = rng.random(n) < prefer
+    category = np.where(preferred, favourite[users], rng.integers(0, len(uniques), n))
+    # Squaring skews picks towards the first (most popular) articles of a category
+    offset = (rng.random(n) ** 2 * counts[category]).astype(np.int64)
+    news_ids = news_df.index.to_numpy()[order[starts[category] + offset]]
+    liked = rng.random(n) < np.where(preferred, like_preferred, like_other)
+    seconds = rng.integers(0, days * 86400, n)
+    logs = pd.DataFrame({
+        'user_id': 'u' + pd.Series(users).astype(str),
+        'news_id': news_ids,
+        'action': np.where(liked, 'like', 'discard'),
+        'timestamp': (START + pd.to_timedelta(seconds, unit='s')).strftime('%Y-%m-%dT%H:%M:%S'),
+    })
+    return logs.sort_values('timestamp', kind='stable').reset_index(drop=True)
+
+
+def temporal_split(logs, holdout=0.2):
+    """Split at the timestamp below which (1 - holdout) of the interactions fall."""
+    cutoff = logs['timestamp'].sort_values().iloc[int(len(logs) * (1 - holdout))]
+    return logs[logs['timestamp'] < cutoff], logs[logs['timestamp'] >= cutoff]
@@ -0,0 +1,94 @@
+import argparse
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from recommend import batch_recommend, BATCH_BLOCK_SIZE
+from utils.log_store import get_log_store
+from utils.log_stream import get_log_aggregates
+from utils.interaction_matrix import get_interaction_matrix, INTERACTION_MATRIX_PATH
+from utils.article_model import get_article_model
+from utils.user_profiles import get_user_profiles
+from utils.neighbors import get_neighbor_index
+from utils.embeddings import get_article_embeddings
+from utils.factorization import train_factor_model
+from utils.rec_store import get_recommendation_store
+from utils.article_store import corpus_key, load_articles, NEWS_PATH, NEWS_COLUMNS
+
+# Offline job: warm the feeds of every active user and store them for the app.
+#   python precompute.py --workers 4
+#   python precompute.py --train-factors   # retrain the factor model (warm start) first
+#   python precompute.py --active-days 30  # only users who interacted in the last 30 days
+
+_news_df = None
+
+
+def _init_worker(news_df):
+    global _news_df
+    _news_df = news_df
+
+
+def _score_block(user_ids, top_n):
+    # Versions are read first so a like made while scoring marks the feed stale
+    store = get_log_store()
+    versions = {user_id: store.version(user_id) for user_id in user_ids}
+    results = batch_recommend(user_ids, _news_df, top_n)
+    feeds = {}
+    for user_id, (recs, explanations) in results.items():
+        feeds[user_id] = (versions[user_id], list(zip(recs.index.tolist(), explanations)))
+    return feeds
+
+
+def precompute(news_df, user_ids=None, top_n=5, workers=None, block_size=BATCH_BLOCK_SIZE, train_factors=False,
+               active_days=None):
+    """
+    Score users in blocks across a process pool and write their feeds to the
+    recommendation store. With `active_days`, only users whose latest
+    interaction is that recent are scored. Returns the number of users written.
+    """
+    store = get_log_store()
+    if train_factors:
+        train_factor_model(store)
+    if user_ids is None:
+        user_ids = store.user_ids()
+    # One streamed pass gives per-user activity and the co-like counts the workers inherit
+    aggregates = get_log_aggregates(store)
+    if active_days is not None:
+        stats = aggregates.user_stats
+        active = set(stats.index[stats['last_ts'] >= time.time() - active_days * 86400].astype(str))
+        user_ids = [user_id for user_id in user_ids if str(user_id) in active]
+    # Build every shared model once in this process before the pool starts: forked workers
+    # inherit them, and the snapshots written here let spawned workers start from disk
+    model = get_article_model(news_df)
+    get_article_embeddings(news_df)
+    get_user_profiles(model, store)
+    matrix = get_interaction_matrix(store)
+    matrix.save(INTERACTION_MATRIX_PATH)
+    get_neighbor_index(matrix, store)
+
+    blocks = [user_ids[i:i + block_size] for i in range(0, len(user_ids), block_size)]
+    rec_store = get_recommendation_store()
+    written = 0
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(news_df,)) as pool:
+        for feeds in pool.map(_score_block, blocks, [top_n] * len(blocks)):
+            rec_store.write_many(feeds, corpus_key=corpus_key(news_df))
+            written += len(feeds)
+    return written
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Precompute recommendation feeds for active users.')
+    parser.add_argument('--users', nargs='*', help='Only these user ids (default: every user in the log)')
+    parser.add_argument('--top-n', type=int, default=5)
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--block-size', type=int, default=BATCH_BLOCK_SIZE)
+    parser.add_argument('--train-factors', action='store_true', help='Retrain the factor model before scoring')
+    parser.add_argument('--active-days', type=int, default=None, help='Only users active in this many days')
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    news_df = load_articles(NEWS_PATH, columns=NEWS_COLUMNS, on_error=print)
+    if news_df is None:
+        raise SystemExit(f"Could not load {NEWS_PATH}")
+    written = precompute(news_df, args.users, args.top_n, args.workers, args.block_size, args.train_factors,
+                         args.active_days)
+    print(f"Precomputed feeds for {written} users in {time.perf_counter() - start:.1f}s")
@@ -1,119 +1,169 @@
 import pandas as pd
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import linear_kernel
 import numpy as np
-import os
+import threading
+from utils.log_store import get_log_store, empty_logs, compact_logs
+from utils.interaction_matrix import InteractionMatrix, get_interaction_matrix, refresh_interaction_matrix
+from utils.log_stream import get_log_aggregates
+from utils.neighbors import ExactNeighborIndex, get_neighbor_index
+from utils.factorization import get_factor_model
+from utils.article_model import get_article_model
+from utils.embeddings import get_article_embeddings
+from utils.user_profiles import get_user_profiles, refresh_user_profiles
+from utils.analytics import get_user_analytics, refresh_user_analytics
+from utils.article_store import corpus_key
+from utils.rec_store import get_recommendation_store
+from utils.rec_cache import get_recommendation_cache, invalidate_user_recommendations
+from utils.ranking import select_diverse
+from utils.recency_index import get_recency_index
+from utils.instrument import span
 
-USER_LOGS_PATH = os.path.join('user_logs', 'user_logs.csv')
+# Number of similar users whose likes feed collaborative recommendations
+COLLAB_NEIGHBORS = 2
 
-# Helper: Load user logs
+# Users scored together by batch_recommend
+BATCH_BLOCK_SIZE = 256
+
+# Memory for the dense users x articles content scores batch_recommend holds at once
+SCORE_BLOCK_BYTES = 32 * 2**20
+
+# Helper: Load user logs (a single user's rows are read through the store's user_id index).
+# The whole log comes back with compact typed columns; one user's few rows are returned as read.
+@span('recommend.load_user_logs')
 def load_user_logs(user_id=None):
-    if os.path.exists(USER_LOGS_PATH):
-        logs = pd.read_csv(USER_LOGS_PATH)
-        if user_id is not None:
-            return logs[logs['user_id'] == user_id]
-        return logs
-    else:
-        return pd.DataFrame(columns=['user_id', 'news_id', 'action', 'timestamp'])
+    logs = get_log_store().load(user_id)
+    return compact_logs(logs) if user_id is None else logs
 
-# Helper: Save a new user interaction
+# Helper: Save a new user interaction (appended, the existing history is not rewritten)
+@span('recommend.save_user_log')
 def save_user_log(user_id, news_id, action, timestamp):
-    logs = load_user_logs()
-    new_log = pd.DataFrame([[user_id, news_id, action, timestamp]], columns=['user_id', 'news_id', 'action', 'timestamp'])
-    all_logs = pd.concat([logs, new_log], ignore_index=True)
-    all_logs.to_csv(USER_LOGS_PATH, index=False)
+    store = get_log_store()
+    store.append(user_id, news_id, action, timestamp)
+    refresh_interaction_matrix(store)
+    refresh_user_profiles(store)
+    refresh_user_analytics(store)
+    invalidate_user_recommendations(user_id)
+
+# Helper: Per-user analytics (articles first seen, liked categories and topics) over a date range, from the rollups
+@span('recommend.load_user_analytics')
+def load_user_analytics(user_id, news_df, start=None, end=None):
+    return get_user_analytics(news_df, get_log_store()).summary(user_id, start, end)
+
+# Helper: Likes, discards and newly seen articles per month (or day) over a date range, from the rollups
+@span('recommend.load_user_activity')
+def load_user_activity(user_id, news_df, start=None, end=None, period='month'):
+    return get_user_analytics(news_df, get_log_store()).timeline(user_id, start, end, period)
 
 # Get user preferences from logs
 def get_user_preferences(user_logs, news_df):
     liked = user_logs[user_logs['action'] == 'like']
     if liked.empty:
         return []
-    liked_news = news_df.iloc[liked['news_id'].astype(int)]
-    topics = liked_news['topic'].tolist()
-    categories = liked_news['category'].tolist()
+    liked_ids = liked['news_id'].astype(int)
+    # Only the two columns needed are gathered, not whole article rows
+    positions = news_df.index.get_indexer(liked_ids[liked_ids.isin(news_df.index)])
+    topics = news_df['topic'].iloc[positions].tolist()
+    categories = news_df['category'].iloc[positions].tolist()
     return topics + categories
 
 # --- Collaborative Filtering ---
-def collaborative_recommend(user_id, news_df, logs_df, top_n=5):
-    # Build user-item matrix (users x news)
-    user_ids = logs_df['user_id'].unique()
-    news_ids = news_df.index
-    user_item = pd.DataFrame(0, index=user_ids, columns=news_ids)
-    for _, row in logs_df.iterrows():
-        if row['action'] == 'like':
-            user_item.at[row['user_id'], int(row['news_id'])] = 1
-        # Implicit feedback: simulate time spent (if available)
-        # You can extend this to use a 'time_spent' column
-    # Compute user-user similarity
-    if user_id not in user_item.index:
+@span('recommend.collaborative')
+def collaborative_recommend(user_id, news_df, logs_df=None, top_n=5, n_neighbors=COLLAB_NEIGHBORS, similar_users=None):
+    # Sparse user-item matrix (users x news); kept up to date by save_user_log.
+    # Passing logs_df builds a one-off matrix from those rows instead.
+    # Discards and time spent are used by the factor model (factor_recommend)
+    if logs_df is None:
+        matrix = get_interaction_matrix(get_log_store())
+    else:
+        matrix = InteractionMatrix.from_logs(logs_df)
+    row = matrix.user_index.get(user_id)
+    if row is None:
+        return pd.DataFrame()
+    # Get top similar users (excluding self) from the neighbour index,
+    # unless the batch job already looked them up
+    if similar_users is None:
+        if logs_df is None:
+            index = get_neighbor_index(matrix, get_log_store())
+        else:
+            index = ExactNeighborIndex().build(matrix)
+        similar_users, _ = index.query(matrix, row, n_neighbors)
+    user_item = matrix.tocsr()
+    user_vec = user_item[row]
+    # Get news liked by similar users but not seen by current user,
+    # ranked by how strongly the similar users agree on them
+    scores = np.asarray(user_item[similar_users].sum(axis=0)).ravel()
+    scores[user_vec.indices] = 0
+    candidates = np.flatnonzero(scores)
+    order = candidates[np.argsort(-scores[candidates], kind='stable')]
+    recs = [matrix.item_ids[c] for c in order]
+    recs = [news_id for news_id in recs if news_id in news_df.index]
+    # Return top_n recommended news (only those rows are gathered)
+    if not recs:
         return pd.DataFrame()
-    user_vec = user_item.loc[user_id].values.reshape(1, -1)
-    all_vecs = user_item.values
-    sim = linear_kernel(user_vec, all_vecs).flatten()
-    # Get top similar users (excluding self)
-    similar_users = user_item.index[np.argsort(sim)[::-1][1:3]]  # top 2 similar users
-    # Get news liked by similar users but not seen by current user
-    seen = set(user_item.loc[user_id][user_item.loc[user_id] > 0].index)
-    recs = set()
-    for u in similar_users:
-        liked = set(user_item.loc[u][user_item.loc[u] > 0].index)
-        recs.update(liked - seen)
-    # Return top_n recommended news
-    recs = list(recs)
+    return news_df.loc[recs[:top_n]]
+
+# --- Co-liked Articles ---
+@span('recommend.colike')
+def colike_recommend(user_id, news_df, user_logs, top_n=5, aggregates=None):
+    # Articles most often liked together with the user's likes, from the streamed
+    # co-like counts (utils/log_stream.py); used when no similar user has new likes
+    aggregates = aggregates or get_log_aggregates(get_log_store())
+    liked = user_logs.loc[user_logs['action'] == 'like', 'news_id'].astype(int).tolist()
+    scores = aggregates.colike_scores(liked)
+    seen = set(user_logs['news_id'].astype(int))
+    recs = sorted((news_id for news_id in scores if news_id not in seen and news_id in news_df.index),
+                  key=lambda news_id: (-scores[news_id], news_id))
     if not recs:
         return pd.DataFrame()
-    return news_df.loc[recs].head(top_n)
+    return news_df.loc[recs[:top_n]]
+
+# --- Matrix Factorisation ---
+@span('recommend.factor')
+def factor_recommend(user_id, news_df, user_logs, top_n=5, model=None):
+    # Latent factors trained offline (python -m utils.factorization) from likes,
+    # discards and time spent; one dot product per article scores the user
+    model = model or get_factor_model()
+    if model is None:
+        return pd.DataFrame()
+    seen = user_logs['news_id'].astype(int).tolist()
+    # Ask for a few extra in case some items are no longer in the corpus
+    recs = model.recommend(user_id, top_n + 10, exclude=seen)
+    recs = [news_id for news_id in recs if news_id in news_df.index][:top_n]
+    if not recs:
+        return pd.DataFrame()
+    return news_df.loc[recs]
 
 # --- Content-Based Filtering ---
-def content_based_recommend(user_id, news_df, user_logs, top_n=5):
+@span('recommend.content_based')
+def content_based_recommend(user_id, news_df, user_logs, top_n=5, profiles=None, scores=None):
     prefs = get_user_preferences(user_logs, news_df)
     
-    # Ensure required columns exist
-    news_df = news_df.copy()
-    if 'date' not in news_df.columns:
-        import datetime
-        news_df['date'] = datetime.datetime.now().strftime('%Y-%m-%d')
+    # Articles sorted newest first within each category, built once per corpus
+    recency = get_recency_index(news_df)
     
     # If no preferences yet, return a diverse set of recent articles from different categories
     if not prefs:
-        # Get the most recent article from each category
-        diverse_recs = pd.DataFrame()
-        for category in news_df['category'].unique():
-            category_news = news_df[news_df['category'] == category].sort_values('date', ascending=False).head(1)
-            diverse_recs = pd.concat([diverse_recs, category_news])
-        
-        # If we still need more recommendations, add more recent articles
-        if len(diverse_recs) < top_n:
-            # Exclude categories we already have
-            existing_categories = set(diverse_recs['category'])
-            remaining = news_df[~news_df['category'].isin(existing_categories)].sort_values('date', ascending=False)
-            diverse_recs = pd.concat([diverse_recs, remaining.head(top_n - len(diverse_recs))])
-        
-        # Ensure we don't exceed top_n
-        diverse_recs = diverse_recs.head(top_n)
+        # Get the most recent article from each category (every category is used at most once)
+        picks = [rows[0] for rows in recency.latest_per_category(1).values()][:top_n]
+        diverse_recs = news_df.iloc[picks]
         return diverse_recs, ["Recent article from " + cat for cat in diverse_recs['category']]
     
-    # Create content field for TF-IDF
-    if 'topic' not in news_df.columns:
-        news_df['topic'] = news_df['category']
-    
-    # Combine features for content-based filtering
-    news_df['content_features'] = news_df['topic'].astype(str) + ' ' + news_df['category'].astype(str)
+    # Similarity of title/summary embeddings to the articles the user liked: one dense
+    # product over EMBEDDING_DIM columns, with the user's vector kept between calls.
+    # TF-IDF over topic + category (kept up to date by save_user_log) is the fallback
+    # when none of the liked articles has an embedding
+    if scores is None:
+        liked_ids = user_logs.loc[user_logs['action'] == 'like', 'news_id'].astype(int)
+        scores = get_article_embeddings(news_df).user_scores(liked_ids, user_id)
+    if scores is None or len(scores) != len(news_df):
+        if profiles is None:
+            profiles = get_user_profiles(get_article_model(news_df), get_log_store())
+        scores = profiles.scores(user_id)
+    cosine_sim = scores
     
-    # Apply TF-IDF
-    tfidf = TfidfVectorizer()
-    tfidf_matrix = tfidf.fit_transform(news_df['content_features'])
-    user_profile = ' '.join(prefs)
-    user_vec = tfidf.transform([user_profile])
-    cosine_sim = linear_kernel(user_vec, tfidf_matrix).flatten()
-    
-    # Filter out seen articles
+    # Filter out seen articles (scores stay a separate array so news_df is never copied)
     seen_ids = user_logs['news_id'].astype(int).tolist()
-    news_df['score'] = cosine_sim
     
     # Get recommendations with category diversity
-    # First, get top scored articles for each category
-    recs = pd.DataFrame()
     categories = news_df['category'].unique()
     
     # Prioritize categories based on user preferences
@@ -128,60 +178,55 @@ def content_based_recommend(user_id, news_df, user_logs, top_n=5):
         sorted_categories = list(categories)
         random.shuffle(sorted_categories)
     
-    # Select top article from each category until we reach top_n
-    for category in sorted_categories:
-        if len(recs) >= top_n:
-            break
-        
-        # Get top scored unseen articles from this category
-        category_recs = news_df[(news_df['category'] == category) & 
-                               (~news_df.index.isin(seen_ids))].sort_values('score', ascending=False).head(1)
-        
-        if not category_recs.empty:
-            recs = pd.concat([recs, category_recs])
-    
-    # If we still need more recommendations, add more top scored articles
-    if len(recs) < top_n:
-        remaining = news_df[~news_df.index.isin(seen_ids) & ~news_df.index.isin(recs.index)].sort_values('score', ascending=False)
-        recs = pd.concat([recs, remaining.head(top_n - len(recs))])
+    # Select the top scored unseen article from each category until we reach top_n,
+    # then add more top scored unseen articles
+    unseen = ~news_df.index.isin(seen_ids)
+    picks = select_diverse(news_df['category'], cosine_sim, top_n,
+                           category_order=sorted_categories, mask=unseen)
+    recs = news_df.iloc[picks]
     
     # Generate explanations
     explanations = [f"Matched topics/categories: {prefs}" for _ in range(len(recs))]
     
     # Fallback to recent articles if no recommendations
     if recs.empty:
-        recs = news_df.sort_values('date', ascending=False).head(top_n)
+        recs = news_df.iloc[recency.latest(top_n)]
         explanations = ["Most recent articles"] * top_n
         
     return recs, explanations
 
 # --- Hybrid Recommendation ---
-def hybrid_recommend(user_id, news_df, top_n=5):
-    logs_df = load_user_logs()
-    user_logs = logs_df[logs_df['user_id'] == user_id]
+@span('recommend.hybrid')
+def hybrid_recommend(user_id, news_df, top_n=5, user_logs=None, content_scores=None, similar_users=None):
+    # batch_recommend passes in the user's logs and precomputed scores
+    if user_logs is None:
+        user_logs = load_user_logs(user_id)
     
     # Check if user has any interactions yet
     user_has_interactions = not user_logs.empty
     
     # If user has no interactions, return diverse set of news from different categories
     if not user_has_interactions:
-        # Get one article from each category
-        diverse_recs = pd.DataFrame()
-        for category in news_df['category'].unique():
-            category_news = news_df[news_df['category'] == category].sample(1)
-            diverse_recs = pd.concat([diverse_recs, category_news])
-        
-        # Ensure we don't exceed top_n
-        diverse_recs = diverse_recs.sample(min(len(diverse_recs), top_n))
+        # Get one random article from each category, then at most top_n of them
+        sampled = get_recency_index(news_df).random_per_category(1)
+        picks = np.array([rows[0] for rows in sampled.values()], dtype=np.int64)
+        picks = np.random.choice(picks, size=min(len(picks), top_n), replace=False) if len(picks) else picks
+        diverse_recs = news_df.iloc[picks]
         explanations = [f"Featured article from {row.category}" for _, row in diverse_recs.iterrows()]
         return diverse_recs, explanations
     
-    # Try collaborative filtering first
-    collab_recs = collaborative_recommend(user_id, news_df, logs_df, top_n)
+    # Try collaborative filtering first: the factor model when it knows the user, otherwise similar users' likes
+    collab_recs = factor_recommend(user_id, news_df, user_logs, top_n)
+    if collab_recs.empty:
+        collab_recs = collaborative_recommend(user_id, news_df, top_n=top_n, similar_users=similar_users)
+    reason = "Other users with similar likes also liked this"
+    if collab_recs.empty:
+        collab_recs = colike_recommend(user_id, news_df, user_logs, top_n)
+        reason = "Often liked together with articles you liked"
     explanations = []
     
     if not collab_recs.empty:
-        explanations = ["Other users with similar likes also liked this"] * len(collab_recs)
+        explanations = [reason] * len(collab_recs)
         
         # Check if we have diverse categories in collaborative recommendations
         collab_categories = collab_recs['category'].unique()
@@ -193,14 +238,14 @@ def hybrid_recommend(user_id, news_df, top_n=5):
             explanations = explanations[:2]
             
             # Fill the rest with content-based from different categories
-            cb_recs, cb_expl = content_based_recommend(user_id, news_df, user_logs, top_n - len(collab_recs))
+            cb_recs, cb_expl = content_based_recommend(user_id, news_df, user_logs, top_n - len(collab_recs), scores=content_scores)
             recs = pd.concat([collab_recs, cb_recs]).head(top_n)
             explanations += cb_expl
             return recs, explanations
         
         # Fill up with content-based if not enough
         if len(collab_recs) < top_n:
-            cb_recs, cb_expl = content_based_recommend(user_id, news_df, user_logs, top_n - len(collab_recs))
+            cb_recs, cb_expl = content_based_recommend(user_id, news_df, user_logs, top_n - len(collab_recs), scores=content_scores)
             recs = pd.concat([collab_recs, cb_recs]).head(top_n)
             explanations += cb_expl
             return recs, explanations
@@ -208,4 +253,105 @@ def hybrid_recommend(user_id, news_df, top_n=5):
         return collab_recs, explanations
     
     # Fallback to content-based
-    return content_based_recommend(user_id, news_df, user_logs, top_n)
\ No newline at end of file
+    return content_based_recommend(user_id, news_df, user_logs, top_n, scores=content_scores)
+
+# --- Batch Recommendation ---
+@span('recommend.batch')
+def batch_recommend(user_ids, news_df, top_n=5, block_size=BATCH_BLOCK_SIZE):
+    """
+    Recommend for many users at once. Models are loaded once; logs and
+    similar users are fetched per block of users, the latter with a sparse
+    matrix product, and content scores per slice of a block that fits
+    SCORE_BLOCK_BYTES, with one dense product against the article embeddings.
+    Returns {user_id: (recs, explanations)}.
+    """
+    store = get_log_store()
+    matrix = get_interaction_matrix(store)
+    index = get_neighbor_index(matrix, store)
+    embeddings = get_article_embeddings(news_df)
+    no_logs = compact_logs(empty_logs())
+    score_rows = max(1, SCORE_BLOCK_BYTES // (embeddings.vectors.shape[0] * embeddings.vectors.dtype.itemsize or 1))
+    results = {}
+    for start in range(0, len(user_ids), block_size):
+        block = list(user_ids[start:start + block_size])
+        # Only this block's history is loaded, never the whole log;
+        # compact_logs keys users by str(user_id), and a CSV log reads numeric ids as ints
+        logs_by_user = dict(tuple(compact_logs(store.load_users(block)).groupby('user_id', observed=True)))
+        logs_by_user = {user_id: logs_by_user.get(str(user_id), no_logs) for user_id in block}
+        known = [user_id for user_id in block if user_id in matrix.user_index]
+        neighbors = index.query_many(matrix, [matrix.user_index[user_id] for user_id in known], COLLAB_NEIGHBORS)
+        neighbors = dict(zip(known, neighbors))
+        for lo in range(0, len(block), score_rows):
+            users = block[lo:lo + score_rows]
+            user_vecs = {}
+            for user_id in users:
+                logs = logs_by_user[user_id]
+                vec = embeddings.user_vector(logs.loc[logs['action'] == 'like', 'news_id'].astype(int), user_id)
+                if vec is not None:
+                    user_vecs[user_id] = vec
+            # Users without a liked article that has an embedding are scored by content_based_recommend
+            scored = list(user_vecs)
+            content_scores = np.array([user_vecs[u] for u in scored]) @ embeddings.vectors.T if scored else None
+            columns = {user_id: i for i, user_id in enumerate(scored)}
+            for user_id in users:
+                results[user_id] = hybrid_recommend(
+                    user_id, news_df, top_n,
+                    user_logs=logs_by_user[user_id],
+                    content_scores=content_scores[columns[user_id]] if user_id in columns else None,
+                    similar_users=neighbors.get(user_id),
+                )
+    return results
+
+# Helper: Precomputed feed for a user, or None if it is missing or out of date
+@span('recommend.load_precomputed')
+def load_precomputed_recommend(user_id, news_df, top_n=5, log_version=None):
+    if log_version is None:
+        log_version = get_log_store().version(user_id)
+    items = get_recommendation_store().load(user_id, log_version=log_version, corpus_key=corpus_key(news_df))
+    if not items:
+        return None
+    news_ids = [news_id for news_id, _ in items[:top_n]]
+    if not all(news_id in news_df.index for news_id in news_ids):
+        return None
+    return news_df.loc[news_ids], [expl for _, expl in items[:top_n]]
+
+# Serve the feed from the in-process cache; on a miss use the precomputed feed
+# when it is current, otherwise compute it inline
+@span('recommend.get_recommendations')
+def get_recommendations(user_id, news_df, top_n=5):
+    log_version = get_log_store().version(user_id)
+    def compute():
+        precomputed = load_precomputed_recommend(user_id, news_df, top_n, log_version)
+        if precomputed is not None:
+            return precomputed
+        return hybrid_recommend(user_id, news_df, top_n)
+    return get_recommendation_cache().get(user_id, top_n, log_version, corpus_key(news_df), compute)
+
+# Helper: Build everything the feed needs (article model, embeddings, recency index, user profiles, similar-user index)
+@span('recommend.warm_up')
+def warm_up(news_df):
+    store = get_log_store()
+    get_user_profiles(get_article_model(news_df), store)
+    get_article_embeddings(news_df)
+    get_recency_index(news_df)
+    get_neighbor_index(get_interaction_matrix(store), store)
+    get_user_analytics(news_df, store)
+
+_warm_up_thread = None
+_warm_up_lock = threading.Lock()
+
+# Helper: Run warm_up and any extra preload callables once per process, in a background thread.
+# The shared models are guarded by their own locks, so a request that needs one
+# before the warm-up reaches it simply builds it (or waits for it) itself.
+def start_warm_up(news_df, extra=()):
+    global _warm_up_thread
+    with _warm_up_lock:
+        if _warm_up_thread is not None:
+            return _warm_up_thread
+        def run():
+            warm_up(news_df)
+            for preload in extra:
+                preload()
+        _warm_up_thread = threading.Thread(target=run, name='warm-up', daemon=True)
+        _warm_up_thread.start()
+        return _warm_up_thread
@@ -0,0 +1,113 @@
+import threading
+import pandas as pd
+from utils.article_store import corpus_key
+from utils.instrument import span
+from utils.rollups import get_rollup_store
+
+# Number of topics shown as "Top 3 Topics"
+TOP_TOPICS = 3
+
+
+class UserAggregates:
+    """Precomputed analytics for one user and date range, shared by the sidebar and the dashboard."""
+
+    def __init__(self, version, new_seen, most_liked_category, top_topics, category_counts, topic_counts,
+                 discard_counts):
+        self.version = version
+        # Articles first seen within the range; over all time, every article seen
+        self.new_seen = new_seen
+        self.most_liked_category = most_liked_category
+        self.top_topics = top_topics
+        # Liked articles per category / non-numeric topic and discards per category, most frequent first
+        self.category_counts = category_counts
+        self.topic_counts = topic_counts
+        self.discard_counts = discard_counts
+
+
+def _ranked(totals):
+    """Counts by key, most frequent first, ties going to the most recent interaction."""
+    totals = totals.sort_values(['count', 'last_ts', 'last_id'], ascending=False, kind='stable')
+    return pd.Series(totals['count'].to_numpy(), index=totals['key'].to_numpy(), dtype='int64')
+
+
+class UserAnalyticsStore:
+    """
+    Per-user analytics over any date range, answered from the interaction
+    rollups (utils/rollups.py) rather than the raw log. New interactions are
+    folded into the rollups on refresh; summaries are memoised per
+    (user, range) until the rollups move on.
+    """
+
+    def __init__(self, news_df, rollups):
+        self.corpus_key = corpus_key(news_df)
+        self.rollups = rollups
+        self.version = rollups.version()
+        self._news_df = news_df
+        self._summaries = {}
+        self._lock = threading.Lock()
+
+    def refresh(self, store):
+        """Fold log rows written since the rollups' version into them."""
+        self.rollups.refresh(store, self._news_df)
+        version = self.rollups.version()
+        with self._lock:
+            if version != self.version:
+                self.version = version
+                self._summaries.clear()
+
+    @span('analytics.summary')
+    def summary(self, user_id, start=None, end=None):
+        """UserAggregates for the user over the dates start..end (None for no bound)."""
+        with self._lock:
+            cached = self._summaries.get((user_id, start, end))
+            if cached is not None:
+                return cached
+            totals = self.rollups.totals(user_id, start, end)
+            by_metric = {metric: rows for metric, rows in totals.groupby('metric', sort=False)}
+            empty = totals.iloc[:0]
+            likes = by_metric.get('like', empty)
+            category_counts = _ranked(likes)
+            topic_counts = _ranked(by_metric.get('topic', empty))
+            top = topic_counts if not topic_counts.empty else category_counts
+            latest = likes.sort_values(['last_ts', 'last_id'], kind='stable')['key']
+            summary = UserAggregates(
+                version=self.version,
+                new_seen=int(by_metric.get('new', empty)['count'].sum()),
+                most_liked_category=latest.iloc[-1] if len(latest) else None,
+                top_topics=top.index[:TOP_TOPICS].tolist(),
+                category_counts=category_counts,
+                topic_counts=topic_counts,
+                discard_counts=_ranked(by_metric.get('discard', empty)),
+            )
+            self._summaries[(user_id, start, end)] = summary
+            return summary
+
+    def timeline(self, user_id, start=None, end=None, period='month'):
+        """Likes, discards and newly seen articles per day or month (see RollupStore.timeline)."""
+        return self.rollups.timeline(user_id, start, end, period)
+
+
+_analytics = None
+_analytics_lock = threading.Lock()
+
+
+@span('analytics.get')
+def get_user_analytics(news_df, store):
+    """
+    Return the process-wide analytics store, caught up with the log store.
+    Rollups keep the categories and topics articles had when they were
+    rolled up, so a new corpus only changes how new interactions are counted.
+    """
+    global _analytics
+    with _analytics_lock:
+        if _analytics is None or _analytics.corpus_key != corpus_key(news_df):
+            _analytics = UserAnalyticsStore(news_df, get_rollup_store())
+        _analytics.refresh(store)
+        return _analytics
+
+
+def refresh_user_analytics(store):
+    """Fold new log rows into the rollups if this process has analytics loaded."""
+    if _analytics is not None:
+        with _analytics_lock:
+            _analytics.refresh(store)
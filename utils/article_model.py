@@ -0,0 +1,170 @@
+import json
+import os
+import threading
+import time
+import weakref
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+from utils.instrument import span
+
+# scikit-learn is imported where it is used: it dominates the import time of
+# recommend.py and is only needed once the article model is built or loaded.
+
+ARTICLE_MODEL_DIR = os.path.join('data', 'article_model')
+
+# Refit from scratch once this fraction of tokens in appended articles is out of vocabulary
+REFIT_DRIFT = 0.2
+
+
+def content_features(news_df):
+    """Text that the article model vectorises: topic (or category) plus category."""
+    topic = news_df['topic'] if 'topic' in news_df.columns else news_df['category']
+    return topic.astype(str) + ' ' + news_df['category'].astype(str)
+
+
+def row_hashes(news_df):
+    """Per-article hash of the index and feature text, used to match a frame to a fitted model."""
+    return pd.util.hash_pandas_object(content_features(news_df), index=True).to_numpy()
+
+
+class ArticleModel:
+    """
+    TF-IDF model of the article corpus, equivalent to TfidfVectorizer().fit_transform
+    on content_features(). Term counts and document frequencies are kept so new
+    articles can be appended and re-weighted without re-tokenising the corpus.
+    """
+
+    def __init__(self, vocabulary, counts, hashes, news_ids, oov_tokens=0, new_tokens=0):
+        self.vocabulary = vocabulary
+        self.counts = counts.tocsr()
+        self.hashes = hashes
+        # news_id of each row, so article ids can be mapped to matrix rows
+        self.news_index = pd.Index(news_ids)
+        # Token totals for articles appended since the last full fit
+        self.oov_tokens = oov_tokens
+        self.new_tokens = new_tokens
+        from sklearn.feature_extraction.text import CountVectorizer
+        self._vectorizer = CountVectorizer(vocabulary=vocabulary)
+        self._reweight()
+
+    def _reweight(self):
+        from sklearn.preprocessing import normalize
+        n_docs = self.counts.shape[0]
+        doc_freq = np.bincount(self.counts.indices, minlength=len(self.vocabulary))
+        # Same smoothed idf as sklearn's TfidfTransformer
+        self.idf = np.log((1 + n_docs) / (1 + doc_freq)) + 1
+        self.matrix = normalize(self.counts.multiply(self.idf).tocsr())
+
+    @property
+    def drift(self):
+        return self.oov_tokens / self.new_tokens if self.new_tokens else 0.0
+
+    @classmethod
+    def fit(cls, news_df):
+        from sklearn.feature_extraction.text import CountVectorizer
+        vectorizer = CountVectorizer()
+        counts = vectorizer.fit_transform(content_features(news_df))
+        return cls(vectorizer.vocabulary_, counts, row_hashes(news_df), news_df.index)
+
+    def positions(self, news_ids):
+        """Matrix rows of the given news ids (-1 for unknown ids)."""
+        return self.news_index.get_indexer(news_ids)
+
+    def transform(self, texts):
+        """TF-IDF vectors for arbitrary text in this model's feature space."""
+        from sklearn.preprocessing import normalize
+        return normalize(self._vectorizer.transform(texts).multiply(self.idf).tocsr())
+
+    def transform_counts(self, texts):
+        return self._vectorizer.transform(texts)
+
+    def extend(self, new_df):
+        """Append articles using the current vocabulary and refresh the idf weights."""
+        texts = content_features(new_df)
+        analyzer = self._vectorizer.build_analyzer()
+        for text in texts:
+            tokens = analyzer(text)
+            self.new_tokens += len(tokens)
+            self.oov_tokens += sum(token not in self.vocabulary for token in tokens)
+        self.counts = sp.vstack([self.counts, self.transform_counts(texts)]).tocsr()
+        self.hashes = np.concatenate([self.hashes, row_hashes(new_df)])
+        self.news_index = self.news_index.append(new_df.index)
+        self._reweight()
+        return self
+
+    def save(self, path=ARTICLE_MODEL_DIR):
+        """
+        Write the model under fresh file names and then switch meta.json to
+        them, as utils/embeddings.py does; older files are removed.
+        """
+        os.makedirs(path, exist_ok=True)
+        tag = time.time_ns()
+        files = {name: f'{name}-{tag}.npy' for name in ('idf', 'hashes', 'news_ids')}
+        files['vocabulary'] = f'vocabulary-{tag}.json'
+        files['counts'] = f'counts-{tag}.npz'
+        with open(os.path.join(path, files['vocabulary']), 'w') as f:
+            json.dump({term: int(col) for term, col in self.vocabulary.items()}, f)
+        np.save(os.path.join(path, files['idf']), self.idf)
+        np.save(os.path.join(path, files['hashes']), self.hashes)
+        np.save(os.path.join(path, files['news_ids']), self.news_index.to_numpy())
+        sp.save_npz(os.path.join(path, files['counts']), self.counts)
+        meta_path = os.path.join(path, 'meta.json')
+        with open(meta_path + '.tmp', 'w') as f:
+            json.dump({'files': files, 'oov_tokens': self.oov_tokens, 'new_tokens': self.new_tokens}, f)
+        os.replace(meta_path + '.tmp', meta_path)
+        current = set(files.values())
+        for name in os.listdir(path):
+            if name != 'meta.json' and not name.endswith('.tmp') and name not in current:
+                os.remove(os.path.join(path, name))
+
+    @classmethod
+    def load(cls, path=ARTICLE_MODEL_DIR):
+        with open(os.path.join(path, 'meta.json')) as f:
+            meta = json.load(f)
+        files = {name: os.path.join(path, file) for name, file in meta['files'].items()}
+        with open(files['vocabulary']) as f:
+            vocabulary = json.load(f)
+        counts = sp.load_npz(files['counts'])
+        hashes = np.load(files['hashes'])
+        news_ids = np.load(files['news_ids'], allow_pickle=True)
+        return cls(vocabulary, counts, hashes, news_ids, meta['oov_tokens'], meta['new_tokens'])
+
+
+_model = None
+_model_frame = None
+_model_lock = threading.Lock()
+
+
+@span('article_model.get')
+def get_article_model(news_df):
+    """
+    Return the article model for news_df, fitting it only when needed.
+    A model whose articles are a prefix of news_df is extended with the new
+    rows; a full refit happens when the frame no longer matches or drift
+    crosses REFIT_DRIFT. Fitted and extended models are saved to disk.
+    """
+    global _model, _model_frame
+    with _model_lock:
+        # Shared frames are never modified in place, so the frame last matched needs no re-hashing
+        if _model is not None and _model_frame is not None and _model_frame() is news_df:
+            return _model
+        if _model is None and os.path.exists(os.path.join(ARTICLE_MODEL_DIR, 'meta.json')):
+            try:
+                _model = ArticleModel.load(ARTICLE_MODEL_DIR)
+            except (OSError, ValueError, KeyError):
+                _model = None
+        hashes = row_hashes(news_df)
+        if _model is not None and np.array_equal(_model.hashes, hashes):
+            _model_frame = weakref.ref(news_df)
+            return _model
+        n_known = 0 if _model is None else len(_model.hashes)
+        if _model is not None and n_known < len(hashes) and np.array_equal(_model.hashes, hashes[:n_known]):
+            _model.extend(news_df.iloc[n_known:])
+            if _model.drift > REFIT_DRIFT:
+                _model = ArticleModel.fit(news_df)
+        else:
+            _model = ArticleModel.fit(news_df)
+        _model.save(ARTICLE_MODEL_DIR)
+        _model_frame = weakref.ref(news_df)
+        return _model
@@ -0,0 +1,463 @@
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+import weakref
+import numpy as np
+import pandas as pd
+from utils.cleaner import CLEAN_BLOCK_SIZE, clean_news_data, clean_news_data_chunked, parse_dates
+from utils.dedup import DedupIndex, MinHashIndex, article_key
+from utils.file_lock import file_lock
+from utils.instrument import span
+
+NEWS_PATH = os.path.join('data', 'news_dataset.csv')
+ARTICLE_CACHE_DIR = os.path.join('data', 'cache')
+# Ingested articles: immutable, append-only segment files plus the dedup index
+INGEST_DIR = os.path.join('data', 'ingested')
+DEDUP_INDEX_PATH = os.path.join(INGEST_DIR, 'dedup_index.txt')
+# Held by whichever process is allocating news_ids and appending a segment
+INGEST_LOCK_PATH = os.path.join(INGEST_DIR, 'ingest.lock')
+
+NEWS_COLUMNS = ['category', 'title', 'summary', 'topic', 'date']
+
+# Bumped whenever the layout of the Parquet cache changes
+CACHE_FORMAT = 4
+
+# Ingested segments read one by one before frame() folds them into the Parquet cache
+MAX_UNFOLDED_SEGMENTS = 16
+
+# Low-cardinality text columns kept as pandas categoricals
+CATEGORICAL_COLUMNS = ['category', 'topic']
+
+try:
+    import pyarrow  # noqa: F401
+    HAS_PARQUET = True
+except ImportError:
+    HAS_PARQUET = False
+
+
+def file_sha1(path):
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def read_news_csv(path, on_error=None):
+    """Parse the raw news dataset, falling back through more lenient parsers."""
+    try:
+        # Try with tab delimiter and Python engine to handle inconsistent field counts
+        return pd.read_csv(path, delimiter='\t', engine='python', on_bad_lines='skip')
+    except Exception as e:
+        if on_error:
+            on_error(f"Error loading data with tab delimiter: {e}")
+    try:
+        # Fallback to C engine with flexible field count
+        return pd.read_csv(path, delimiter='\t', engine='c', on_bad_lines='skip')
+    except Exception as e2:
+        if on_error:
+            on_error(f"Error loading data with fallback method: {e2}")
+    try:
+        # Last resort: try to infer delimiter
+        return pd.read_csv(path, sep=None, engine='python', on_bad_lines='skip')
+    except Exception as e3:
+        if on_error:
+            on_error(f"Failed to load data: {e3}")
+    return None
+
+
+def compact_articles(df):
+    """
+    Give cleaned articles compact, typed columns in place: categorical
+    category and topic, datetime64 dates (NaT when unparsable) and int32
+    news ids. Columns that are already compact are left untouched.
+    """
+    for col in CATEGORICAL_COLUMNS:
+        if col in df.columns and not isinstance(df[col].dtype, pd.CategoricalDtype):
+            df[col] = df[col].astype('category')
+    if 'date' in df.columns and not pd.api.types.is_datetime64_any_dtype(df['date']):
+        df['date'] = parse_dates(df['date'])
+    if 'news_id' in df.columns:
+        df['news_id'] = df['news_id'].astype(np.int32)
+    if df.index.name == 'news_id':
+        df.index = df.index.astype(np.int32)
+    return df
+
+
+_corpus_keys = {}
+_corpus_keys_lock = threading.Lock()
+
+
+def corpus_key(news_df):
+    """
+    Key identifying the articles of a frame, stable across processes: the
+    article store's source key for frames it built, otherwise a SHA-1 of the
+    frame's contents, computed once per frame.
+    """
+    key = news_df.attrs.get('corpus_key')
+    if key is not None:
+        return key
+    with _corpus_keys_lock:
+        cached = _corpus_keys.get(id(news_df))
+        if cached is not None and cached[0]() is news_df:
+            return cached[1]
+        row_hashes = pd.util.hash_pandas_object(news_df, index=True).to_numpy()
+        key = 'sha1:' + hashlib.sha1(row_hashes.tobytes()).hexdigest()
+        for frame_id in [frame_id for frame_id, (ref, _) in _corpus_keys.items() if ref() is None]:
+            del _corpus_keys[frame_id]
+        _corpus_keys[id(news_df)] = (weakref.ref(news_df), key)
+        return key
+
+
+def iter_news_csv(path, chunksize=CLEAN_BLOCK_SIZE):
+    """
+    Stream the raw news dataset in blocks of `chunksize` rows. Every column is
+    read as text so that blocks agree on dtypes (the dataset is all text).
+    """
+    yield from pd.read_csv(path, delimiter='\t', engine='python', on_bad_lines='skip',
+                           dtype=str, chunksize=chunksize)
+
+
+class ArticleStore:
+    """
+    Cleaned articles for one source file, cached as Parquet under
+    ARTICLE_CACHE_DIR and keyed on the source's SHA-1 and mtime. Parsing and
+    cleaning run once per source version; columns are read from the cache
+    only when a caller first asks for them and are then kept in memory, with
+    the compact column types of compact_articles().
+
+    Articles are indexed by a stable news_id: rows of the source file keep
+    their cleaned position as id, and ingested articles are appended as
+    segment files in `ingest_dir` with ids that continue from the largest one.
+    Segments are folded into the Parquet cache whenever it is rebuilt, and
+    once more than MAX_UNFOLDED_SEGMENTS of them are waiting; the segment
+    files stay, as the cache is rebuilt from them with the source.
+    """
+
+    def __init__(self, path=NEWS_PATH, cache_dir=ARTICLE_CACHE_DIR, ingest_dir=INGEST_DIR):
+        self.path = path
+        self.cache_dir = cache_dir
+        self.ingest_dir = ingest_dir
+        self.key = None
+        self._stat = None
+        self._meta = None
+        self._columns = {}
+        self._index = None
+        self._all_columns = []
+        self._segments = {}
+        self._frames = {}
+        self._lock = threading.RLock()
+
+    @property
+    def cache_name(self):
+        return os.path.splitext(os.path.basename(self.path))[0]
+
+    @property
+    def meta_path(self):
+        return os.path.join(self.cache_dir, f'{self.cache_name}.parquet.json')
+
+    def _cache_file(self, meta):
+        return os.path.join(self.cache_dir, meta['file'])
+
+    def _read_meta(self):
+        try:
+            with open(self.meta_path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _write_meta(self, meta):
+        # Renamed into place so a reader (or a crash) never leaves a partial file
+        tmp_path = f'{self.meta_path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(meta, f)
+        os.replace(tmp_path, self.meta_path)
+        self._meta = meta
+
+    def _write_cache(self, df, meta):
+        """
+        Write cleaned articles under a fresh file name, then switch the meta
+        file to it, so the articles and the segments folded into them change
+        together. Older files than the one replaced are removed.
+        """
+        os.makedirs(self.cache_dir, exist_ok=True)
+        name = f'{self.cache_name}-{time.time_ns()}.parquet'
+        tmp_path = os.path.join(self.cache_dir, name + '.tmp')
+        df.to_parquet(tmp_path)
+        os.replace(tmp_path, os.path.join(self.cache_dir, name))
+        previous = (self._read_meta() or {}).get('file')
+        self._write_meta(dict(meta, file=name, columns=list(df.columns), format=CACHE_FORMAT))
+        pattern = re.compile(rf'{re.escape(self.cache_name)}(-\d+)?\.parquet')
+        for other in os.listdir(self.cache_dir):
+            if pattern.fullmatch(other) and other not in (name, previous):
+                try:
+                    os.remove(os.path.join(self.cache_dir, other))
+                except FileNotFoundError:
+                    pass
+
+    def _with_segments(self, df, names):
+        """Cleaned articles (news_id as a column) followed by the given segments."""
+        if not names:
+            return df
+        parts = [df] + [self._segment(name).reset_index().reindex(columns=df.columns) for name in names]
+        return compact_articles(pd.concat(parts, ignore_index=True))
+
+    @span('article_store.clean')
+    def _clean_source(self, on_error, workers=1):
+        try:
+            return clean_news_data_chunked(iter_news_csv(self.path), workers=workers)
+        except Exception as e:
+            if on_error:
+                on_error(f"Error streaming data, reading it whole: {e}")
+        df = read_news_csv(self.path, on_error)
+        return None if df is None else clean_news_data(df)
+
+    def _rebuild(self, sha1, mtime_ns, on_error, workers=1):
+        df = self._clean_source(on_error, workers)
+        if df is None:
+            return None
+        df = df.reset_index(drop=True)
+        if 'news_id' not in df.columns:
+            df.insert(0, 'news_id', np.arange(len(df), dtype=np.int64))
+        df = compact_articles(df)
+        if HAS_PARQUET:
+            segments = self.segment_names()
+            self._write_cache(self._with_segments(df, segments),
+                              {'sha1': sha1, 'mtime_ns': mtime_ns, 'segments': segments})
+        return df
+
+    @span('article_store.fold')
+    def _fold(self, names):
+        """Append segments to the Parquet cache and record them as folded."""
+        df = pd.read_parquet(self._cache_file(self._meta))
+        self._write_cache(self._with_segments(df, names),
+                          dict(self._meta, segments=self._meta['segments'] + names))
+        self._columns = {}
+
+    def _refresh(self, on_error):
+        """Make sure the cache matches the source file; cheap when nothing changed."""
+        stat = os.stat(self.path)
+        stat_key = (stat.st_size, stat.st_mtime_ns)
+        if stat_key == self._stat:
+            return True
+        meta = self._read_meta() if HAS_PARQUET else None
+        if meta and (meta.get('format') != CACHE_FORMAT or not os.path.exists(self._cache_file(meta))):
+            meta = None
+        if meta and meta.get('mtime_ns') == stat.st_mtime_ns:
+            sha1 = meta['sha1']
+        else:
+            sha1 = file_sha1(self.path)
+        self._columns = {}
+        self._index = None
+        if meta and meta.get('sha1') == sha1:
+            self._meta = meta
+            self._all_columns = meta['columns']
+            if meta.get('mtime_ns') != stat.st_mtime_ns:
+                # Touched but unchanged: remember the new mtime to skip hashing next time
+                self._write_meta(dict(meta, mtime_ns=stat.st_mtime_ns))
+        else:
+            df = self._rebuild(sha1, stat.st_mtime_ns, on_error)
+            if df is None:
+                return False
+            self._all_columns = list(df.columns)
+            if not HAS_PARQUET:
+                # Without a disk cache, keep the cleaned frame in memory instead
+                self._columns = {col: df[col] for col in df.columns}
+                self._index = df.index
+        self.key = sha1
+        self._stat = stat_key
+        return True
+
+    def rebuild(self, workers=None, on_error=None):
+        """
+        Clean the source again and rewrite the cache, across `workers`
+        processes (one per CPU by default). For offline use; the app rebuilds
+        in-process when it finds the cache out of date.
+        """
+        with self._lock:
+            stat = os.stat(self.path)
+            df = self._rebuild(file_sha1(self.path), stat.st_mtime_ns, on_error, workers)
+            self._stat = None
+            self._frames = {}
+            return df
+
+    def _base_frame(self, wanted):
+        missing = [col for col in ['news_id'] + wanted if col not in self._columns]
+        if missing:
+            loaded = pd.read_parquet(self._cache_file(self._meta), columns=missing)
+            self._columns.update({col: loaded[col] for col in missing})
+        index = pd.Index(self._columns['news_id'].to_numpy(), name='news_id')
+        # .array keeps categoricals and datetimes as they are instead of materialising objects
+        return pd.DataFrame({col: self._columns[col].array for col in wanted}, index=index, copy=False)
+
+    def segment_names(self):
+        if not os.path.isdir(self.ingest_dir):
+            return []
+        return sorted(name for name in os.listdir(self.ingest_dir)
+                      if name.startswith('segment-') and name.endswith('.tsv'))
+
+    def _segment(self, name):
+        if name not in self._segments:
+            segment = pd.read_csv(os.path.join(self.ingest_dir, name), sep='\t', keep_default_na=False)
+            self._segments[name] = segment.set_index('news_id')
+        return self._segments[name]
+
+    def _build(self, wanted, segments):
+        unfolded = segments
+        if HAS_PARQUET:
+            folded = set(self._meta['segments'])
+            unfolded = [name for name in segments if name not in folded]
+            if len(unfolded) > MAX_UNFOLDED_SEGMENTS:
+                self._fold(unfolded)
+                unfolded = []
+        parts = [self._base_frame(wanted)]
+        parts += [self._segment(name).reindex(columns=wanted) for name in unfolded]
+        return compact_articles(pd.concat(parts)) if len(parts) > 1 else parts[0]
+
+    def frame(self, columns=None, on_error=None):
+        """
+        Cleaned articles indexed by news_id, with only the requested columns
+        (all by default). Returns None if the source could not be parsed.
+        The frame is shared between callers and must not be modified in place.
+        """
+        with self._lock:
+            if not self._refresh(on_error):
+                return None
+            segments = self.segment_names()
+            wanted = [col for col in (columns or self._all_columns) if col in self._all_columns and col != 'news_id']
+            version = (self.key, tuple(segments))
+            if self._frames.get('version') != version:
+                self._frames = {'version': version}
+            if tuple(wanted) not in self._frames:
+                try:
+                    df = self._build(wanted, segments)
+                except FileNotFoundError:
+                    # Another process folded segments and removed the cache file this one was reading
+                    self._stat = None
+                    if not self._refresh(on_error):
+                        return None
+                    df = self._build(wanted, segments)
+                df.attrs['corpus_key'] = f"{self.key}:{segments[-1] if segments else ''}"
+                self._frames[tuple(wanted)] = df
+            return self._frames[tuple(wanted)]
+
+    def append(self, new_articles):
+        """
+        Store new articles (indexed by news_id) as a new segment file. The file
+        is written under a temporary name and renamed into place, so readers
+        see either the whole segment or none of it.
+        """
+        with self._lock:
+            os.makedirs(self.ingest_dir, exist_ok=True)
+            name = f'segment-{time.time_ns()}.tsv'
+            path = os.path.join(self.ingest_dir, name)
+            tmp_path = path + '.tmp'
+            with open(tmp_path, 'w', newline='') as f:
+                new_articles.to_csv(f, sep='\t', index_label='news_id')
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, path)
+            return path
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_article_store(path=NEWS_PATH):
+    """Process-wide article store, shared by every Streamlit rerun and session."""
+    with _stores_lock:
+        if path not in _stores:
+            _stores[path] = ArticleStore(path)
+        return _stores[path]
+
+
+_dedup_index = None
+_minhash_index = None
+_minhash_max_id = -1
+_ingest_lock = threading.Lock()
+
+
+@span('article_store.ingest')
+def ingest_articles(df_api, path=NEWS_PATH, near_duplicates=False):
+    """
+    Clean only the newly fetched rows, drop exact duplicates of stored
+    articles (by normalised title + summary) and optionally near-duplicates
+    (MinHash), then append the rest as one segment with fresh news_ids.
+    Returns the appended articles. Other processes ingesting into the same
+    directory are kept out by a file lock, and their segments and dedup keys
+    are picked up once it is held.
+    """
+    global _dedup_index, _minhash_index, _minhash_max_id
+    store = get_article_store(path)
+    with _ingest_lock, file_lock(INGEST_LOCK_PATH):
+        corpus = store.frame(['title', 'summary'])
+        if _dedup_index is None:
+            if os.path.exists(DEDUP_INDEX_PATH):
+                _dedup_index = DedupIndex(DEDUP_INDEX_PATH)
+            else:
+                _dedup_index = DedupIndex.build(DEDUP_INDEX_PATH, corpus['title'], corpus['summary'])
+        else:
+            _dedup_index.reload()
+        new = clean_news_data(df_api.reindex(columns=NEWS_COLUMNS))
+        keys = [article_key(t, s) for t, s in zip(new['title'], new['summary'])]
+        keep = []
+        seen = set()
+        for key in keys:
+            keep.append(key not in _dedup_index and key not in seen)
+            seen.add(key)
+        new = new[keep]
+        keys = [key for key, kept in zip(keys, keep) if kept]
+        if near_duplicates and not new.empty:
+            if _minhash_index is None:
+                _minhash_index = MinHashIndex()
+            # Articles stored since the last call, by this process or another one
+            unindexed = corpus[corpus.index > _minhash_max_id]
+            for text in unindexed['title'] + ' ' + unindexed['summary']:
+                _minhash_index.add(_minhash_index.signature(text))
+            if len(corpus):
+                _minhash_max_id = max(_minhash_max_id, int(corpus.index.max()))
+            keep = []
+            for text in new['title'] + ' ' + new['summary']:
+                sig = _minhash_index.signature(text)
+                is_new = _minhash_index.query(sig) is None
+                if is_new:
+                    _minhash_index.add(sig)
+                keep.append(is_new)
+            new = new[keep]
+            keys = [key for key, kept in zip(keys, keep) if kept]
+        if new.empty:
+            return new
+        next_id = int(corpus.index.max()) + 1 if len(corpus) else 0
+        new.index = pd.Index(np.arange(next_id, next_id + len(new), dtype=np.int64), name='news_id')
+        store.append(new)
+        _dedup_index.add_many(keys)
+        if near_duplicates:
+            _minhash_max_id = int(new.index.max())
+        return new
+
+
+@span('article_store.load_articles')
+def load_articles(path=NEWS_PATH, columns=None, on_error=None):
+    """Load cleaned articles (only the given columns) through the process-wide cache."""
+    if not os.path.exists(path):
+        if on_error:
+            on_error(f"News dataset not found: {path}")
+        return None
+    return get_article_store(path).frame(columns, on_error)
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Rebuild the cleaned article cache offline.')
+    parser.add_argument('--path', default=NEWS_PATH)
+    parser.add_argument('--workers', type=int, default=None, help='Cleaning processes (default: one per CPU)')
+    args = parser.parse_args()
+    start = time.perf_counter()
+    df = get_article_store(args.path).rebuild(args.workers, on_error=print)
+    if df is None:
+        raise SystemExit(f"Could not clean {args.path}")
+    print(f"{len(df)} articles cached in {time.perf_counter() - start:.1f}s")
@@ -1,5 +1,29 @@
+import itertools
+import multiprocessing
+import os
+from collections import deque
 import pandas as pd
 
+def parse_dates(values, utc=False):
+    """
+    Parse dates to datetime64: ISO 8601 in one vectorised pass, then any
+    other format pandas can infer for the values that failed it. Values that
+    cannot be parsed at all become NaT.
+    """
+    values = pd.Series(values)
+    dates = pd.to_datetime(values, errors='coerce', format='ISO8601', utc=utc)
+    failed = dates.isna() & values.notna()
+    if failed.any():
+        retry = values[failed].astype(str).str.strip()
+        retry = retry[retry != '']
+        if len(retry):
+            parsed = pd.to_datetime(retry, errors='coerce', format='mixed', utc=utc)
+            if not utc and isinstance(parsed.dtype, pd.DatetimeTZDtype):
+                parsed = parsed.dt.tz_localize(None)
+            dates = dates.astype(parsed.dtype) if dates.isna().all() else dates
+            dates.loc[parsed.index] = parsed
+    return dates
+
 def clean_news_data(df):
     """
     Clean the news DataFrame by removing missing values, duplicates, and normalizing categories.
@@ -8,7 +32,7 @@ def clean_news_data(df):
     # Remove missing values
     df = df.dropna()
     # Remove duplicates
-    df = df.drop_duplicates()
+    df = df.drop_duplicates().copy()
     # Normalize category names (strip and title case)
     if 'category' in df.columns:
         df['category'] = df['category'].str.strip().str.title()
@@ -60,7 +84,99 @@ def clean_api_news(df):
             df[col] = 'General'
     # Remove missing values and duplicates
     df = df.dropna(subset=['title', 'summary', 'date'])
-    df = df.drop_duplicates(subset=['title', 'summary'])
+    df = df.drop_duplicates(subset=['title', 'summary']).copy()
     # Format date
     df['date'] = pd.to_datetime(df['date']).dt.date.astype(str)
-    return df
\ No newline at end of file
+    return df
+
+# --- Chunked, parallel cleaning ---
+# clean_news_data_chunked() applies the rules of clean_news_data() block by
+# block and gives the same result as running it once over all blocks
+# concatenated. Categories and topics are dictionary-encoded so each distinct
+# value is normalised once; duplicates are removed per block and then once more
+# across blocks on the raw values, keeping the first occurrence.
+
+CLEAN_BLOCK_SIZE = 200_000
+
+
+def _normalise_unique(values, transform):
+    codes, uniques = pd.factorize(values)
+    normalised = transform(pd.Series(uniques, dtype=values.dtype))
+    return pd.Series(normalised.to_numpy()[codes], index=values.index, dtype=normalised.dtype)
+
+
+def _clean_block(df, today):
+    """
+    Clean one block. Returns (cleaned, raw category, whether every filename
+    topic is numeric); the raw category is kept for the cross-block dedup.
+    """
+    df = df.dropna()
+    df = df.drop_duplicates().copy()
+    raw_category = None
+    if 'category' in df.columns:
+        raw_category = df['category']
+        df['category'] = _normalise_unique(raw_category, lambda s: s.str.strip().str.title())
+    if 'summary' not in df.columns and 'content' in df.columns:
+        df['summary'] = df['content'].str[:100] + '...'
+    numeric_topics = None
+    if 'topic' not in df.columns:
+        if 'filename' in df.columns:
+            df['topic'] = _normalise_unique(df['filename'], lambda s: s.str.split('.').str[0])
+            topics = pd.Series(pd.unique(df['topic']), dtype=df['topic'].dtype)
+            numeric_topics = bool(topics.str.match(r'^\d+$').all())
+        else:
+            df['topic'] = df['category']
+    if 'date' not in df.columns:
+        df['date'] = today
+    return df, raw_category, numeric_topics
+
+
+def iter_frame_blocks(df, block_size=CLEAN_BLOCK_SIZE):
+    # An empty frame still yields one (empty) block so its columns survive
+    for start in range(0, max(len(df), 1), block_size):
+        yield df.iloc[start:start + block_size]
+
+
+def clean_news_data_chunked(blocks, workers=1):
+    """
+    Clean an iterable of raw news blocks (e.g. a chunked CSV reader or
+    iter_frame_blocks(df)). The result equals clean_news_data(pd.concat(blocks)).
+    workers=1 cleans block by block in this process, which is what the app
+    does; more workers (None for one per CPU) clean across a pool of spawned
+    processes, for offline rebuilds only, as forking a multithreaded server is unsafe.
+    """
+    import datetime
+    from concurrent.futures import ProcessPoolExecutor
+    today = datetime.datetime.now().strftime('%Y-%m-%d')
+    workers = workers or os.cpu_count() or 1
+    blocks = iter(blocks)
+    first = next(blocks, None)
+    second = next(blocks, None)
+    blocks = itertools.chain([b for b in (first, second) if b is not None], blocks)
+    columns = [] if first is None else list(first.columns)
+    if workers == 1 or second is None:
+        # A single block is not worth starting a pool for
+        results = [_clean_block(block, today) for block in blocks]
+    else:
+        results = []
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn')) as pool:
+            pending = deque()
+            for block in blocks:
+                # Keep at most two blocks per worker in flight to bound memory
+                if len(pending) >= 2 * workers:
+                    results.append(pending.popleft().result())
+                pending.append(pool.submit(_clean_block, block, today))
+            results.extend(future.result() for future in pending)
+    if not results:
+        return pd.DataFrame()
+    cleaned = pd.concat([df for df, _, _ in results])
+    if len(results) > 1:
+        # Global dedup pass over the raw values of each row
+        raw = cleaned[columns]
+        if 'category' in columns:
+            raw = raw.assign(category=pd.concat([category for _, category, _ in results]).to_numpy())
+        cleaned = cleaned[~raw.duplicated().to_numpy()]
+    flags = [numeric for _, _, numeric in results if numeric is not None]
+    if flags and all(flags) and 'category' in cleaned.columns:
+        cleaned['topic'] = cleaned['category']
+    return cleaned
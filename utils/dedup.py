@@ -0,0 +1,133 @@
+import hashlib
+import os
+import re
+import threading
+import numpy as np
+
+_PUNCT = re.compile(r'[^\w\s]')
+_SPACE = re.compile(r'\s+')
+
+
+def normalise_text(text):
+    """Lower-case, drop punctuation and collapse whitespace."""
+    text = _PUNCT.sub(' ', str(text).lower())
+    return _SPACE.sub(' ', text).strip()
+
+
+def article_key(title, summary):
+    """Exact-duplicate key: hash of the normalised title and summary."""
+    text = normalise_text(title) + '\n' + normalise_text(summary)
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()[:32]
+
+
+class DedupIndex:
+    """
+    Persistent set of article keys, one hex key per line in an append-only file.
+    New keys are appended after their articles have been stored.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.keys = set()
+        self._offset = 0
+        self._lock = threading.Lock()
+        self.reload()
+
+    def reload(self):
+        """Read keys appended to the file since it was last read (e.g. by another process)."""
+        if not os.path.exists(self.path):
+            return
+        with self._lock, open(self.path) as f:
+            f.seek(self._offset)
+            lines = f.read()
+            # Leave a partly written last line for the next reload
+            end = lines.rfind('\n') + 1
+            self.keys.update(line.strip() for line in lines[:end].splitlines() if line.strip())
+            self._offset += len(lines[:end].encode())
+
+    def __contains__(self, key):
+        return key in self.keys
+
+    def __len__(self):
+        return len(self.keys)
+
+    def add_many(self, keys):
+        new_keys = [key for key in dict.fromkeys(keys) if key not in self.keys]
+        if not new_keys:
+            return
+        with self._lock:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            with open(self.path, 'a') as f:
+                f.write(''.join(key + '\n' for key in new_keys))
+                f.flush()
+                os.fsync(f.fileno())
+                self._offset = f.tell()
+            self.keys.update(new_keys)
+
+    @classmethod
+    def build(cls, path, titles, summaries):
+        """Create the index file from an existing corpus."""
+        index = cls.__new__(cls)
+        index.path = path
+        index.keys = set()
+        index._offset = 0
+        index._lock = threading.Lock()
+        index.add_many(article_key(t, s) for t, s in zip(titles, summaries))
+        return index
+
+
+class MinHashIndex:
+    """
+    Near-duplicate detection with MinHash signatures over word shingles and
+    LSH banding: two articles are candidates when any band of their
+    signatures matches, and duplicates when the estimated Jaccard
+    similarity reaches `threshold`.
+    """
+
+    _PRIME = (1 << 61) - 1
+
+    def __init__(self, num_perm=64, bands=16, shingle=3, threshold=0.8, seed=0):
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.shingle = shingle
+        self.threshold = threshold
+        rng = np.random.default_rng(seed)
+        self._a = rng.integers(1, self._PRIME, num_perm, dtype=np.uint64)
+        self._b = rng.integers(0, self._PRIME, num_perm, dtype=np.uint64)
+        self.signatures = []
+        self._buckets = [{} for _ in range(bands)]
+
+    def signature(self, text):
+        words = normalise_text(text).split()
+        if len(words) < self.shingle:
+            shingles = {' '.join(words)}
+        else:
+            shingles = {' '.join(words[i:i + self.shingle]) for i in range(len(words) - self.shingle + 1)}
+        hashes = np.array(
+            [int.from_bytes(hashlib.blake2b(s.encode('utf-8'), digest_size=8).digest(), 'little') >> 4 for s in shingles],
+            dtype=np.uint64,
+        )
+        with np.errstate(over='ignore'):
+            permuted = (hashes[:, None] * self._a[None, :] + self._b[None, :]) % np.uint64(self._PRIME)
+        return permuted.min(axis=0)
+
+    def _band_keys(self, sig):
+        return [sig[i * self.rows:(i + 1) * self.rows].tobytes() for i in range(self.bands)]
+
+    def query(self, sig):
+        """Index of a stored near-duplicate of `sig`, or None."""
+        candidates = set()
+        for band, key in enumerate(self._band_keys(sig)):
+            candidates.update(self._buckets[band].get(key, ()))
+        for candidate in candidates:
+            if np.mean(self.signatures[candidate] == sig) >= self.threshold:
+                return candidate
+        return None
+
+    def add(self, sig):
+        pos = len(self.signatures)
+        self.signatures.append(sig)
+        for band, key in enumerate(self._band_keys(sig)):
+            self._buckets[band].setdefault(key, []).append(pos)
+        return pos
@@ -0,0 +1,208 @@
+import json
+import os
+import threading
+import time
+import weakref
+import numpy as np
+import pandas as pd
+from utils.instrument import span
+
+# scikit-learn is imported where it is used, as in article_model.py, to keep import time down
+
+EMBEDDINGS_DIR = os.path.join('data', 'embeddings')
+
+# Dimension of the article vectors and size of the TF-IDF vocabulary they are reduced from
+EMBEDDING_DIM = 64
+MAX_VOCABULARY = 50000
+
+# Refit once the articles appended since the last fit reach this fraction of the fitted ones
+REFIT_FRACTION = 0.2
+
+
+def embedding_text(news_df):
+    """Text that article embeddings are built from: title plus summary."""
+    columns = [col for col in ('title', 'summary') if col in news_df.columns]
+    text = pd.Series('', index=news_df.index, dtype=object)
+    for col in columns:
+        text = text + ' ' + news_df[col].astype(str)
+    return text
+
+
+def text_hashes(news_df):
+    """Per-article hash of the index and embedding text, used to match a frame to the stored vectors."""
+    return pd.util.hash_pandas_object(embedding_text(news_df), index=True).to_numpy()
+
+
+def _normalise_rows(vectors):
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+class ArticleEmbeddings:
+    """
+    Dense article vectors: sublinear TF-IDF over title and summary, reduced
+    to EMBEDDING_DIM dimensions with TruncatedSVD and L2-normalised, so cosine
+    similarity is a dot product. Vectors are float32 and memory-mapped when
+    loaded, so worker processes share one copy through the page cache.
+    Appended articles are projected with the fitted vocabulary and components.
+    """
+
+    def __init__(self, vocabulary, idf, components, vectors, hashes, news_ids, n_fitted=None):
+        self.vocabulary = vocabulary
+        self.idf = idf
+        self.components = components
+        self.vectors = vectors
+        self.hashes = hashes
+        self.news_index = pd.Index(news_ids)
+        self.n_fitted = len(self.news_index) if n_fitted is None else n_fitted
+        # user_id -> (likes folded in, articles known then, sum of their vectors)
+        self._user_sums = {}
+        self._lock = threading.Lock()
+
+    def _tfidf(self, texts):
+        from sklearn.feature_extraction.text import CountVectorizer
+        from sklearn.preprocessing import normalize
+        counts = CountVectorizer(vocabulary=self.vocabulary, stop_words='english').transform(texts).astype(np.float32)
+        counts.data = 1 + np.log(counts.data)
+        return normalize(counts.multiply(self.idf).tocsr())
+
+    def transform(self, texts):
+        """Normalised float32 vectors for arbitrary text."""
+        return _normalise_rows(np.asarray(self._tfidf(texts) @ self.components.T, dtype=np.float32))
+
+    @classmethod
+    def fit(cls, news_df, dim=EMBEDDING_DIM, max_vocabulary=MAX_VOCABULARY, seed=0):
+        from sklearn.decomposition import TruncatedSVD
+        from sklearn.feature_extraction.text import CountVectorizer
+        texts = embedding_text(news_df)
+        counts = CountVectorizer(stop_words='english', max_features=max_vocabulary).fit(texts)
+        vocabulary = {term: int(col) for term, col in counts.vocabulary_.items()}
+        model = cls(vocabulary, None, None, None, text_hashes(news_df), news_df.index)
+        raw = counts.transform(texts)
+        doc_freq = np.bincount(raw.indices, minlength=len(vocabulary))
+        # Same smoothed idf as sklearn's TfidfTransformer
+        model.idf = (np.log((1 + len(texts)) / (1 + doc_freq)) + 1).astype(np.float32)
+        tfidf = model._tfidf(texts)
+        n_components = max(1, min(dim, tfidf.shape[1] - 1, tfidf.shape[0] - 1))
+        svd = TruncatedSVD(n_components=n_components, random_state=seed).fit(tfidf)
+        model.components = svd.components_.astype(np.float32)
+        model.vectors = _normalise_rows(np.asarray(tfidf @ model.components.T, dtype=np.float32))
+        return model
+
+    def extend(self, new_df):
+        """Append vectors for new articles without refitting."""
+        self.vectors = np.vstack([self.vectors, self.transform(embedding_text(new_df))])
+        self.hashes = np.concatenate([self.hashes, text_hashes(new_df)])
+        self.news_index = self.news_index.append(new_df.index)
+        return self
+
+    def positions(self, news_ids):
+        """Rows of the given news ids (-1 for unknown ids)."""
+        return self.news_index.get_indexer(news_ids)
+
+    def user_vector(self, liked_ids, user_id=None):
+        """
+        Normalised sum of the liked articles' vectors; None when none of them
+        is known. With a user_id, the sum is kept and only likes appended
+        since the last call are added (the log is append-only), so the cost
+        does not grow with the user's history.
+        """
+        liked_ids = list(liked_ids)
+        with self._lock:
+            cached = self._user_sums.get(user_id) if user_id is not None else None
+            # A shorter history (log retention) or newly known articles mean starting over
+            if cached is None or cached[0] > len(liked_ids) or cached[1] != len(self.news_index):
+                cached = (0, len(self.news_index), np.zeros(self.vectors.shape[1], dtype=np.float32))
+            positions = self.positions(liked_ids[cached[0]:])
+            positions = positions[positions >= 0]
+            total = cached[2] + self.vectors[positions].sum(axis=0) if len(positions) else cached[2]
+            if user_id is not None:
+                self._user_sums[user_id] = (len(liked_ids), len(self.news_index), total)
+        norm = np.linalg.norm(total)
+        return total / norm if norm > 0 else None
+
+    def user_scores(self, liked_ids, user_id=None):
+        """Cosine similarity of every article with user_vector; None when it is None."""
+        profile = self.user_vector(liked_ids, user_id)
+        return None if profile is None else self.vectors @ profile
+
+    def save(self, path=EMBEDDINGS_DIR):
+        """
+        Write the arrays under fresh names and then switch meta.json to them,
+        so readers always see one complete set; older files are removed.
+        """
+        os.makedirs(path, exist_ok=True)
+        tag = time.time_ns()
+        files = {name: f'{name}-{tag}.npy' for name in ('vectors', 'components', 'idf', 'hashes', 'news_ids')}
+        out = np.lib.format.open_memmap(os.path.join(path, files['vectors']), mode='w+', dtype=np.float32,
+                                        shape=self.vectors.shape)
+        out[:] = self.vectors
+        out.flush()
+        del out
+        np.save(os.path.join(path, files['components']), self.components)
+        np.save(os.path.join(path, files['idf']), self.idf)
+        np.save(os.path.join(path, files['hashes']), self.hashes)
+        np.save(os.path.join(path, files['news_ids']), self.news_index.to_numpy())
+        files['vocabulary'] = f'vocabulary-{tag}.json'
+        with open(os.path.join(path, files['vocabulary']), 'w') as f:
+            json.dump(self.vocabulary, f)
+        meta_path = os.path.join(path, 'meta.json')
+        with open(meta_path + '.tmp', 'w') as f:
+            json.dump({'files': files, 'n_fitted': self.n_fitted}, f)
+        os.replace(meta_path + '.tmp', meta_path)
+        current = set(files.values())
+        for name in os.listdir(path):
+            if name != 'meta.json' and not name.endswith('.tmp') and name not in current:
+                os.remove(os.path.join(path, name))
+
+    @classmethod
+    def load(cls, path=EMBEDDINGS_DIR):
+        with open(os.path.join(path, 'meta.json')) as f:
+            meta = json.load(f)
+        files = {name: os.path.join(path, file) for name, file in meta['files'].items()}
+        with open(files['vocabulary']) as f:
+            vocabulary = json.load(f)
+        return cls(
+            vocabulary,
+            np.load(files['idf']),
+            np.load(files['components']),
+            np.load(files['vectors'], mmap_mode='r'),
+            np.load(files['hashes']),
+            np.load(files['news_ids']),
+            meta['n_fitted'],
+        )
+
+
+_embeddings = None
+_embeddings_frame = None
+_embeddings_lock = threading.Lock()
+
+
+@span('embeddings.get')
+def get_article_embeddings(news_df, path=EMBEDDINGS_DIR):
+    """
+    Return the article embeddings for news_df, loading the saved vectors when
+    they match. New articles at the end of news_df are projected and appended;
+    a refit happens when the frame no longer matches or the appended articles
+    reach REFIT_FRACTION of the fitted ones. Changes are saved to disk.
+    """
+    global _embeddings, _embeddings_frame
+    with _embeddings_lock:
+        if _embeddings is not None and _embeddings_frame is not None and _embeddings_frame() is news_df:
+            return _embeddings
+        if _embeddings is None and os.path.exists(os.path.join(path, 'meta.json')):
+            try:
+                _embeddings = ArticleEmbeddings.load(path)
+            except (OSError, ValueError, KeyError):
+                _embeddings = None
+        hashes = text_hashes(news_df)
+        if _embeddings is None or not np.array_equal(_embeddings.hashes, hashes):
+            n_known = 0 if _embeddings is None else len(_embeddings.hashes)
+            if (0 < n_known < len(hashes) and np.array_equal(_embeddings.hashes, hashes[:n_known])
+                    and len(hashes) - _embeddings.n_fitted < REFIT_FRACTION * _embeddings.n_fitted):
+                _embeddings.extend(news_df.iloc[n_known:])
+            else:
+                _embeddings = ArticleEmbeddings.fit(news_df)
+            _embeddings.save(path)
+        _embeddings_frame = weakref.ref(news_df)
+        return _embeddings
@@ -0,0 +1,322 @@
+import json
+import os
+import threading
+import time
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+from utils.instrument import span
+from utils.log_store import LOG_CHUNK_SIZE, get_log_store
+
+FACTORS_DIR = os.path.join('user_logs', 'factors')
+
+# Latent dimensions, L2 regularisation and confidence scale of the ALS model
+N_FACTORS = 32
+REGULARIZATION = 0.1
+ALPHA = 10.0
+
+# ALS iterations for a cold fit and for a warm-started refit
+ITERATIONS = 10
+WARM_ITERATIONS = 3
+
+# Conjugate-gradient steps per half-iteration
+CG_STEPS = 3
+
+# Evidence per interaction: likes count towards a positive preference, discards against
+ACTION_PREFERENCE = {'like': 1.0, 'discard': -1.0}
+
+# Dwell time (optional 'time_spent' column, in seconds) adds log1p(time_spent / DWELL_SCALE) evidence
+DWELL_WEIGHT = 0.5
+DWELL_SCALE_SECONDS = 30.0
+
+# Observed cells whose factor dot products are computed at once
+CELL_BLOCK = 1_000_000
+
+
+def _grow(ids, index, values):
+    positions = np.empty(len(values), dtype=np.int64)
+    for i, value in enumerate(values):
+        pos = index.get(value)
+        if pos is None:
+            pos = index[value] = len(ids)
+            ids.append(value)
+        positions[i] = pos
+    return positions
+
+
+def interaction_weights(chunks, user_ids=(), item_ids=()):
+    """
+    Sum the evidence of every (user, article) pair over the log chunks.
+    Returns (user_ids, item_ids, confidence, signed): users and articles
+    start with the given ids, in that order; `confidence` holds the summed
+    evidence of each pair and `signed` the same with discards negative.
+    """
+    user_ids, item_ids = list(user_ids), list(item_ids)
+    user_index = {u: i for i, u in enumerate(user_ids)}
+    item_index = {n: i for i, n in enumerate(item_ids)}
+    confidence = sp.csr_matrix((0, 0), dtype=np.float32)
+    signed = sp.csr_matrix((0, 0), dtype=np.float32)
+    for chunk in chunks:
+        news_ids = pd.to_numeric(chunk['news_id'], errors='coerce')
+        sign = chunk['action'].map(ACTION_PREFERENCE)
+        keep = (news_ids.notna() & sign.notna()).to_numpy()
+        if not keep.any():
+            continue
+        evidence = np.ones(int(keep.sum()), dtype=np.float32)
+        if 'time_spent' in chunk.columns:
+            dwell = pd.to_numeric(chunk['time_spent'], errors='coerce').fillna(0).clip(lower=0).to_numpy()[keep]
+            evidence += DWELL_WEIGHT * np.log1p(dwell / DWELL_SCALE_SECONDS).astype(np.float32)
+        users = chunk['user_id'].astype(str).to_numpy()[keep]
+        items = news_ids.to_numpy()[keep].astype(np.int64)
+        codes, uniques = pd.factorize(users)
+        rows = _grow(user_ids, user_index, uniques.tolist())[codes]
+        codes, uniques = pd.factorize(items)
+        cols = _grow(item_ids, item_index, uniques.tolist())[codes]
+        shape = (len(user_ids), len(item_ids))
+        part = sp.csr_matrix((evidence, (rows, cols)), shape=shape)
+        part_signed = sp.csr_matrix((evidence * sign.to_numpy()[keep].astype(np.float32), (rows, cols)), shape=shape)
+        confidence.resize(shape)
+        signed.resize(shape)
+        confidence = confidence + part
+        signed = signed + part_signed
+    shape = (len(user_ids), len(item_ids))
+    confidence.resize(shape)
+    signed.resize(shape)
+    return user_ids, item_ids, confidence.tocsr(), signed.tocsr()
+
+
+def _cell_dots(X, Y, rows, cols):
+    """X[rows[j]] . Y[cols[j]] for every observed cell j, in blocks."""
+    dots = np.empty(len(rows), dtype=np.float32)
+    for start in range(0, len(rows), CELL_BLOCK):
+        end = start + CELL_BLOCK
+        dots[start:end] = np.einsum('ij,ij->i', X[rows[start:end]], Y[cols[start:end]])
+    return dots
+
+
+def _als_step(X, Y, weights, targets, regularization, cg_steps):
+    """
+    Update X in place for fixed Y. Each row x_u solves
+    (Y'Y + Y' (C_u - I) Y + reg I) x_u = Y' C_u p_u, where `weights` holds
+    c - 1 and `targets` c * p for the observed cells. A few conjugate-gradient
+    steps from the current X are run for all rows at once with sparse products.
+    """
+    gram = Y.T @ Y + regularization * np.eye(Y.shape[1], dtype=np.float32)
+    rows = np.repeat(np.arange(weights.shape[0]), np.diff(weights.indptr))
+    cols = weights.indices
+
+    def apply(V):
+        scaled = sp.csr_matrix((weights.data * _cell_dots(V, Y, rows, cols), cols, weights.indptr), shape=weights.shape)
+        return V @ gram + scaled @ Y
+
+    residual = targets @ Y - apply(X)
+    direction = residual.copy()
+    norms = np.einsum('ij,ij->i', residual, residual)
+    for _ in range(cg_steps):
+        product = apply(direction)
+        curvature = np.einsum('ij,ij->i', direction, product)
+        step = np.divide(norms, curvature, out=np.zeros_like(norms), where=curvature > 0)
+        X += step[:, None] * direction
+        residual -= step[:, None] * product
+        new_norms = np.einsum('ij,ij->i', residual, residual)
+        beta = np.divide(new_norms, norms, out=np.zeros_like(norms), where=norms > 0)
+        direction = residual + beta[:, None] * direction
+        norms = new_norms
+
+
+class FactorModel:
+    """
+    Implicit-feedback matrix factorisation (confidence-weighted ALS after Hu,
+    Koren & Volinsky). Every (user, article) pair with interactions gets
+    confidence 1 + alpha * evidence and preference 1 when likes outweigh
+    discards, 0 otherwise; all other pairs have preference 0 at confidence 1.
+    Factors are float32 and are memory-mapped when loaded from disk.
+    """
+
+    def __init__(self, user_ids, item_ids, user_factors, item_factors, version=0):
+        self.user_ids = list(user_ids)
+        self.item_ids = np.asarray(item_ids, dtype=np.int64)
+        self.user_index = {u: i for i, u in enumerate(self.user_ids)}
+        self.item_index = pd.Index(self.item_ids)
+        self.user_factors = user_factors
+        self.item_factors = item_factors
+        self.version = version
+
+    @property
+    def n_factors(self):
+        return self.item_factors.shape[1]
+
+    def scores(self, user_id):
+        """Predicted preference of the user for every item, or None for an unknown user."""
+        row = self.user_index.get(str(user_id))
+        if row is None:
+            return None
+        return self.item_factors @ self.user_factors[row]
+
+    def recommend(self, user_id, k, exclude=()):
+        """Top-k news ids by predicted preference (best first), skipping `exclude`."""
+        scores = self.scores(user_id)
+        if scores is None:
+            return []
+        positions = self.item_index.get_indexer(list(exclude))
+        scores[positions[positions >= 0]] = -np.inf
+        k = min(k, int(np.isfinite(scores).sum()))
+        if k <= 0:
+            return []
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.lexsort((top, -scores[top]))]
+        return self.item_ids[top].tolist()
+
+    @classmethod
+    @span('factorization.train')
+    def train(cls, store, warm=None, n_factors=N_FACTORS, iterations=None, regularization=REGULARIZATION,
+              alpha=ALPHA, cg_steps=CG_STEPS, chunksize=LOG_CHUNK_SIZE, seed=0):
+        """
+        Fit factors to the whole interaction log, streamed in chunks. With a
+        `warm` model of the same rank, its factors are the starting point:
+        known users and items keep them, new ones start small and random, and
+        WARM_ITERATIONS suffice by default.
+        """
+        if warm is not None and warm.n_factors != n_factors:
+            warm = None
+        if iterations is None:
+            iterations = ITERATIONS if warm is None else WARM_ITERATIONS
+        # Read before streaming: rows appended meanwhile may be trained on, but are not marked as covered
+        version = store.version()
+        user_ids, item_ids, confidence, signed = interaction_weights(
+            store.iter_since(0, chunksize),
+            warm.user_ids if warm is not None else (),
+            warm.item_ids.tolist() if warm is not None else (),
+        )
+        weights = confidence.copy()
+        weights.data *= alpha
+        # c * p: preference is 1 only where likes outweigh discards
+        targets = confidence.multiply(signed > 0).tocsr()
+        targets.data = 1 + alpha * targets.data
+
+        rng = np.random.default_rng(seed)
+        scale = 0.01
+        X = (rng.standard_normal((len(user_ids), n_factors)) * scale).astype(np.float32)
+        Y = (rng.standard_normal((len(item_ids), n_factors)) * scale).astype(np.float32)
+        if warm is not None:
+            X[:len(warm.user_ids)] = warm.user_factors
+            Y[:len(warm.item_ids)] = warm.item_factors
+        weights_t, targets_t = weights.T.tocsr(), targets.T.tocsr()
+        for _ in range(iterations):
+            _als_step(X, Y, weights, targets, regularization, cg_steps)
+            _als_step(Y, X, weights_t, targets_t, regularization, cg_steps)
+        return cls(user_ids, item_ids, X, Y, version)
+
+    def save(self, path=FACTORS_DIR):
+        """
+        Write the factors as float32 .npy files and then switch meta.json to
+        them, so readers always see one complete model; older files are removed.
+        """
+        os.makedirs(path, exist_ok=True)
+        tag = f'{self.version}-{time.time_ns()}'
+        files = {
+            'user_factors': f'user_factors-{tag}.npy',
+            'item_factors': f'item_factors-{tag}.npy',
+            'user_ids': f'user_ids-{tag}.npy',
+            'item_ids': f'item_ids-{tag}.npy',
+        }
+        for name in ('user_factors', 'item_factors'):
+            values = getattr(self, name)
+            out = np.lib.format.open_memmap(os.path.join(path, files[name]), mode='w+', dtype=np.float32, shape=values.shape)
+            out[:] = values
+            out.flush()
+            del out
+        np.save(os.path.join(path, files['user_ids']), np.array(self.user_ids, dtype=str))
+        np.save(os.path.join(path, files['item_ids']), self.item_ids)
+        meta_path = os.path.join(path, 'meta.json')
+        with open(meta_path + '.tmp', 'w') as f:
+            json.dump({'version': int(self.version), 'n_factors': self.n_factors, 'files': files}, f)
+        os.replace(meta_path + '.tmp', meta_path)
+        current = set(files.values())
+        for name in os.listdir(path):
+            if name.endswith('.npy') and name not in current:
+                # Readers that mapped an older file keep their mapping
+                os.remove(os.path.join(path, name))
+
+    @classmethod
+    def load(cls, path=FACTORS_DIR):
+        with open(os.path.join(path, 'meta.json')) as f:
+            meta = json.load(f)
+        files = {name: os.path.join(path, file) for name, file in meta['files'].items()}
+        return cls(
+            np.load(files['user_ids']).tolist(),
+            np.load(files['item_ids']),
+            np.load(files['user_factors'], mmap_mode='r'),
+            np.load(files['item_factors'], mmap_mode='r'),
+            meta['version'],
+        )
+
+
+_model = None
+_model_stamp = None
+_model_lock = threading.Lock()
+
+
+@span('factorization.get')
+def get_factor_model(path=FACTORS_DIR):
+    """
+    The latest saved factor model, memory-mapped and shared by the process;
+    reloaded when a newer one is saved. None until a model has been trained.
+    """
+    global _model, _model_stamp
+    try:
+        stat = os.stat(os.path.join(path, 'meta.json'))
+    except OSError:
+        return None
+    stamp = (path, stat.st_mtime_ns, stat.st_size)
+    with _model_lock:
+        if _model is None or _model_stamp != stamp:
+            try:
+                _model = FactorModel.load(path)
+            except (OSError, ValueError, KeyError):
+                return _model
+            _model_stamp = stamp
+        return _model
+
+
+def train_factor_model(store=None, path=FACTORS_DIR, cold=False, allow_partial=False, **kwargs):
+    """
+    Retrain from the saved model (warm start) unless `cold`, save the result
+    and return it. Training refits to the log as it is now, so once the
+    retention policy has deleted old interactions (utils/rollups.py) the new
+    model only reflects the history kept; that needs `allow_partial`.
+    """
+    store = store or get_log_store()
+    if store.pruned_through() and not allow_partial:
+        raise ValueError(f"Interactions up to id {store.pruned_through()} were deleted by the retention policy; "
+                         f"retraining would fit the remaining history only (pass allow_partial=True)")
+    warm = None
+    if not cold and os.path.exists(os.path.join(path, 'meta.json')):
+        try:
+            warm = FactorModel.load(path)
+        except (OSError, ValueError, KeyError):
+            warm = None
+    model = FactorModel.train(store, warm=warm, **kwargs)
+    model.save(path)
+    return model
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Train the implicit-feedback factor model from the interaction log.')
+    parser.add_argument('--cold', action='store_true', help='Ignore the saved model and fit from scratch')
+    parser.add_argument('--factors', type=int, default=N_FACTORS)
+    parser.add_argument('--iterations', type=int, default=None)
+    parser.add_argument('--regularization', type=float, default=REGULARIZATION)
+    parser.add_argument('--alpha', type=float, default=ALPHA)
+    parser.add_argument('--allow-partial', action='store_true',
+                        help='Train even though the retention policy deleted old interactions')
+    args = parser.parse_args()
+    start = time.perf_counter()
+    try:
+        model = train_factor_model(cold=args.cold, allow_partial=args.allow_partial, n_factors=args.factors,
+                                   iterations=args.iterations, regularization=args.regularization, alpha=args.alpha)
+    except ValueError as e:
+        raise SystemExit(str(e))
+    print(f"{len(model.user_ids)} users x {len(model.item_ids)} items, rank {model.n_factors}, "
+          f"log version {model.version} in {time.perf_counter() - start:.1f}s")
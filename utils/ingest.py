@@ -0,0 +1,163 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import pandas as pd
+from utils.cleaner import clean_api_news
+from utils.instrument import span
+
+# Point at a local stub server with NEWSAPI_BASE_URL=http://127.0.0.1:8000/v2/top-headlines
+NEWSAPI_BASE_URL = os.environ.get('NEWSAPI_BASE_URL', 'https://newsapi.org/v2/top-headlines')
+NEWSAPI_CATEGORIES = ['business', 'entertainment', 'general', 'health', 'science', 'sports', 'technology']
+
+# Requests per second allowed across all worker threads, and the burst size
+REQUESTS_PER_SECOND = 5
+BURST = 5
+
+# Retries per page on connection errors, 429 and 5xx; each one waits for a token like the first attempt
+MAX_RETRIES = 3
+RETRY_BACKOFF = 0.5
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+# Upper bound on a server's Retry-After, in seconds
+MAX_RETRY_AFTER = 30
+
+
+class RateLimiter:
+    """Token bucket shared by all fetch threads."""
+
+    def __init__(self, rate=REQUESTS_PER_SECOND, burst=BURST):
+        self.rate = rate
+        self.capacity = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait_for = (1 - self.tokens) / self.rate
+            time.sleep(wait_for)
+
+
+def make_session(pool_size=10):
+    """
+    A requests.Session with pooled keep-alive connections. It does not retry
+    by itself: _fetch_page retries, so every attempt goes through the rate limiter.
+    """
+    # Imported here so the app does not pay for requests until news is fetched
+    import requests
+    from requests.adapters import HTTPAdapter
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=0)
+    session = requests.Session()
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def _retry_delay(response, attempt, backoff):
+    # Retry-After in seconds when the server sends one, exponential backoff otherwise
+    retry_after = response.headers.get('Retry-After') if response is not None else None
+    try:
+        return min(max(float(retry_after), 0.0), MAX_RETRY_AFTER)
+    except (TypeError, ValueError):
+        return backoff * 2 ** attempt
+
+
+def _fetch_page(session, limiter, base_url, params, timeout, retries=MAX_RETRIES, backoff=RETRY_BACKOFF):
+    import requests
+    for attempt in range(retries + 1):
+        limiter.acquire()
+        try:
+            response = session.get(base_url, params=params, timeout=timeout)
+        except (requests.ConnectionError, requests.Timeout):
+            if attempt == retries:
+                raise
+            response = None
+        if response is not None and response.status_code == 200:
+            return response.json()
+        if response is not None and (response.status_code not in RETRY_STATUSES or attempt == retries):
+            raise RuntimeError(f"API error: {response.status_code}")
+        time.sleep(_retry_delay(response, attempt, backoff))
+
+
+def _clean_page(payload, category):
+    articles = payload.get('articles', [])
+    if not articles:
+        return None
+    df_api = pd.DataFrame(articles)
+    if category and 'category' not in df_api.columns:
+        df_api['category'] = category.title()
+    return clean_api_news(df_api)
+
+
+def iter_headlines(api_key, categories=None, countries=('us',), page_size=20, max_pages=1,
+                   workers=8, base_url=NEWSAPI_BASE_URL, limiter=None, session=None,
+                   timeout=10, retries=MAX_RETRIES, errors=None):
+    """
+    Fetch top headlines for every (country, category) pair concurrently and
+    yield each page as a cleaned DataFrame as soon as it arrives. Further pages
+    of a query are requested while totalResults says there are more, up to
+    max_pages. Each page is retried up to `retries` times, every attempt
+    taking a token from `limiter`; pages that still fail are appended to
+    `errors` (if given) and skipped.
+    """
+    categories = list(categories) if categories is not None else [None]
+    limiter = limiter or RateLimiter()
+    own_session = session is None
+    session = session or make_session(pool_size=workers)
+
+    def params_for(country, category, page):
+        params = {'country': country, 'pageSize': page_size, 'page': page, 'apiKey': api_key}
+        if category:
+            params['category'] = category
+        return params
+
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            pending = {}
+            for country in countries:
+                for category in categories:
+                    future = pool.submit(_fetch_page, session, limiter, base_url,
+                                         params_for(country, category, 1), timeout, retries)
+                    pending[future] = (country, category, 1)
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    country, category, page = pending.pop(future)
+                    try:
+                        payload = future.result()
+                    except Exception as e:
+                        if errors is not None:
+                            errors.append(f"{country}/{category or 'all'} page {page}: {e}")
+                        continue
+                    total = payload.get('totalResults', 0) or 0
+                    if page < max_pages and page * page_size < total:
+                        next_future = pool.submit(_fetch_page, session, limiter, base_url,
+                                                  params_for(country, category, page + 1), timeout, retries)
+                        pending[next_future] = (country, category, page + 1)
+                    df_page = _clean_page(payload, category)
+                    if df_page is not None and not df_page.empty:
+                        yield df_page
+    finally:
+        if own_session:
+            session.close()
+
+
+@span('ingest.fetch_headlines')
+def fetch_headlines(api_key, **kwargs):
+    """
+    Run iter_headlines to completion. Returns (df, errors) with duplicates
+    across pages and categories removed; df is None when nothing was fetched.
+    """
+    errors = []
+    pages = list(iter_headlines(api_key, errors=errors, **kwargs))
+    if not pages:
+        return None, errors
+    df = pd.concat(pages, ignore_index=True).drop_duplicates(subset=['title', 'summary'])
+    return df.reset_index(drop=True), errors
@@ -0,0 +1,199 @@
+import cProfile
+import contextvars
+import functools
+import io
+import os
+import pstats
+import threading
+import time
+import tracemalloc
+from bisect import bisect_left
+
+# Set CARVED_INSTRUMENT=0 to turn spans into no-ops
+ENABLED = os.environ.get('CARVED_INSTRUMENT', '1') != '0'
+
+# Histogram bucket upper bounds in milliseconds (the last bucket is open-ended)
+BUCKETS_MS = [0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000]
+
+
+class Histogram:
+    """Latency histogram with fixed buckets; percentiles are bucket upper bounds (capped at the max)."""
+
+    def __init__(self, buckets=BUCKETS_MS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+
+    def percentile(self, q):
+        if not self.count:
+            return 0.0
+        rank = q / 100 * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            seen += n
+            if seen >= rank and n:
+                return min(self.buckets[i], self.max) if i < len(self.buckets) else self.max
+        return self.max
+
+    def summary(self):
+        return {
+            'count': self.count,
+            'mean_ms': self.total / self.count if self.count else 0.0,
+            'p50_ms': self.percentile(50),
+            'p95_ms': self.percentile(95),
+            'max_ms': self.max,
+        }
+
+
+class MetricsRegistry:
+    """In-process histograms (per span name) and counters, shared by all threads."""
+
+    def __init__(self):
+        self.histograms = {}
+        self.counters = {}
+        self._lock = threading.Lock()
+
+    def observe(self, name, value_ms):
+        with self._lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram()
+            histogram.observe(value_ms)
+
+    def incr(self, name, value=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'histograms': {name: h.summary() for name, h in sorted(self.histograms.items())},
+                'counters': dict(sorted(self.counters.items())),
+            }
+
+    def reset(self):
+        with self._lock:
+            self.histograms.clear()
+            self.counters.clear()
+
+
+registry = MetricsRegistry()
+
+# Spans of the trace being captured in this thread / context, if any
+_current_trace = contextvars.ContextVar('carved_trace', default=None)
+_open_spans = contextvars.ContextVar('carved_open_spans', default=())
+
+
+class Trace:
+    """Spans recorded during one capture (e.g. one Streamlit render)."""
+
+    def __init__(self):
+        self.spans = []
+        self.profile_text = None
+        self.top_allocations = None
+
+    def rows(self):
+        """Spans in start order as dicts (name, depth, ms, alloc_kb)."""
+        return [dict(name=name, depth=depth, ms=ms, alloc_kb=alloc_kb)
+                for _, name, depth, ms, alloc_kb in sorted(self.spans)]
+
+
+class span:
+    """
+    Time a block or a function and record it in the metrics registry:
+
+        with span('recommend.hybrid'):
+            ...
+
+        @span('recommend.load_user_logs')
+        def load_user_logs(...): ...
+
+    Inside a capture, the span is also added to the current Trace, together
+    with the traced memory it allocated when tracemalloc is running.
+    """
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        if not ENABLED:
+            return self
+        alloc = tracemalloc.get_traced_memory()[0] if tracemalloc.is_tracing() else None
+        stack = _open_spans.get()
+        _open_spans.set(stack + ((time.perf_counter(), alloc),))
+        return self
+
+    def __exit__(self, *exc):
+        if not ENABLED:
+            return False
+        stack = _open_spans.get()
+        start, alloc = stack[-1]
+        _open_spans.set(stack[:-1])
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        registry.observe(self.name, elapsed_ms)
+        trace = _current_trace.get()
+        if trace is not None:
+            alloc_kb = None
+            if alloc is not None and tracemalloc.is_tracing():
+                alloc_kb = (tracemalloc.get_traced_memory()[0] - alloc) / 1024
+            trace.spans.append((start, self.name, len(stack) - 1, elapsed_ms, alloc_kb))
+        return False
+
+    def __call__(self, fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with self:
+                return fn(*args, **kwargs)
+        return wrapper
+
+
+class capture:
+    """
+    Collect the spans of one request into a Trace. With profile=True the block
+    runs under cProfile (stats text in trace.profile_text); with memory=True
+    tracemalloc runs for the block, spans get allocation sizes and the top
+    allocation sites are kept in trace.top_allocations.
+    """
+
+    def __init__(self, profile=False, memory=False, limit=25):
+        self.profile = profile
+        self.memory = memory
+        self.limit = limit
+        self.trace = Trace()
+
+    def __enter__(self):
+        self._token = _current_trace.set(self.trace)
+        self._started_tracing = self.memory and not tracemalloc.is_tracing()
+        if self._started_tracing:
+            tracemalloc.start()
+        self._profiler = None
+        if self.profile:
+            self._profiler = cProfile.Profile()
+            try:
+                self._profiler.enable()
+            except ValueError:
+                # Another profiler is already active in this process
+                self._profiler = None
+        return self.trace
+
+    def __exit__(self, *exc):
+        if self._profiler is not None:
+            self._profiler.disable()
+            out = io.StringIO()
+            pstats.Stats(self._profiler, stream=out).sort_stats('cumulative').print_stats(self.limit)
+            self.trace.profile_text = out.getvalue()
+        if self.memory and tracemalloc.is_tracing():
+            stats = tracemalloc.take_snapshot().statistics('lineno')[:self.limit]
+            self.trace.top_allocations = [(str(stat.traceback), stat.size / 1024, stat.count) for stat in stats]
+        if self._started_tracing:
+            tracemalloc.stop()
+        _current_trace.reset(self._token)
+        return False
@@ -0,0 +1,200 @@
+import os
+import threading
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+from utils.instrument import registry, span
+
+INTERACTION_MATRIX_PATH = os.path.join('user_logs', 'user_item_matrix.npz')
+
+# Write a new snapshot once this many log rows have been applied since the last one
+SNAPSHOT_EVERY = 500
+
+# While streaming the log, fold buffered likes into the CSR matrix once this many are pending
+FOLD_PENDING_EVERY = 1_000_000
+
+
+class InteractionMatrix:
+    """
+    Binary users x articles "like" matrix in CSR form, with id maps for both axes.
+    New interactions are buffered as COO triplets and folded into the CSR
+    matrix the next time it is read, so the matrix is never rebuilt from the log.
+    """
+
+    def __init__(self):
+        self.user_ids = []
+        self.item_ids = []
+        self.user_index = {}
+        self.item_index = {}
+        self.version = 0
+        self._csr = sp.csr_matrix((0, 0), dtype=np.float32)
+        self._pending_rows = []
+        self._pending_cols = []
+        self._lock = threading.RLock()
+
+    @property
+    def shape(self):
+        return len(self.user_ids), len(self.item_ids)
+
+    def _user_row(self, user_id):
+        row = self.user_index.get(user_id)
+        if row is None:
+            row = len(self.user_ids)
+            self.user_index[user_id] = row
+            self.user_ids.append(user_id)
+        return row
+
+    def _item_col(self, news_id):
+        col = self.item_index.get(news_id)
+        if col is None:
+            col = len(self.item_ids)
+            self.item_index[news_id] = col
+            self.item_ids.append(news_id)
+        return col
+
+    def add(self, user_id, news_id, action):
+        """Record one interaction. Every user gets a row; only likes set a cell."""
+        with self._lock:
+            row = self._user_row(user_id)
+            if action == 'like':
+                self._pending_rows.append(row)
+                self._pending_cols.append(self._item_col(int(news_id)))
+
+    def add_logs(self, logs):
+        """Record a frame of interactions; ids from an 'id' column advance the version."""
+        if logs.empty:
+            return
+        with self._lock:
+            for user_id in pd.unique(logs['user_id']):
+                self._user_row(user_id)
+            liked = logs[logs['action'] == 'like']
+            news_ids = liked['news_id'].astype(int).to_numpy()
+            for news_id in pd.unique(news_ids):
+                self._item_col(int(news_id))
+            self._pending_rows.extend(liked['user_id'].map(self.user_index).tolist())
+            self._pending_cols.extend(pd.Series(news_ids).map(self.item_index).tolist())
+            if 'id' in logs.columns:
+                self.version = max(self.version, int(logs['id'].max()))
+
+    def tocsr(self):
+        """Return the CSR matrix with any buffered interactions folded in."""
+        with self._lock:
+            if self._csr.shape != self.shape or self._pending_rows:
+                base = self._csr
+                if base.shape != self.shape:
+                    base = base.copy()
+                    base.resize(self.shape)
+                if self._pending_rows:
+                    pending = sp.csr_matrix(
+                        (np.ones(len(self._pending_rows), dtype=np.float32),
+                         (self._pending_rows, self._pending_cols)),
+                        shape=self.shape,
+                    )
+                    base = base + pending
+                    base.sum_duplicates()
+                    # Repeated likes still count once
+                    base.data[:] = 1
+                    self._pending_rows = []
+                    self._pending_cols = []
+                self._csr = base.tocsr()
+            return self._csr
+
+    def liked_items(self, user_id):
+        """News ids the user has liked."""
+        row = self.user_index.get(user_id)
+        if row is None:
+            return []
+        matrix = self.tocsr()
+        cols = matrix.indices[matrix.indptr[row]:matrix.indptr[row + 1]]
+        return [self.item_ids[c] for c in cols]
+
+    def refresh(self, store):
+        """Apply log rows written since this matrix's version; returns the number applied."""
+        with self._lock:
+            applied = 0
+            for new_rows in store.iter_since(self.version):
+                self.add_logs(new_rows)
+                applied += len(new_rows)
+                if len(self._pending_rows) >= FOLD_PENDING_EVERY:
+                    self.tocsr()
+            return applied
+
+    @classmethod
+    def from_logs(cls, logs):
+        matrix = cls()
+        matrix.add_logs(logs)
+        return matrix
+
+    def save(self, path=INTERACTION_MATRIX_PATH):
+        with self._lock:
+            matrix = self.tocsr()
+            tmp_path = path + '.tmp.npz'
+            np.savez(
+                tmp_path,
+                data=matrix.data,
+                indices=matrix.indices,
+                indptr=matrix.indptr,
+                shape=np.array(matrix.shape),
+                # Object array so user ids come back with their type (ints from a CSV log stay ints)
+                user_ids=np.array(self.user_ids, dtype=object),
+                item_ids=np.array(self.item_ids, dtype=np.int64),
+                version=np.array(self.version),
+            )
+            os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path=INTERACTION_MATRIX_PATH):
+        with np.load(path, allow_pickle=True) as snapshot:
+            matrix = cls()
+            matrix.user_ids = snapshot['user_ids'].tolist()
+            matrix.item_ids = snapshot['item_ids'].tolist()
+            matrix.user_index = {u: i for i, u in enumerate(matrix.user_ids)}
+            matrix.item_index = {n: i for i, n in enumerate(matrix.item_ids)}
+            matrix._csr = sp.csr_matrix(
+                (snapshot['data'], snapshot['indices'], snapshot['indptr']),
+                shape=tuple(snapshot['shape']),
+            )
+            matrix.version = int(snapshot['version'])
+        return matrix
+
+
+_matrix = None
+_saved_version = 0
+_matrix_lock = threading.Lock()
+
+
+@span('interaction_matrix.get')
+def get_interaction_matrix(store):
+    """
+    Return the process-wide interaction matrix, caught up with the log store.
+    The first call starts from the on-disk snapshot when one matches the store.
+    """
+    global _matrix, _saved_version
+    with _matrix_lock:
+        if _matrix is None:
+            matrix = None
+            if os.path.exists(INTERACTION_MATRIX_PATH):
+                try:
+                    matrix = InteractionMatrix.load(INTERACTION_MATRIX_PATH)
+                except (OSError, ValueError, KeyError):
+                    matrix = None
+            # A snapshot ahead of the store belongs to a different log; start over
+            if matrix is None or matrix.version > store.version():
+                matrix = InteractionMatrix()
+            # Retention only deletes rows a snapshot covered, so this one lost it: the rebuild misses them
+            if matrix.version < store.pruned_through():
+                registry.incr('interaction_matrix.partial_rebuild')
+            _matrix = matrix
+            _saved_version = matrix.version
+        _matrix.refresh(store)
+        if _matrix.version - _saved_version >= SNAPSHOT_EVERY or (_saved_version == 0 and _matrix.version > 0):
+            _matrix.save(INTERACTION_MATRIX_PATH)
+            _saved_version = _matrix.version
+        return _matrix
+
+
+@span('interaction_matrix.refresh')
+def refresh_interaction_matrix(store):
+    """Fold new log rows into the matrix if this process has one loaded."""
+    if _matrix is not None:
+        get_interaction_matrix(store)
@@ -0,0 +1,438 @@
+import io
+import os
+import sqlite3
+from abc import ABC, abstractmethod
+import threading
+import numpy as np
+import pandas as pd
+from utils.cleaner import parse_dates
+from utils.file_lock import file_lock
+from utils.instrument import span
+
+LOG_COLUMNS = ['user_id', 'news_id', 'action', 'timestamp']
+
+USER_LOGS_CSV_PATH = os.path.join('user_logs', 'user_logs.csv')
+USER_LOGS_DB_PATH = os.path.join('user_logs', 'user_logs.db')
+
+# Backend used by get_log_store(): 'sqlite' (default) or 'csv'
+LOG_BACKEND = os.environ.get('CARVED_LOG_BACKEND', 'sqlite')
+
+# Rows per chunk when the log is streamed instead of loaded at once
+LOG_CHUNK_SIZE = 100_000
+
+ACTIONS = ['like', 'discard']
+
+
+def empty_logs():
+    """Return an empty log DataFrame with the expected columns."""
+    return pd.DataFrame(columns=LOG_COLUMNS)
+
+
+def _normalise_columns(logs):
+    logs.columns = [str(col).strip() for col in logs.columns]
+    if list(logs.columns).count('timestamp') > 1:
+        stamps = logs.loc[:, logs.columns == 'timestamp']
+        merged = stamps.iloc[:, -1]
+        for i in range(stamps.shape[1] - 2, -1, -1):
+            merged = merged.combine_first(stamps.iloc[:, i])
+        logs = logs.loc[:, logs.columns != 'timestamp']
+        logs['timestamp'] = merged
+    for col in LOG_COLUMNS:
+        if col not in logs.columns:
+            logs[col] = None
+    return logs[LOG_COLUMNS]
+
+
+def read_log_csv(path):
+    """
+    Read a user log CSV into the standard columns.
+    Older log files have a stray 'timestamp ' header column; duplicate
+    timestamp columns are merged, keeping the last non-empty value.
+    """
+    return _normalise_columns(pd.read_csv(path))
+
+
+def iter_log_csv(path, chunksize=None):
+    """Read a user log CSV in chunks of `chunksize` rows, normalised like read_log_csv."""
+    with pd.read_csv(path, chunksize=chunksize or LOG_CHUNK_SIZE) as reader:
+        for chunk in reader:
+            yield _normalise_columns(chunk)
+
+
+def compact_logs(logs):
+    """
+    Log rows with compact, typed columns: categorical user_id and action,
+    int32 news_id and int64 timestamps (seconds since the epoch, 0 when
+    missing or unparsable). An 'id' column is kept as int64.
+    """
+    stamps = parse_dates(logs['timestamp'])
+    seconds = stamps.to_numpy('datetime64[s]').view('int64').copy()
+    seconds[stamps.isna().to_numpy()] = 0
+    compact = pd.DataFrame({
+        'user_id': logs['user_id'].astype(str).astype('category'),
+        'news_id': pd.to_numeric(logs['news_id'], errors='coerce').fillna(-1).astype('int32').to_numpy(),
+        'action': pd.Categorical(logs['action'], categories=ACTIONS),
+        'timestamp': seconds,
+    }, index=logs.index)
+    if 'id' in logs.columns:
+        compact.insert(0, 'id', logs['id'].astype('int64'))
+    return compact
+
+
+class LogStore(ABC):
+    """Interface for interaction log backends; a backend missing a method cannot be instantiated."""
+
+    @abstractmethod
+    def append(self, user_id, news_id, action, timestamp):
+        """Append one interaction."""
+
+    @abstractmethod
+    def load(self, user_id=None):
+        """All rows, or one user's rows."""
+
+    @abstractmethod
+    def version(self, user_id=None):
+        """Monotonic id of the most recent interaction, overall or for one user (0 when empty)."""
+
+    @abstractmethod
+    def user_ids(self):
+        """Distinct users with at least one interaction."""
+
+    @abstractmethod
+    def load_since(self, last_id):
+        """Rows appended after interaction id `last_id`, with their ids in an 'id' column."""
+
+    def iter_since(self, last_id, chunksize=LOG_CHUNK_SIZE):
+        """load_since in chunks of at most `chunksize` rows, so callers can stream the history."""
+        yield self.load_since(last_id)
+
+    def load_users(self, user_ids):
+        """Rows of several users at once."""
+        logs = [self.load(user_id) for user_id in user_ids]
+        return pd.concat(logs) if logs else empty_logs()
+
+    # Whether old interactions can be deleted (see delete_before and utils/rollups.py)
+    supports_retention = False
+
+    def pruned_through(self):
+        """Highest interaction id up to which old rows may have been deleted (0 when the log is complete)."""
+        return 0
+
+
+class CSVLogStore(LogStore):
+    """
+    Append-only CSV backend. Each interaction is a single appended line;
+    reads scan the file in chunks, so only the requested rows are kept in memory.
+    """
+
+    def __init__(self, path=USER_LOGS_CSV_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        # Bytes of the file already counted, their rows and each user's last row (by str(user_id))
+        self._offset = 0
+        self._rows = 0
+        self._last = {}
+
+    def _header(self):
+        with open(self.path, 'r', newline='') as f:
+            return [col.strip() for col in f.readline().rstrip('\r\n').split(',')]
+
+    def append(self, user_id, news_id, action, timestamp):
+        row = {'user_id': user_id, 'news_id': int(news_id), 'action': action, 'timestamp': timestamp}
+        with self._lock:
+            if os.path.exists(self.path) and os.path.getsize(self.path) > 0:
+                # Match whatever column layout the existing file uses
+                columns = self._header()
+                new_file = False
+            else:
+                columns = LOG_COLUMNS
+                new_file = True
+            line = pd.DataFrame([[row.get(col, '') for col in columns]], columns=columns)
+            line.to_csv(self.path, mode='a', header=new_file, index=False)
+
+    def _chunks(self, chunksize=None):
+        if os.path.exists(self.path) and os.path.getsize(self.path) > 0:
+            yield from iter_log_csv(self.path, chunksize)
+
+    def load(self, user_id=None):
+        if user_id is None:
+            return read_log_csv(self.path) if os.path.exists(self.path) else empty_logs()
+        return self.load_users([user_id])
+
+    def load_users(self, user_ids):
+        wanted = set(user_ids)
+        parts = [chunk[chunk['user_id'].isin(wanted)] for chunk in self._chunks()]
+        return pd.concat(parts) if parts else empty_logs()
+
+    def _scan(self):
+        """Count the lines appended since the last call, so version() never rereads the whole file."""
+        with self._lock:
+            size = os.path.getsize(self.path) if os.path.exists(self.path) else 0
+            if size < self._offset:
+                # Replaced or truncated: count from the start
+                self._offset, self._rows, self._last = 0, 0, {}
+            if size == self._offset:
+                return
+            with open(self.path, 'rb') as f:
+                header = f.readline()
+                start = max(self._offset, len(header))
+                f.seek(start)
+                tail = f.read(size - start)
+            # A partly written last line is left for the next call
+            tail = tail[:tail.rfind(b'\n') + 1]
+            if tail:
+                rows = _normalise_columns(pd.read_csv(io.BytesIO(header + tail)))
+                ids = np.arange(self._rows + 1, self._rows + 1 + len(rows))
+                self._last.update(zip(rows['user_id'].astype(str).tolist(), ids.tolist()))
+                self._rows += len(rows)
+            self._offset = start + len(tail)
+
+    # Interaction ids are 1-based row positions in the file
+    def version(self, user_id=None):
+        self._scan()
+        return self._rows if user_id is None else self._last.get(str(user_id), 0)
+
+    def user_ids(self):
+        users = {}
+        for chunk in self._chunks():
+            users.update(dict.fromkeys(chunk['user_id'].dropna().unique().tolist()))
+        return list(users)
+
+    def load_since(self, last_id):
+        parts = list(self.iter_since(last_id))
+        return pd.concat(parts) if parts else empty_logs().assign(id=pd.Series(dtype='int64'))
+
+    def iter_since(self, last_id, chunksize=LOG_CHUNK_SIZE):
+        start = 0
+        for chunk in self._chunks(chunksize):
+            end = start + len(chunk)
+            if end > last_id:
+                chunk = chunk.iloc[max(last_id - start, 0):]
+                first = max(last_id, start) + 1
+                yield chunk.assign(id=range(first, first + len(chunk)))
+            start = end
+
+
+class SQLiteLogStore(LogStore):
+    """
+    SQLite backend in WAL mode. Rows are only inserted (old ones may be deleted
+    by the retention policy in utils/rollups.py), and lookups by user_id or
+    news_id go through an index instead of scanning the history.
+    """
+
+    supports_retention = True
+
+    def __init__(self, path=USER_LOGS_DB_PATH):
+        self.path = path
+        self._local = threading.local()
+        self._init_schema()
+
+    def _connect(self):
+        # One connection per thread; a forked worker process opens its own
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def close(self):
+        """Checkpoint the WAL into the database file and close this thread's connection."""
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+            conn.execute('PRAGMA journal_mode=DELETE')
+            conn.close()
+            self._local.conn = None
+
+    def _init_schema(self):
+        conn = self._connect()
+        with conn:
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS interactions ('
+                'id INTEGER PRIMARY KEY AUTOINCREMENT, '
+                'user_id TEXT NOT NULL, '
+                'news_id INTEGER NOT NULL, '
+                'action TEXT NOT NULL, '
+                'timestamp TEXT)'
+            )
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_interactions_user ON interactions (user_id, id)')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_interactions_news ON interactions (news_id)')
+            conn.execute('CREATE TABLE IF NOT EXISTS log_meta (name TEXT PRIMARY KEY, value INTEGER NOT NULL)')
+
+    @span('log_store.append')
+    def append(self, user_id, news_id, action, timestamp):
+        conn = self._connect()
+        with conn:
+            conn.execute(
+                'INSERT INTO interactions (user_id, news_id, action, timestamp) VALUES (?, ?, ?, ?)',
+                (str(user_id), int(news_id), action, timestamp),
+            )
+
+    def append_many(self, logs):
+        """Insert every row of a log DataFrame in one transaction."""
+        rows = [
+            (str(u), int(n), a, None if pd.isna(t) else str(t))
+            for u, n, a, t in logs[LOG_COLUMNS].itertuples(index=False, name=None)
+        ]
+        conn = self._connect()
+        with conn:
+            conn.executemany(
+                'INSERT INTO interactions (user_id, news_id, action, timestamp) VALUES (?, ?, ?, ?)',
+                rows,
+            )
+        return len(rows)
+
+    def count(self):
+        return self._connect().execute('SELECT COUNT(*) FROM interactions').fetchone()[0]
+
+    @span('log_store.load')
+    def load(self, user_id=None):
+        query = 'SELECT user_id, news_id, action, timestamp FROM interactions'
+        params = ()
+        if user_id is not None:
+            query += ' WHERE user_id = ?'
+            params = (str(user_id),)
+        query += ' ORDER BY id'
+        logs = pd.read_sql_query(query, self._connect(), params=params)
+        if logs.empty:
+            return empty_logs()
+        return logs
+
+    def version(self, user_id=None):
+        if user_id is None:
+            return self._connect().execute('SELECT COALESCE(MAX(id), 0) FROM interactions').fetchone()[0]
+        return self._connect().execute(
+            'SELECT COALESCE(MAX(id), 0) FROM interactions WHERE user_id = ?', (str(user_id),)
+        ).fetchone()[0]
+
+    def user_ids(self):
+        return [row[0] for row in self._connect().execute('SELECT DISTINCT user_id FROM interactions')]
+
+    def pruned_through(self):
+        row = self._connect().execute("SELECT value FROM log_meta WHERE name = 'pruned_through'").fetchone()
+        return 0 if row is None else int(row[0])
+
+    # Ids are never reused (AUTOINCREMENT), so versions stay monotonic after a delete;
+    # rows without a timestamp are kept
+    @span('log_store.delete_before')
+    def delete_before(self, timestamp, max_id):
+        """
+        Delete interactions dated before `timestamp` (ISO format) with an id of
+        at most `max_id`, and record `max_id` as pruned_through() so later
+        rebuilds from the log know it is incomplete. Returns the number deleted.
+        """
+        conn = self._connect()
+        with conn:
+            deleted = conn.execute(
+                'DELETE FROM interactions WHERE id <= ? AND timestamp < ?', (int(max_id), str(timestamp))
+            ).rowcount
+            conn.execute(
+                "INSERT INTO log_meta (name, value) VALUES ('pruned_through', ?) "
+                "ON CONFLICT (name) DO UPDATE SET value = MAX(value, excluded.value)",
+                (int(max_id),),
+            )
+            return deleted
+
+    @span('log_store.load_since')
+    def load_since(self, last_id):
+        return pd.read_sql_query(
+            'SELECT id, user_id, news_id, action, timestamp FROM interactions WHERE id > ? ORDER BY id',
+            self._connect(),
+            params=(int(last_id),),
+        )
+
+    def iter_since(self, last_id, chunksize=LOG_CHUNK_SIZE):
+        # Keyset pagination on the primary key: each page is an index range scan
+        conn = self._connect()
+        while True:
+            chunk = pd.read_sql_query(
+                'SELECT id, user_id, news_id, action, timestamp FROM interactions WHERE id > ? ORDER BY id LIMIT ?',
+                conn,
+                params=(int(last_id), int(chunksize)),
+            )
+            if chunk.empty:
+                return
+            yield chunk
+            last_id = int(chunk['id'].iloc[-1])
+            if len(chunk) < chunksize:
+                return
+
+    @span('log_store.load_users')
+    def load_users(self, user_ids):
+        user_ids = [str(user_id) for user_id in user_ids]
+        parts = []
+        # Stay below SQLite's limit on bound parameters
+        for start in range(0, len(user_ids), 500):
+            batch = user_ids[start:start + 500]
+            parts.append(pd.read_sql_query(
+                f"SELECT user_id, news_id, action, timestamp FROM interactions "
+                f"WHERE user_id IN ({', '.join('?' * len(batch))}) ORDER BY id",
+                self._connect(),
+                params=batch,
+            ))
+        return pd.concat(parts) if parts else empty_logs()
+
+
+def migrate_csv_to_sqlite(csv_path=USER_LOGS_CSV_PATH, db_path=USER_LOGS_DB_PATH):
+    """
+    One-shot migration of a CSV log into the SQLite store. The database is
+    built under a temporary name and renamed into place, so a failed
+    migration leaves no database behind and is retried on the next start.
+    Refuses to run against a database that already holds interactions.
+    Returns the number of migrated rows.
+    """
+    with file_lock(db_path + '.lock'):
+        if os.path.exists(db_path) and SQLiteLogStore(db_path).count() > 0:
+            raise ValueError(f"{db_path} already contains interactions; not migrating")
+        if not os.path.exists(csv_path):
+            return 0
+        tmp_path = db_path + '.migrating'
+        for leftover in (tmp_path, tmp_path + '-wal', tmp_path + '-shm'):
+            if os.path.exists(leftover):
+                os.remove(leftover)
+        store = SQLiteLogStore(tmp_path)
+        logs = read_log_csv(csv_path).dropna(subset=['user_id', 'news_id', 'action'])
+        migrated = store.append_many(logs)
+        store.close()
+        os.replace(tmp_path, db_path)
+        return migrated
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_log_store(backend=None):
+    """
+    Return the process-wide log store for the configured backend.
+    The first time the SQLite store is created, an existing CSV log is migrated into it.
+    """
+    backend = backend or LOG_BACKEND
+    with _stores_lock:
+        if backend not in _stores:
+            if backend == 'csv':
+                _stores[backend] = CSVLogStore(USER_LOGS_CSV_PATH)
+            elif backend == 'sqlite':
+                if not os.path.exists(USER_LOGS_DB_PATH) and os.path.exists(USER_LOGS_CSV_PATH):
+                    try:
+                        migrate_csv_to_sqlite(USER_LOGS_CSV_PATH, USER_LOGS_DB_PATH)
+                    except ValueError:
+                        # Another process migrated while this one waited for the lock
+                        pass
+                _stores[backend] = SQLiteLogStore(USER_LOGS_DB_PATH)
+            else:
+                raise ValueError(f"Unknown log backend: {backend}")
+        return _stores[backend]
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Migrate a CSV user log into the SQLite log store.')
+    parser.add_argument('--csv', default=USER_LOGS_CSV_PATH)
+    parser.add_argument('--db', default=USER_LOGS_DB_PATH)
+    args = parser.parse_args()
+    migrated = migrate_csv_to_sqlite(args.csv, args.db)
+    print(f"Migrated {migrated} interactions from {args.csv} to {args.db}")
@@ -0,0 +1,171 @@
+import threading
+from collections import deque
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+from utils.instrument import span
+from utils.log_store import LOG_CHUNK_SIZE, compact_logs, get_log_store
+
+# Most recent distinct likes per user that new likes are paired with
+MAX_HISTORY = 50
+
+_NO_TIME = np.iinfo(np.int64).max
+_STATS_AGG = {'interactions': 'sum', 'likes': 'sum', 'discards': 'sum', 'first_ts': 'min', 'last_ts': 'max'}
+
+
+class LogAggregator:
+    """
+    Single pass over the interaction log in chunks. Keeps per-user totals
+    (interactions, likes, discards, first and last timestamp) and symmetric
+    item-item co-like counts: each new like is paired with the user's last
+    `max_history` distinct likes. Memory is bounded by the number of users,
+    items and co-occurring pairs, not by the length of the log. Rows written
+    later are folded in with refresh.
+    """
+
+    def __init__(self, max_history=MAX_HISTORY):
+        self.max_history = max_history
+        self.rows = 0
+        self.version = 0
+        self._stats = None
+        self.item_ids = []
+        self.item_index = {}
+        self._history = {}
+        self._cooccurrence = sp.csr_matrix((0, 0), dtype=np.int32)
+
+    def _item_col(self, news_id):
+        col = self.item_index.get(news_id)
+        if col is None:
+            col = len(self.item_ids)
+            self.item_index[news_id] = col
+            self.item_ids.append(news_id)
+        return col
+
+    def _update_stats(self, chunk):
+        ts = chunk['timestamp'].to_numpy()
+        per_row = pd.DataFrame({
+            'interactions': np.ones(len(chunk), dtype=np.int64),
+            'likes': (chunk['action'] == 'like').to_numpy(np.int64),
+            'discards': (chunk['action'] == 'discard').to_numpy(np.int64),
+            'first_ts': np.where(ts > 0, ts, _NO_TIME),
+            'last_ts': ts,
+        })
+        stats = per_row.groupby(chunk['user_id'].to_numpy()).agg(_STATS_AGG)
+        if self._stats is not None:
+            stats = pd.concat([self._stats, stats]).groupby(level=0).agg(_STATS_AGG)
+        self._stats = stats
+
+    def _update_cooccurrence(self, chunk):
+        likes = chunk[chunk['action'] == 'like']
+        rows, cols = [], []
+        for user_id, news_id in zip(likes['user_id'].to_numpy(), likes['news_id'].to_numpy()):
+            col = self._item_col(int(news_id))
+            history = self._history.get(user_id)
+            if history is None:
+                history = self._history[user_id] = deque(maxlen=self.max_history)
+            elif col in history:
+                # A repeated like adds no new pairs
+                continue
+            rows.extend(history)
+            cols.extend([col] * len(history))
+            history.append(col)
+        n_items = len(self.item_ids)
+        counts = self._cooccurrence
+        if counts.shape != (n_items, n_items):
+            counts = counts.copy()
+            counts.resize((n_items, n_items))
+        if rows:
+            pairs = sp.csr_matrix(
+                (np.ones(2 * len(rows), dtype=np.int32), (rows + cols, cols + rows)), shape=(n_items, n_items)
+            )
+            counts = counts + pairs
+        self._cooccurrence = counts.tocsr()
+
+    def update(self, chunk):
+        """Fold one chunk of log rows into the aggregates."""
+        chunk = compact_logs(chunk)
+        self.rows += len(chunk)
+        if 'id' in chunk.columns and len(chunk):
+            self.version = max(self.version, int(chunk['id'].max()))
+        self._update_stats(chunk)
+        self._update_cooccurrence(chunk)
+        return self
+
+    @property
+    def user_stats(self):
+        """Per-user totals indexed by user_id (timestamps in epoch seconds, 0 when unknown)."""
+        if self._stats is None:
+            return pd.DataFrame(columns=list(_STATS_AGG), dtype='int64')
+        return self._stats.assign(first_ts=self._stats['first_ts'].replace(_NO_TIME, 0))
+
+    def refresh(self, store, chunksize=LOG_CHUNK_SIZE):
+        """Fold log rows written since this aggregator's version."""
+        for chunk in store.iter_since(self.version, chunksize):
+            self.update(chunk)
+        return self
+
+    def cooccurrence(self):
+        """Items x items CSR matrix of co-like counts, ordered like `item_ids`."""
+        return self._cooccurrence
+
+    def top_cooccurring(self, news_id, k=10):
+        """[(news_id, count), ...] most often liked by the same users as `news_id`."""
+        col = self.item_index.get(news_id)
+        if col is None:
+            return []
+        row = self._cooccurrence.getrow(col)
+        order = np.argsort(-row.data, kind='stable')[:k]
+        return [(self.item_ids[row.indices[i]], int(row.data[i])) for i in order]
+
+    def colike_scores(self, news_ids):
+        """{news_id: count} of how often other items were liked together with any of `news_ids`."""
+        cols = [self.item_index[n] for n in news_ids if n in self.item_index]
+        if not cols:
+            return {}
+        totals = self._cooccurrence[cols].sum(axis=0).A1
+        hits = np.flatnonzero(totals)
+        return {self.item_ids[c]: int(totals[c]) for c in hits}
+
+
+def aggregate_logs(store=None, chunksize=LOG_CHUNK_SIZE, max_history=MAX_HISTORY):
+    """Stream the whole log through a LogAggregator."""
+    store = store or get_log_store()
+    return LogAggregator(max_history).refresh(store, chunksize)
+
+
+_aggregator = None
+_aggregator_lock = threading.Lock()
+
+
+@span('log_stream.get')
+def get_log_aggregates(store):
+    """
+    Return the process-wide aggregator, caught up with the log store. It is
+    built in one streamed pass on first use and refreshed lazily, so likes
+    cost nothing until co-like counts are asked for.
+    """
+    global _aggregator
+    with _aggregator_lock:
+        if _aggregator is None:
+            _aggregator = LogAggregator()
+        return _aggregator.refresh(store)
+
+
+if __name__ == '__main__':
+    import argparse
+    import resource
+    import time
+    parser = argparse.ArgumentParser(description='Stream the interaction log and report per-user and co-like aggregates.')
+    parser.add_argument('--chunksize', type=int, default=LOG_CHUNK_SIZE)
+    parser.add_argument('--max-history', type=int, default=MAX_HISTORY)
+    parser.add_argument('--top', type=int, default=5)
+    args = parser.parse_args()
+    start = time.perf_counter()
+    aggregator = aggregate_logs(chunksize=args.chunksize, max_history=args.max_history)
+    elapsed = time.perf_counter() - start
+    peak_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(f"{aggregator.rows} rows, {len(aggregator.user_stats)} users, {len(aggregator.item_ids)} liked items, "
+          f"{aggregator.cooccurrence().nnz} co-like pairs in {elapsed:.1f}s (peak RSS {peak_mb:.0f} MB)")
+    print(aggregator.user_stats.sort_values('interactions', ascending=False).head(args.top).to_string())
+    for news_id in aggregator.item_ids[:args.top]:
+        print(f"news {news_id}: {aggregator.top_cooccurring(news_id, args.top)}")
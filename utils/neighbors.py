@@ -0,0 +1,331 @@
+import os
+import threading
+import time
+import numpy as np
+import pandas as pd
+from utils.instrument import span
+
+NEIGHBOR_INDEX_PATH = os.path.join('user_logs', 'neighbor_index.npz')
+
+# Backend used by get_neighbor_index(): 'exact' (default) or 'lsh'
+NEIGHBOR_BACKEND = os.environ.get('CARVED_NEIGHBOR_BACKEND', 'exact')
+
+# Users scored per block by the exact backend
+BLOCK_SIZE = 65536
+
+
+def _top_k(rows, scores, k):
+    """Best k (row, score) pairs, highest score first and lower row first on ties."""
+    if len(rows) > k:
+        kth = np.partition(scores, len(scores) - k)[len(scores) - k]
+        above = np.flatnonzero(scores > kth)
+        # Break ties at the cut-off in favour of lower rows
+        tied = np.flatnonzero(scores == kth)
+        need = k - len(above)
+        if len(tied) > need:
+            tied = tied[np.argpartition(rows[tied], need - 1)[:need]]
+        keep = np.concatenate([above, tied])
+        rows, scores = rows[keep], scores[keep]
+    order = np.lexsort((rows, -scores))
+    return rows[order], scores[order]
+
+
+class ExactNeighborIndex:
+    """
+    Exact top-k similar users by dot product, scored block by block with
+    np.argpartition so only k candidates per block are ever sorted.
+    """
+
+    backend = 'exact'
+
+    def __init__(self, block_size=BLOCK_SIZE):
+        self.block_size = block_size
+        self.version = 0
+
+    def build(self, matrix):
+        self.version = matrix.version
+        return self
+
+    def refresh(self, matrix, store=None):
+        self.version = matrix.version
+        return 0
+
+    def query(self, matrix, row, k):
+        """Top-k (rows, similarities) for the user at `row`, excluding that user."""
+        user_item = matrix.tocsr()
+        query_vec = user_item[row].T
+        best_rows = np.empty(0, dtype=np.int64)
+        best_scores = np.empty(0, dtype=np.float32)
+        for start in range(0, user_item.shape[0], self.block_size):
+            block = user_item[start:start + self.block_size]
+            sims = np.asarray((block @ query_vec).todense()).ravel()
+            rows = np.arange(start, start + len(sims))
+            mask = rows != row
+            rows, sims = _top_k(rows[mask], sims[mask], k)
+            best_rows, best_scores = _top_k(
+                np.concatenate([best_rows, rows]), np.concatenate([best_scores, sims]), k
+            )
+        return best_rows, best_scores
+
+    def query_many(self, matrix, rows, k):
+        """
+        Top-k similar users for a block of users with one sparse product.
+        Returns one array of neighbour rows per query, in the same order as query().
+        """
+        user_item = matrix.tocsr()
+        sims = (user_item[rows] @ user_item.T).tocsr()
+        results = []
+        for i, row in enumerate(rows):
+            start, end = sims.indptr[i], sims.indptr[i + 1]
+            cols = sims.indices[start:end].astype(np.int64)
+            vals = sims.data[start:end]
+            mask = (cols != row) & (vals > 0)
+            top, _ = _top_k(cols[mask], vals[mask], k)
+            if len(top) < k:
+                # Users with zero similarity fill the remaining slots, lowest rows first
+                taken = set(top.tolist())
+                taken.add(int(row))
+                fill = []
+                candidate = 0
+                while len(top) + len(fill) < k and candidate < user_item.shape[0]:
+                    if candidate not in taken:
+                        fill.append(candidate)
+                    candidate += 1
+                top = np.concatenate([top, np.array(fill, dtype=np.int64)])
+            results.append(top)
+        return results
+
+
+def _item_projections(item_ids, n_bits, seed):
+    """
+    Deterministic +/-1 random projection rows for each news id, derived from a
+    hash of (news_id, bit) so they never need to be stored or kept in sync.
+    """
+    ids = np.asarray(item_ids, dtype=np.uint64)[:, None]
+    bits = np.arange(n_bits, dtype=np.uint64)[None, :] + np.uint64(seed)
+    with np.errstate(over='ignore'):
+        x = ids * np.uint64(0x9E3779B97F4A7C15) + bits * np.uint64(0xBF58476D1CE4E5B9)
+        x ^= x >> np.uint64(31)
+        x *= np.uint64(0x94D049BB133111EB)
+        x ^= x >> np.uint64(29)
+    return np.where(x & np.uint64(1), 1, -1).astype(np.int8)
+
+
+class LSHNeighborIndex:
+    """
+    Approximate similar-user lookup with random-projection (cosine) LSH.
+    Each of `n_tables` hash tables buckets users by the signs of `n_bits`
+    projections of their like vector; candidates from the query's buckets
+    are then re-ranked exactly.
+    """
+
+    backend = 'lsh'
+
+    def __init__(self, n_tables=12, n_bits=6, seed=0):
+        self.n_tables = n_tables
+        self.n_bits = n_bits
+        self.seed = seed
+        self.version = 0
+        self.keys = np.empty((0, n_tables), dtype=np.int64)
+        self._projections = np.empty((0, n_tables * n_bits), dtype=np.int8)
+        self._buckets = [{} for _ in range(n_tables)]
+
+    def _signatures(self, matrix, rows):
+        n_items = matrix.shape[1]
+        if len(self._projections) < n_items:
+            extra = _item_projections(matrix.item_ids[len(self._projections):n_items], self.n_tables * self.n_bits, self.seed)
+            self._projections = np.vstack([self._projections, extra])
+        user_item = matrix.tocsr()[rows]
+        projected = user_item @ self._projections[:n_items].astype(np.float32)
+        signs = (np.asarray(projected) > 0).reshape(len(rows), self.n_tables, self.n_bits)
+        weights = np.left_shift(1, np.arange(self.n_bits, dtype=np.int64))
+        return signs.astype(np.int64) @ weights
+
+    def _index_rows(self, rows, keys):
+        for row, row_keys in zip(rows, keys):
+            for table, key in enumerate(row_keys):
+                self._buckets[table].setdefault(int(key), set()).add(int(row))
+
+    def _unindex_rows(self, rows):
+        for row in rows:
+            for table, key in enumerate(self.keys[row]):
+                bucket = self._buckets[table].get(int(key))
+                if bucket is not None:
+                    bucket.discard(int(row))
+
+    def build(self, matrix, block_size=BLOCK_SIZE):
+        self.keys = np.empty((matrix.shape[0], self.n_tables), dtype=np.int64)
+        self._buckets = [{} for _ in range(self.n_tables)]
+        for start in range(0, matrix.shape[0], block_size):
+            rows = np.arange(start, min(start + block_size, matrix.shape[0]))
+            self.keys[rows] = self._signatures(matrix, rows)
+            self._index_rows(rows, self.keys[rows])
+        self.version = matrix.version
+        return self
+
+    def update_rows(self, matrix, rows):
+        """Re-hash the given users, e.g. after they liked something new."""
+        rows = np.unique(np.asarray(rows, dtype=np.int64))
+        n_users = matrix.shape[0]
+        if len(self.keys) < n_users:
+            grow = np.zeros((n_users - len(self.keys), self.n_tables), dtype=np.int64)
+            new_rows = np.arange(len(self.keys), n_users)
+            self.keys = np.vstack([self.keys, grow])
+            self._index_rows(new_rows, grow)
+            rows = np.union1d(rows, new_rows)
+        if len(rows) == 0:
+            return
+        self._unindex_rows(rows)
+        self.keys[rows] = self._signatures(matrix, rows)
+        self._index_rows(rows, self.keys[rows])
+
+    def refresh(self, matrix, store):
+        """Re-hash users with log rows written since this index's version."""
+        touched = set()
+        for new_rows in store.iter_since(self.version):
+            new_rows = new_rows[new_rows['id'] <= matrix.version]
+            touched.update(matrix.user_index[u] for u in pd.unique(new_rows['user_id']) if u in matrix.user_index)
+        self.update_rows(matrix, sorted(touched))
+        self.version = matrix.version
+        return len(touched)
+
+    def candidates(self, row):
+        found = set()
+        for table, key in enumerate(self.keys[row]):
+            found.update(self._buckets[table].get(int(key), ()))
+        found.discard(int(row))
+        return np.fromiter(found, dtype=np.int64, count=len(found))
+
+    def query(self, matrix, row, k):
+        """Approximate top-k (rows, similarities); may return fewer than k users."""
+        rows = self.candidates(row)
+        if len(rows) == 0:
+            return rows, np.empty(0, dtype=np.float32)
+        user_item = matrix.tocsr()
+        sims = np.asarray((user_item[rows] @ user_item[row].T).todense()).ravel()
+        return _top_k(rows, sims, k)
+
+    def query_many(self, matrix, rows, k):
+        return [self.query(matrix, row, k)[0] for row in rows]
+
+    def save(self, path=NEIGHBOR_INDEX_PATH):
+        tmp_path = path + '.tmp.npz'
+        np.savez(
+            tmp_path,
+            keys=self.keys,
+            params=np.array([self.n_tables, self.n_bits, self.seed]),
+            version=np.array(self.version),
+        )
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path=NEIGHBOR_INDEX_PATH):
+        with np.load(path) as snapshot:
+            n_tables, n_bits, seed = (int(v) for v in snapshot['params'])
+            index = cls(n_tables=n_tables, n_bits=n_bits, seed=seed)
+            index.keys = snapshot['keys']
+            index.version = int(snapshot['version'])
+        index._index_rows(np.arange(len(index.keys)), index.keys)
+        return index
+
+
+def build_neighbor_index(matrix, backend=None, **params):
+    """Build a neighbour index over every user in the interaction matrix."""
+    backend = backend or NEIGHBOR_BACKEND
+    if backend == 'exact':
+        return ExactNeighborIndex(**params).build(matrix)
+    if backend == 'lsh':
+        return LSHNeighborIndex(**params).build(matrix)
+    raise ValueError(f"Unknown neighbour backend: {backend}")
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+@span('neighbors.get_index')
+def get_neighbor_index(matrix, store):
+    """
+    Return the process-wide neighbour index, refreshed up to the matrix version.
+    The LSH backend starts from its offline-built snapshot when one is available.
+    """
+    global _index
+    with _index_lock:
+        if _index is None or _index.backend != NEIGHBOR_BACKEND:
+            index = None
+            if NEIGHBOR_BACKEND == 'lsh' and os.path.exists(NEIGHBOR_INDEX_PATH):
+                try:
+                    index = LSHNeighborIndex.load(NEIGHBOR_INDEX_PATH)
+                except (OSError, ValueError, KeyError):
+                    index = None
+                if index is not None and (index.version > matrix.version or len(index.keys) > matrix.shape[0]):
+                    index = None
+            _index = index or build_neighbor_index(matrix)
+        if _index.version < matrix.version:
+            _index.refresh(matrix, store)
+        return _index
+
+
+def recall_latency_report(matrix, k=10, n_queries=200, lsh_params=None, seed=0):
+    """
+    Compare approximate LSH lookups against the exact backend on a sample of users.
+    Recall@k counts how many of the exact neighbours with a positive similarity
+    the approximate index also returns. Returns one row per configuration.
+    """
+    lsh_params = lsh_params or [{'n_tables': t, 'n_bits': b} for t, b in [(8, 8), (12, 6), (16, 5), (24, 4)]]
+    user_item = matrix.tocsr()
+    active = np.flatnonzero(np.diff(user_item.indptr))
+    if len(active) == 0:
+        return pd.DataFrame()
+    rng = np.random.default_rng(seed)
+    queries = rng.choice(active, size=min(n_queries, len(active)), replace=False)
+
+    def run(index):
+        results, latencies = [], []
+        for row in queries:
+            start = time.perf_counter()
+            rows, sims = index.query(matrix, row, k)
+            latencies.append((time.perf_counter() - start) * 1000)
+            results.append(set(rows[sims > 0].tolist()))
+        return results, np.array(latencies)
+
+    exact_results, exact_latency = run(ExactNeighborIndex().build(matrix))
+    report = [{
+        'backend': 'exact', 'params': '', 'build_s': 0.0, f'recall@{k}': 1.0,
+        'p50_ms': np.percentile(exact_latency, 50), 'p95_ms': np.percentile(exact_latency, 95),
+    }]
+    for params in lsh_params:
+        start = time.perf_counter()
+        index = LSHNeighborIndex(**params).build(matrix)
+        build_s = time.perf_counter() - start
+        approx_results, latency = run(index)
+        hits = sum(len(a & e) for a, e in zip(approx_results, exact_results))
+        total = sum(len(e) for e in exact_results)
+        report.append({
+            'backend': 'lsh', 'params': ', '.join(f'{key}={value}' for key, value in params.items()),
+            'build_s': build_s, f'recall@{k}': hits / total if total else 1.0,
+            'p50_ms': np.percentile(latency, 50), 'p95_ms': np.percentile(latency, 95),
+        })
+    return pd.DataFrame(report)
+
+
+if __name__ == '__main__':
+    import argparse
+    from utils.log_store import get_log_store
+    from utils.interaction_matrix import get_interaction_matrix
+
+    parser = argparse.ArgumentParser(description='Build the similar-user index or report LSH recall vs latency.')
+    parser.add_argument('command', choices=['build', 'report'])
+    parser.add_argument('--k', type=int, default=10)
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--tables', type=int, default=12)
+    parser.add_argument('--bits', type=int, default=6)
+    args = parser.parse_args()
+
+    matrix = get_interaction_matrix(get_log_store())
+    if args.command == 'build':
+        index = LSHNeighborIndex(n_tables=args.tables, n_bits=args.bits).build(matrix)
+        index.save(NEIGHBOR_INDEX_PATH)
+        print(f"Indexed {matrix.shape[0]} users into {NEIGHBOR_INDEX_PATH}")
+    else:
+        print(recall_latency_report(matrix, k=args.k, n_queries=args.queries).to_string(index=False))
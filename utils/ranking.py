@@ -0,0 +1,74 @@
+import numpy as np
+import pandas as pd
+
+# Candidate selection over NumPy arrays. Positions refer to rows of the frame
+# the arrays came from; ties are broken in favour of earlier rows.
+
+
+def sort_key(values):
+    """Numeric sort key for a column; strings such as ISO dates are ranked."""
+    values = pd.Series(values)
+    if pd.api.types.is_numeric_dtype(values) or pd.api.types.is_datetime64_any_dtype(values):
+        return values.to_numpy(dtype=np.float64, na_value=-np.inf)
+    codes, _ = pd.factorize(values, sort=True)
+    return codes.astype(np.float64)
+
+
+def top_per_category(categories, scores, k=1, mask=None):
+    """
+    Positions of the k highest-scoring rows of every category, in one lexsort.
+    Returns {category: positions} with categories in order of first appearance.
+    """
+    codes, uniques = pd.factorize(pd.Series(categories))
+    scores = np.asarray(scores, dtype=np.float64)
+    positions = np.flatnonzero(codes >= 0 if mask is None else (codes >= 0) & np.asarray(mask, dtype=bool))
+    if len(positions) == 0:
+        return {}
+    if k == 1:
+        # Hash groupby max, then the first row reaching it in each category
+        group_max = pd.Series(scores[positions]).groupby(codes[positions]).max()
+        best = np.full(len(uniques), -np.inf)
+        best[group_max.index.to_numpy()] = group_max.to_numpy()
+        hits = positions[scores[positions] == best[codes[positions]]]
+        hit_codes, first = np.unique(codes[hits], return_index=True)
+        return {uniques[code]: hits[i:i + 1] for code, i in sorted(zip(hit_codes, first))}
+    # lexsort is stable: category, then score descending, then row order
+    order = positions[np.lexsort((-scores[positions], codes[positions]))]
+    group_codes = codes[order]
+    starts = np.flatnonzero(np.r_[True, group_codes[1:] != group_codes[:-1]])
+    sizes = np.diff(np.r_[starts, len(order)])
+    rank = np.arange(len(order)) - np.repeat(starts, sizes)
+    keep = order[rank < k]
+    keep_codes = codes[keep]
+    return {uniques[code]: keep[keep_codes == code] for code in np.unique(keep_codes)}
+
+
+def select_diverse(categories, scores, top_n, category_order=None, mask=None, fill_from_other_categories=False):
+    """
+    Top-k per category, then round-robin fill: take the best row of each
+    category in `category_order` (default: order of first appearance) until
+    top_n rows are picked, then fill up with the best remaining rows overall.
+    With fill_from_other_categories, only rows from categories that were not
+    picked are used to fill. Returns an array of positions.
+    """
+    categories = pd.Series(categories).reset_index(drop=True)
+    scores = np.asarray(scores, dtype=np.float64)
+    best = top_per_category(categories, scores, k=1, mask=mask)
+    if category_order is None:
+        category_order = list(best)
+    picked = [best[cat][0] for cat in category_order if cat in best][:top_n]
+    if len(picked) < top_n:
+        available = np.ones(len(scores), dtype=bool) if mask is None else np.array(mask, dtype=bool)
+        available[picked] = False
+        if fill_from_other_categories:
+            available &= ~categories.isin(categories.iloc[picked]).to_numpy()
+        rest = np.flatnonzero(available)
+        need = min(top_n - len(picked), len(rest))
+        if need > 0:
+            # Only rows scoring at least the need-th best score can make the cut
+            cutoff = np.partition(scores[rest], len(rest) - need)[len(rest) - need]
+            rest = rest[scores[rest] >= cutoff]
+            rest = rest[np.lexsort((rest, -scores[rest]))][:need]
+            picked.extend(rest.tolist())
+    return np.array(picked, dtype=np.int64)
+
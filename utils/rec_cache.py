@@ -0,0 +1,110 @@
+import threading
+import time
+from collections import OrderedDict
+from utils.instrument import registry
+
+# Feeds kept in memory, least recently used evicted first
+REC_CACHE_SIZE = 1024
+
+# Seconds a feed is served as fresh; after that it is served once more while it is recomputed
+REC_CACHE_TTL = 300
+
+
+class _Entry:
+    def __init__(self, log_version, corpus_key, value):
+        self.log_version = log_version
+        self.corpus_key = corpus_key
+        self.value = value
+        self.computed_at = time.monotonic()
+
+
+class RecommendationCache:
+    """
+    In-process feeds keyed on (user_id, top_n), tagged with the user's log
+    version and the corpus key they were computed against.
+
+    A new interaction by the user invalidates their feeds, which are then
+    recomputed inline. A feed that has only outlived its TTL, or was computed
+    against an older corpus, is still returned while a background thread
+    recomputes it (stale-while-revalidate). Other users' interactions never
+    invalidate a feed.
+    """
+
+    def __init__(self, max_size=REC_CACHE_SIZE, ttl=REC_CACHE_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._refreshing = set()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _put(self, key, entry):
+        with self._lock:
+            current = self._entries.get(key)
+            # A slow background refresh must not replace a feed computed for a newer log version
+            if current is not None and current.log_version > entry.log_version:
+                return
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def _revalidate(self, key, log_version, corpus_key, compute):
+        with self._lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+
+        def run():
+            try:
+                self._put(key, _Entry(log_version, corpus_key, compute()))
+            finally:
+                with self._lock:
+                    self._refreshing.discard(key)
+
+        threading.Thread(target=run, name='rec-cache-refresh', daemon=True).start()
+
+    def get(self, user_id, top_n, log_version, corpus_key, compute):
+        """Return the cached feed or compute(); see the class docstring for when each happens."""
+        key = (user_id, top_n)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+        if entry is None or entry.log_version != log_version:
+            registry.incr('rec_cache.miss')
+            value = compute()
+            self._put(key, _Entry(log_version, corpus_key, value))
+            return value
+        if entry.corpus_key != corpus_key or time.monotonic() - entry.computed_at > self.ttl:
+            registry.incr('rec_cache.stale')
+            self._revalidate(key, log_version, corpus_key, compute)
+        else:
+            registry.incr('rec_cache.hit')
+        return entry.value
+
+    def invalidate(self, user_id=None):
+        """Drop the feeds of one user, or of everyone."""
+        with self._lock:
+            for key in [key for key in self._entries if user_id is None or key[0] == user_id]:
+                del self._entries[key]
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_recommendation_cache():
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = RecommendationCache()
+        return _cache
+
+
+def invalidate_user_recommendations(user_id):
+    """Drop the user's cached feeds if this process has the cache loaded."""
+    if _cache is not None:
+        _cache.invalidate(user_id)
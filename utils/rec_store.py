@@ -0,0 +1,104 @@
+import os
+import sqlite3
+import threading
+from datetime import datetime
+import pandas as pd
+
+RECOMMENDATIONS_DB_PATH = os.path.join('user_logs', 'recommendations.db')
+
+
+class RecommendationStore:
+    """
+    Precomputed feeds, one ranked list per user, written by the batch job and
+    read by the app. Each feed records the user's log version and the key of
+    the corpus it was computed against (utils.article_store.corpus_key) so stale
+    feeds can be skipped.
+    """
+
+    def __init__(self, path=RECOMMENDATIONS_DB_PATH):
+        self.path = path
+        self._local = threading.local()
+        conn = self._connect()
+        with conn:
+            # Feeds from before corpus keys were recorded cannot be validated; they are recomputed
+            columns = [row[1] for row in conn.execute('PRAGMA table_info(feeds)')]
+            if columns and 'corpus_key' not in columns:
+                conn.execute('DROP TABLE feeds')
+                conn.execute('DROP TABLE IF EXISTS feed_items')
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS feeds ('
+                'user_id TEXT PRIMARY KEY, '
+                'log_version INTEGER NOT NULL, '
+                'corpus_key TEXT NOT NULL, '
+                'computed_at TEXT NOT NULL)'
+            )
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS feed_items ('
+                'user_id TEXT NOT NULL, '
+                'rank INTEGER NOT NULL, '
+                'news_id INTEGER NOT NULL, '
+                'explanation TEXT, '
+                'PRIMARY KEY (user_id, rank))'
+            )
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute('PRAGMA journal_mode=WAL')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def write_many(self, feeds, corpus_key):
+        """
+        Replace the stored feeds for the given users in one transaction.
+        `feeds` maps user_id -> (log_version, [(news_id, explanation), ...]).
+        """
+        computed_at = datetime.now().isoformat()
+        conn = self._connect()
+        with conn:
+            for user_id, (log_version, items) in feeds.items():
+                conn.execute('DELETE FROM feed_items WHERE user_id = ?', (str(user_id),))
+                conn.execute(
+                    'INSERT OR REPLACE INTO feeds (user_id, log_version, corpus_key, computed_at) VALUES (?, ?, ?, ?)',
+                    (str(user_id), int(log_version), str(corpus_key), computed_at),
+                )
+                conn.executemany(
+                    'INSERT INTO feed_items (user_id, rank, news_id, explanation) VALUES (?, ?, ?, ?)',
+                    [(str(user_id), rank, int(news_id), expl) for rank, (news_id, expl) in enumerate(items)],
+                )
+
+    def load(self, user_id, log_version=None, corpus_key=None):
+        """
+        Return [(news_id, explanation), ...] for the user, or None when there is
+        no feed or it was computed for a different log version or corpus.
+        """
+        conn = self._connect()
+        feed = conn.execute(
+            'SELECT log_version, corpus_key FROM feeds WHERE user_id = ?', (str(user_id),)
+        ).fetchone()
+        if feed is None:
+            return None
+        if log_version is not None and feed[0] != log_version:
+            return None
+        if corpus_key is not None and feed[1] != str(corpus_key):
+            return None
+        items = pd.read_sql_query(
+            'SELECT news_id, explanation FROM feed_items WHERE user_id = ? ORDER BY rank',
+            conn,
+            params=(str(user_id),),
+        )
+        return list(items.itertuples(index=False, name=None))
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_recommendation_store():
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = RecommendationStore(RECOMMENDATIONS_DB_PATH)
+        return _store
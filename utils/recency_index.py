@@ -0,0 +1,182 @@
+import threading
+import weakref
+import numpy as np
+import pandas as pd
+from utils.cleaner import parse_dates
+from utils.instrument import span
+
+# Articles of each category, newest first, partitioned into per-day buckets, so
+# recency queries touch a few rows per category instead of sorting the corpus.
+# Positions refer to rows of the frame the index was built from; articles with
+# the same date keep their row order, and undated articles sort last.
+
+NS_PER_DAY = 86_400 * 10**9
+
+# Sort key of undated articles (keys are negated timestamps, so this is the oldest possible)
+UNDATED = np.iinfo(np.int64).max
+
+
+def _neg_keys(dates):
+    """Negated nanosecond timestamps (ascending = newest first), UNDATED for missing dates."""
+    dates = pd.Series(dates)
+    if not pd.api.types.is_datetime64_any_dtype(dates):
+        dates = parse_dates(dates)
+    values = dates.to_numpy(dtype='datetime64[ns]').astype(np.int64)
+    missing = dates.isna().to_numpy()
+    return np.where(missing, UNDATED, -values)
+
+
+def _neg_days(neg_keys):
+    dated = neg_keys != UNDATED
+    return np.where(dated, -((-neg_keys) // NS_PER_DAY), UNDATED)
+
+
+def index_hashes(news_df):
+    """Per-article hash of the index, category and date, used to match a frame to the index."""
+    columns = [col for col in ('category', 'date') if col in news_df.columns]
+    return pd.util.hash_pandas_object(news_df[columns], index=True).to_numpy()
+
+
+class RecencyIndex:
+    """
+    For every category: row positions sorted newest first, their sort keys,
+    and the start of each day's bucket. Categories are kept in order of first
+    appearance, like utils.ranking.top_per_category. New articles appended to
+    the frame are merged into the categories they belong to.
+    """
+
+    def __init__(self):
+        self.categories = []
+        self._codes = {}
+        self._rows = []
+        self._keys = []
+        self._bucket_days = []
+        self._bucket_starts = []
+        self.hashes = np.empty(0, dtype=np.uint64)
+        self.newest_day = None
+
+    @classmethod
+    def build(cls, news_df):
+        return cls().extend(news_df)
+
+    def __len__(self):
+        return len(self.hashes)
+
+    def _rebucket(self, code):
+        days = _neg_days(self._keys[code])
+        starts = np.flatnonzero(np.r_[True, days[1:] != days[:-1]]) if len(days) else np.empty(0, dtype=np.int64)
+        self._bucket_days[code] = days[starts]
+        self._bucket_starts[code] = starts
+
+    def extend(self, new_df):
+        """Add the rows of new_df, which follow the rows already indexed."""
+        offset = len(self)
+        codes, uniques = pd.factorize(pd.Series(new_df['category']).reset_index(drop=True))
+        keys = _neg_keys(new_df['date']) if 'date' in new_df.columns else np.full(len(new_df), UNDATED)
+        positions = np.arange(offset, offset + len(new_df))
+        # Sorted by category code, then newest first, then row order
+        order = np.lexsort((positions, keys, codes))
+        order = order[codes[order] >= 0]
+        sorted_codes = codes[order]
+        bounds = np.flatnonzero(np.r_[True, sorted_codes[1:] != sorted_codes[:-1], True])
+        for start, end in zip(bounds[:-1], bounds[1:]):
+            category = uniques[sorted_codes[start]]
+            rows, row_keys = positions[order[start:end]], keys[order[start:end]]
+            code = self._codes.get(category)
+            if code is None:
+                code = self._codes[category] = len(self.categories)
+                self.categories.append(category)
+                self._rows.append(rows)
+                self._keys.append(row_keys)
+                self._bucket_days.append(None)
+                self._bucket_starts.append(None)
+            else:
+                # New rows come after existing ones with the same date (side='right')
+                at = np.searchsorted(self._keys[code], row_keys, side='right')
+                self._rows[code] = np.insert(self._rows[code], at, rows)
+                self._keys[code] = np.insert(self._keys[code], at, row_keys)
+            self._rebucket(code)
+        self.hashes = np.concatenate([self.hashes, index_hashes(new_df)])
+        dated = keys[keys != UNDATED]
+        if len(dated):
+            newest = -dated.min() // NS_PER_DAY
+            self.newest_day = newest if self.newest_day is None else max(self.newest_day, newest)
+        return self
+
+    def latest_per_category(self, k=1):
+        """{category: positions of its k newest articles}, categories in order of first appearance."""
+        return {category: self._rows[code][:k] for code, category in enumerate(self.categories)}
+
+    def latest(self, k, exclude=None):
+        """Positions of the k newest articles overall, skipping positions in `exclude`."""
+        exclude = np.asarray([] if exclude is None else list(exclude), dtype=np.int64)
+        heads_rows, heads_keys = [], []
+        for rows, keys in zip(self._rows, self._keys):
+            # The k newest unexcluded rows of a category lie within its first k + len(exclude) rows
+            rows, keys = rows[:k + len(exclude)], keys[:k + len(exclude)]
+            keep = ~np.isin(rows, exclude)
+            heads_rows.append(rows[keep][:k])
+            heads_keys.append(keys[keep][:k])
+        if not heads_rows:
+            return np.empty(0, dtype=np.int64)
+        rows, keys = np.concatenate(heads_rows), np.concatenate(heads_keys)
+        return rows[np.lexsort((rows, keys))][:k]
+
+    def _window(self, code, days):
+        """Number of leading rows of a category dated within the last `days` days."""
+        if days is None:
+            return len(self._rows[code])
+        if self.newest_day is None:
+            return 0
+        bucket = np.searchsorted(self._bucket_days[code], -(self.newest_day - days + 1), side='right')
+        starts = self._bucket_starts[code]
+        return starts[bucket] if bucket < len(starts) else len(self._rows[code])
+
+    def random_per_category(self, k=1, days=None, rng=np.random):
+        """
+        {category: up to k random positions}, drawn from the articles of the
+        last `days` days (counted back from the newest article), or from all
+        of the category's articles when days is None.
+        """
+        picks = {}
+        for code, category in enumerate(self.categories):
+            n = self._window(code, days)
+            if n:
+                picks[category] = self._rows[code][rng.choice(n, size=min(k, n), replace=False)]
+        return picks
+
+    def since(self, timestamp, exclude=None):
+        """Positions of the articles dated at or after `timestamp`, skipping `exclude`, grouped by category."""
+        bound = -pd.Timestamp(timestamp).value
+        parts = [rows[:np.searchsorted(keys, bound, side='right')] for rows, keys in zip(self._rows, self._keys)]
+        candidates = np.concatenate(parts) if parts else np.empty(0, dtype=np.int64)
+        if exclude is not None:
+            candidates = candidates[~np.isin(candidates, np.asarray(list(exclude), dtype=np.int64))]
+        return candidates
+
+
+_index = None
+_index_frame = None
+_index_lock = threading.Lock()
+
+
+@span('recency_index.get')
+def get_recency_index(news_df):
+    """
+    Return the recency index for news_df. An index whose articles are a prefix
+    of news_df (as after ingestion) is extended with the new rows; otherwise
+    it is rebuilt.
+    """
+    global _index, _index_frame
+    with _index_lock:
+        # Shared frames are never modified in place, so the frame last matched needs no re-hashing
+        if _index is not None and _index_frame is not None and _index_frame() is news_df:
+            return _index
+        hashes = index_hashes(news_df)
+        n_known = 0 if _index is None else len(_index)
+        if _index is None or n_known > len(hashes) or not np.array_equal(_index.hashes, hashes[:n_known]):
+            _index = RecencyIndex.build(news_df)
+        elif n_known < len(hashes):
+            _index.extend(news_df.iloc[n_known:])
+        _index_frame = weakref.ref(news_df)
+        return _index
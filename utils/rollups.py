@@ -0,0 +1,445 @@
+import json
+import os
+import re
+import sqlite3
+import threading
+from datetime import date, timedelta
+import numpy as np
+import pandas as pd
+from dateutil.tz import tzlocal
+from utils.cleaner import parse_dates
+from utils.instrument import span
+
+ROLLUPS_DB_PATH = os.path.join('user_logs', 'rollups.db')
+
+# Daily buckets are kept for this many days; compact() folds older history down to its monthly buckets
+DAILY_RETENTION_DAYS = 92
+
+# Raw interactions older than this many days are deleted by compact() once rolled up (unset keeps the full log)
+RAW_LOG_RETENTION_DAYS = int(os.environ['CARVED_RAW_LOG_RETENTION_DAYS']) if os.environ.get('CARVED_RAW_LOG_RETENTION_DAYS') else None
+
+# Retention must keep at least this many profile half-lives of raw history: user
+# profiles replay the whole log, and older likes then weigh under 2 ** -8 of new ones
+RETENTION_HALF_LIVES = 8
+
+# Bucket of interactions without a usable timestamp; it is monthly only and counted in ranges without a start
+UNDATED = ''
+
+# last_ts of interactions without a usable timestamp, older than any real one
+UNDATED_TS = np.iinfo(np.int64).min
+
+# Timestamps that carry a UTC offset; the app logs naive local times (datetime.now())
+_TZ_SUFFIX = re.compile(r'(?:Z|[+-]\d{2}:?\d{2})$')
+
+# Topics that are only a number carry no meaning and are not counted
+_NUMERIC = re.compile(r'\d+')
+
+
+def _day(value):
+    return value.strftime('%Y-%m-%d')
+
+
+def _month(value):
+    return value.strftime('%Y-%m')
+
+
+def _month_end(value):
+    following = (value.replace(day=28) + timedelta(days=4)).replace(day=1)
+    return following - timedelta(days=1)
+
+
+def bucket_ranges(start=None, end=None, daily_from=UNDATED):
+    """
+    (period, first bucket, last bucket) ranges that cover the dates
+    start..end (inclusive, either may be None): whole months from the monthly
+    buckets, partial months at the edges from the daily ones. Days before
+    `daily_from` only exist as monthly buckets, so a partial month among them
+    is rounded out to the whole month.
+    """
+    ranges = []
+    lo_month = UNDATED if start is None else _month(start)
+    hi_month = '9999-12' if end is None else _month(end)
+    if start is not None and start.day != 1 and _day(start.replace(day=1)) >= daily_from:
+        last = _month_end(start) if end is None else min(end, _month_end(start))
+        ranges.append(('day', _day(start), _day(last)))
+        lo_month = _month(_month_end(start) + timedelta(days=1))
+    if (end is not None and end != _month_end(end) and _day(end.replace(day=1)) >= daily_from
+            and lo_month <= _month(end)):
+        ranges.append(('day', _day(end.replace(day=1)), _day(end)))
+        hi_month = _month(end.replace(day=1) - timedelta(days=1))
+    if lo_month <= hi_month:
+        ranges.append(('month', lo_month, hi_month))
+    return ranges
+
+
+def local_times(timestamps):
+    """
+    Parse log timestamps to naive local wall-clock times: naive ones are
+    already local, ones with a UTC offset are converted to local time. Day
+    buckets are local calendar days, like date.today() in the app.
+    """
+    text = pd.Series(timestamps).fillna('').astype(str)
+    aware = text.str.contains(_TZ_SUFFIX).to_numpy()
+    times = pd.Series(pd.NaT, index=text.index, dtype='datetime64[ns]')
+    if not aware.all():
+        times[~aware] = parse_dates(text[~aware]).to_numpy()
+    if aware.any():
+        times[aware] = parse_dates(text[aware], utc=True).dt.tz_convert(tzlocal()).dt.tz_localize(None).to_numpy()
+    return times
+
+
+def _labels(column):
+    """String labels of a category/topic column (categoricals stay dictionary-encoded)."""
+    if isinstance(column.dtype, pd.CategoricalDtype):
+        return column.cat.rename_categories(column.cat.categories.astype(str))
+    return column.astype(str)
+
+
+class RollupStore:
+    """
+    Per-user daily and monthly aggregates of the interaction log, in SQLite:
+    likes ('like') and discards ('discard') per category, topics of liked
+    articles ('topic') and articles seen for the first time ('new', key '').
+    Every (bucket, metric, key) row holds a count and the most recent
+    (timestamp, interaction id) behind it, the timestamp as int64 seconds of
+    local wall-clock time, so rows of any set of buckets can
+    be summed and still ranked by recency. A date range is answered from one
+    row per bucket and key, however long the raw history is.
+    """
+
+    def __init__(self, path=ROLLUPS_DB_PATH):
+        self.path = path
+        self._local = threading.local()
+        conn = self._connect()
+        with conn:
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS rollups ('
+                'user_id TEXT NOT NULL, '
+                'period TEXT NOT NULL, '
+                'bucket TEXT NOT NULL, '
+                'metric TEXT NOT NULL, '
+                'key TEXT NOT NULL, '
+                'count INTEGER NOT NULL, '
+                'last_ts INTEGER NOT NULL, '
+                'last_id INTEGER NOT NULL, '
+                'PRIMARY KEY (user_id, period, bucket, metric, key)) WITHOUT ROWID'
+            )
+            self._migrate_last_ts(conn)
+            # Articles each user has seen, so an article is counted as new only once
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS seen ('
+                'user_id TEXT NOT NULL, '
+                'news_id INTEGER NOT NULL, '
+                'PRIMARY KEY (user_id, news_id)) WITHOUT ROWID'
+            )
+            conn.execute('CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT NOT NULL)')
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    @staticmethod
+    def _migrate_last_ts(conn):
+        """Convert rollups written with last_ts as the raw timestamp text to int64 seconds."""
+        columns = {name: kind for _, name, kind, *_ in conn.execute('PRAGMA table_info(rollups)')}
+        if columns['last_ts'].upper() == 'INTEGER':
+            return
+        schema = conn.execute("SELECT sql FROM sqlite_master WHERE name = 'rollups'").fetchone()[0]
+        conn.execute('ALTER TABLE rollups RENAME TO rollups_text')
+        conn.execute(schema.replace('last_ts TEXT', 'last_ts INTEGER'))
+        # Same as local_times(): naive timestamps as written, ones with an offset in local time
+        conn.execute(
+            'INSERT INTO rollups SELECT user_id, period, bucket, metric, key, count, '
+            "COALESCE(CAST(CASE WHEN last_ts GLOB '*Z' OR last_ts GLOB '*[+-][0-9][0-9]:[0-9][0-9]' "
+            "THEN strftime('%s', last_ts, 'localtime') ELSE strftime('%s', last_ts) END AS INTEGER), ?), "
+            'last_id FROM rollups_text',
+            (int(UNDATED_TS),),
+        )
+        conn.execute('DROP TABLE rollups_text')
+
+    def _meta(self, conn, name, default):
+        row = conn.execute('SELECT value FROM meta WHERE name = ?', (name,)).fetchone()
+        return default if row is None else row[0]
+
+    def _set_meta(self, conn, name, value):
+        conn.execute('INSERT OR REPLACE INTO meta (name, value) VALUES (?, ?)', (name, str(value)))
+
+    def version(self):
+        """Id of the last interaction folded into the rollups (0 when empty)."""
+        return int(self._meta(self._connect(), 'version', 0))
+
+    def daily_from(self):
+        """First day that still has daily buckets after compaction ('' when nothing was compacted)."""
+        return self._meta(self._connect(), 'daily_from', UNDATED)
+
+    @span('rollups.refresh')
+    def refresh(self, store, news_df):
+        """Fold log rows written since the last refresh into the rollups. Returns the number folded."""
+        folded = 0
+        for chunk in store.iter_since(self.version()):
+            folded += self.apply_logs(chunk, news_df)
+        return folded
+
+    def apply_logs(self, logs, news_df):
+        """
+        Fold log rows (with their 'id' column) into the rollups in one
+        transaction. Rows at or below the stored version are skipped, so
+        concurrent refreshes never count a row twice.
+        """
+        conn = self._connect()
+        with conn:
+            conn.execute('BEGIN IMMEDIATE')
+            version = int(self._meta(conn, 'version', 0))
+            rows = self._prepare(logs[logs['id'] > version], news_df)
+            if rows.empty:
+                return 0
+            first_seen = self._first_seen(conn, rows)
+            liked = rows[(rows['action'] == 'like') & rows['category'].notna()]
+            discarded = rows[(rows['action'] == 'discard') & rows['category'].notna()]
+            parts = [
+                ('like', liked, liked['category']),
+                ('discard', discarded, discarded['category']),
+                ('topic', liked[liked['topic'].notna()], liked['topic'].dropna()),
+                ('new', rows.iloc[first_seen], ''),
+            ]
+            updates = []
+            for metric, part, keys in parts:
+                updates += self._bucket_updates(part.assign(key=keys), metric)
+            conn.executemany(
+                'INSERT INTO rollups (user_id, period, bucket, metric, key, count, last_ts, last_id) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?) '
+                'ON CONFLICT (user_id, period, bucket, metric, key) DO UPDATE SET '
+                'count = count + excluded.count, '
+                'last_ts = CASE WHEN (excluded.last_ts, excluded.last_id) > (last_ts, last_id) '
+                'THEN excluded.last_ts ELSE last_ts END, '
+                'last_id = CASE WHEN (excluded.last_ts, excluded.last_id) > (last_ts, last_id) '
+                'THEN excluded.last_id ELSE last_id END',
+                updates,
+            )
+            self._set_meta(conn, 'version', int(rows['id'].max()))
+        return len(rows)
+
+    @staticmethod
+    def _first_seen(conn, rows):
+        """
+        Positions in `rows` (oldest interaction first) of articles each user
+        sees for the first time, recording them in the seen table.
+        """
+        first = ~rows.duplicated(['user_id', 'news_id']).to_numpy()
+        incoming = zip(np.flatnonzero(first).tolist(), rows['user_id'][first], rows['news_id'][first].tolist())
+        conn.execute('CREATE TEMP TABLE IF NOT EXISTS incoming (position INTEGER, user_id TEXT, news_id INTEGER)')
+        conn.execute('DELETE FROM incoming')
+        conn.executemany('INSERT INTO incoming VALUES (?, ?, ?)', incoming)
+        first_seen = [position for position, in conn.execute(
+            'SELECT position FROM incoming i WHERE NOT EXISTS '
+            '(SELECT 1 FROM seen s WHERE s.user_id = i.user_id AND s.news_id = i.news_id) ORDER BY position')]
+        conn.execute('INSERT OR IGNORE INTO seen (user_id, news_id) SELECT user_id, news_id FROM incoming')
+        conn.execute('DELETE FROM incoming')
+        return first_seen
+
+    def _prepare(self, logs, news_df):
+        """Log rows with their day and month buckets and the liked category / topic of known articles."""
+        news_ids = pd.to_numeric(logs['news_id'], errors='coerce')
+        logs = logs[news_ids.notna()]
+        news_ids = news_ids[news_ids.notna()].astype('int64')
+        times = local_times(logs['timestamp'])
+        days = times.dt.strftime('%Y-%m-%d').fillna(UNDATED)
+        rows = pd.DataFrame({
+            'id': logs['id'].astype('int64'),
+            'user_id': logs['user_id'].astype(str),
+            'news_id': news_ids,
+            'action': logs['action'].astype(str),
+            'ts': times.to_numpy('datetime64[s]').astype('int64'),
+            'day': days,
+            'month': days.str[:7],
+        })
+        category = _labels(news_df['category']) if 'category' in news_df.columns else None
+        topic = _labels(news_df['topic']) if 'topic' in news_df.columns else None
+        rows['category'] = None if category is None else category.reindex(news_ids).to_numpy(dtype=object)
+        if topic is None:
+            rows['topic'] = None
+        else:
+            topics = pd.Series(topic.reindex(news_ids).to_numpy(dtype=object), index=rows.index)
+            rows['topic'] = topics.where(topics.notna() & ~topics.astype(str).str.fullmatch(_NUMERIC.pattern))
+        # Most recent last: 'last' in each group is then the latest (timestamp, id)
+        return rows.sort_values(['ts', 'id'], kind='stable')
+
+    @staticmethod
+    def _bucket_updates(part, metric):
+        updates = []
+        for period in ('day', 'month'):
+            rows = part if period == 'month' else part[part['day'] != UNDATED]
+            if rows.empty:
+                continue
+            grouped = rows.groupby(['user_id', period, 'key'], sort=False).agg(
+                count=('id', 'size'), last_ts=('ts', 'last'), last_id=('id', 'last'))
+            updates += [(user_id, period, bucket, metric, str(key), int(count), int(last_ts), int(last_id))
+                        for (user_id, bucket, key), count, last_ts, last_id in zip(
+                            grouped.index, grouped['count'], grouped['last_ts'], grouped['last_id'])]
+        return updates
+
+    @span('rollups.totals')
+    def totals(self, user_id, start=None, end=None):
+        """
+        The user's aggregates over the dates start..end (inclusive; None for
+        no bound), one row per (metric, key) with count, last_ts and last_id.
+        """
+        ranges = bucket_ranges(start, end, self.daily_from())
+        where = ' OR '.join('(period = ? AND bucket BETWEEN ? AND ?)' for _ in ranges)
+        rows = self._connect().execute(
+            f'SELECT metric, key, count, last_ts, last_id FROM rollups WHERE user_id = ? AND ({where})',
+            [str(user_id)] + [value for bounds in ranges for value in bounds],
+        ) if ranges else []
+        # Few rows per bucket, so they are summed in Python rather than through a DataFrame
+        totals = {}
+        for metric, key, count, last_ts, last_id in rows:
+            entry = totals.get((metric, key))
+            if entry is None:
+                totals[(metric, key)] = [count, last_ts, last_id]
+            else:
+                entry[0] += count
+                if (last_ts, last_id) > (entry[1], entry[2]):
+                    entry[1], entry[2] = last_ts, last_id
+        return pd.DataFrame([(metric, key, *entry) for (metric, key), entry in totals.items()],
+                            columns=['metric', 'key', 'count', 'last_ts', 'last_id'])
+
+    @span('rollups.timeline')
+    def timeline(self, user_id, start=None, end=None, period='month'):
+        """
+        Likes, discards and newly seen articles per bucket of `period` ('day'
+        or 'month') between start and end, as a frame indexed by bucket.
+        """
+        lo = UNDATED if start is None else (_day(start) if period == 'day' else _month(start))
+        hi = '9999-12-31' if end is None else (_day(end) if period == 'day' else _month(end))
+        rows = pd.read_sql_query(
+            "SELECT bucket, metric, SUM(count) AS count FROM rollups "
+            "WHERE user_id = ? AND period = ? AND bucket BETWEEN ? AND ? AND bucket != '' "
+            "AND metric IN ('like', 'discard', 'new') GROUP BY bucket, metric",
+            self._connect(),
+            params=(str(user_id), period, lo, hi),
+        )
+        timeline = rows.pivot(index='bucket', columns='metric', values='count')
+        return timeline.reindex(columns=['like', 'discard', 'new']).fillna(0).astype('int64').sort_index()
+
+    @span('rollups.compact')
+    def compact(self, today=None, daily_days=DAILY_RETENTION_DAYS, store=None, raw_days=RAW_LOG_RETENTION_DAYS):
+        """
+        Drop daily buckets of whole months older than `daily_days` (their
+        monthly buckets remain) and, when `raw_days` is set, delete raw
+        interactions older than that which every snapshot already covers
+        (see retention_limit). Returns (daily rows dropped, raw interactions
+        deleted, reason retention was skipped or None).
+        """
+        today = today or date.today()
+        daily_from = _day((today - timedelta(days=daily_days)).replace(day=1))
+        conn = self._connect()
+        with conn:
+            conn.execute('BEGIN IMMEDIATE')
+            daily_from = max(daily_from, self._meta(conn, 'daily_from', UNDATED))
+            dropped = conn.execute(
+                "DELETE FROM rollups WHERE period = 'day' AND bucket < ?", (daily_from,)
+            ).rowcount
+            self._set_meta(conn, 'daily_from', daily_from)
+        if store is None or raw_days is None:
+            return dropped, 0, None
+        max_id, skipped = self.retention_limit(store, raw_days)
+        if skipped:
+            return dropped, 0, skipped
+        return dropped, store.delete_before(_day(today - timedelta(days=raw_days)), max_id), None
+
+    def retention_limit(self, store, raw_days):
+        """
+        (highest interaction id that may be deleted, None), or (None, reason)
+        when deleting would lose history that is rebuilt from the raw log:
+        - the interaction matrix restarts from its snapshot, so only rows it
+          covers may go, and it must have one;
+        - the factor model is retrained from the log, so only rows its saved
+          model covers may go (retraining it cold afterwards needs allow_partial);
+        - user profiles are rebuilt from the log in every process, so retention
+          needs a profile half-life and RETENTION_HALF_LIVES of them kept.
+        """
+        import numpy as np
+        from utils.factorization import FACTORS_DIR
+        from utils.interaction_matrix import INTERACTION_MATRIX_PATH
+        from utils.user_profiles import PROFILE_HALF_LIFE_DAYS
+        if not store.supports_retention:
+            return None, (f'{type(store).__name__} keeps every interaction (its ids are row positions); '
+                          f'migrate the log to SQLite to prune it')
+        if not PROFILE_HALF_LIFE_DAYS or raw_days < RETENTION_HALF_LIVES * PROFILE_HALF_LIFE_DAYS:
+            return None, (f'user profiles are rebuilt from the raw log; retention needs PROFILE_HALF_LIFE_DAYS set '
+                          f'and at least {RETENTION_HALF_LIVES} half-lives of history kept')
+        limits = [self.version()]
+        try:
+            with np.load(INTERACTION_MATRIX_PATH) as snapshot:
+                limits.append(int(snapshot['version']))
+        except (OSError, ValueError, KeyError):
+            return None, f'no interaction matrix snapshot at {INTERACTION_MATRIX_PATH} to rebuild from'
+        try:
+            with open(os.path.join(FACTORS_DIR, 'meta.json')) as f:
+                limits.append(int(json.load(f)['version']))
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError, KeyError):
+            return None, f'unreadable factor model at {FACTORS_DIR}'
+        return min(limits), None
+
+    def clear(self):
+        """Drop every aggregate, e.g. before rebuilding from the log for a new article corpus."""
+        conn = self._connect()
+        with conn:
+            for table in ('rollups', 'seen', 'meta'):
+                conn.execute(f'DELETE FROM {table}')
+
+
+_rollups = None
+_rollups_lock = threading.Lock()
+
+
+def get_rollup_store():
+    """Return the process-wide rollup store."""
+    global _rollups
+    with _rollups_lock:
+        if _rollups is None:
+            _rollups = RollupStore(ROLLUPS_DB_PATH)
+        return _rollups
+
+
+if __name__ == '__main__':
+    import argparse
+    import time
+    from utils.article_store import load_articles, NEWS_PATH, NEWS_COLUMNS
+    from utils.log_store import get_log_store
+    parser = argparse.ArgumentParser(description='Catch up, compact or rebuild the per-user interaction rollups.')
+    parser.add_argument('--rebuild', action='store_true', help='Drop the rollups and fold the whole log again')
+    parser.add_argument('--compact', action='store_true', help='Drop old daily buckets and apply the raw log retention')
+    parser.add_argument('--daily-days', type=int, default=DAILY_RETENTION_DAYS)
+    parser.add_argument('--raw-days', type=int, default=RAW_LOG_RETENTION_DAYS,
+                        help='Delete raw interactions older than this many days once rolled up')
+    parser.add_argument('--allow-partial', action='store_true',
+                        help='Allow --rebuild after raw interactions were deleted (older history is lost)')
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    news_df = load_articles(NEWS_PATH, columns=NEWS_COLUMNS, on_error=print)
+    if news_df is None:
+        raise SystemExit(f"Could not load {NEWS_PATH}")
+    rollups, store = get_rollup_store(), get_log_store()
+    if args.rebuild:
+        if store.pruned_through() and not args.allow_partial:
+            raise SystemExit(f"Interactions up to id {store.pruned_through()} were deleted by the retention policy; "
+                             f"a rebuild would drop them from the rollups (pass --allow-partial to rebuild anyway)")
+        rollups.clear()
+    folded = rollups.refresh(store, news_df)
+    print(f"Folded {folded} interactions, rollups at log version {rollups.version()}")
+    if args.compact:
+        dropped, deleted, skipped = rollups.compact(daily_days=args.daily_days, store=store, raw_days=args.raw_days)
+        print(f"Dropped {dropped} daily buckets, deleted {deleted} raw interactions")
+        if skipped:
+            print(f"Raw log retention skipped: {skipped}")
+    print(f"Done in {time.perf_counter() - start:.1f}s")
@@ -0,0 +1,291 @@
+import hashlib
+import os
+import threading
+from collections import deque
+from datetime import datetime, timezone
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+from utils.cleaner import parse_dates
+from utils.instrument import span
+
+USER_PROFILES_PATH = os.path.join('user_logs', 'user_profiles.npz')
+
+# Contribution of each action to a profile; discards only mark an article as seen by default
+ACTION_WEIGHTS = {'like': 1.0, 'discard': 0.0}
+
+# Half-life for time-decay weighting of interactions (None keeps every interaction at full weight)
+PROFILE_HALF_LIFE_DAYS = None
+
+# Interactions with articles the model does not know kept for a retry (oldest dropped first)
+MAX_PENDING = 10000
+
+# Save a snapshot after this many new log rows
+SNAPSHOT_EVERY = 500
+
+# Exponent of a decay weight above which a profile is rebased before the weights overflow
+MAX_EXPONENT = 500
+
+
+def _parse_time(timestamp):
+    """Epoch seconds, reading naive timestamps as UTC like parse_dates(utc=True); None when unparsable."""
+    try:
+        parsed = datetime.fromisoformat(str(timestamp))
+    except ValueError:
+        parsed = parse_dates([timestamp], utc=True).iloc[0]
+        return None if pd.isna(parsed) else parsed.timestamp()
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.timestamp()
+
+
+def vocabulary_key(model):
+    """Hash of the model's feature space; profiles only carry over between models that share it."""
+    terms = sorted(model.vocabulary.items(), key=lambda item: item[1])
+    return hashlib.sha1('\n'.join(term for term, _ in terms).encode()).hexdigest()
+
+
+class UserProfileStore:
+    """
+    Per-user term-count profiles in the article model's feature space.
+    A like adds the article's term counts to the profile, so an update costs
+    O(article nnz). Scoring weights the profile by idf, which ranks articles
+    the same way as TF-IDF over the joined topics and categories of liked articles.
+
+    With a half-life set, later interactions are weighted up by
+    2 ** (age / half_life) instead of decaying every profile on each write;
+    only the direction of a profile matters for cosine scoring.
+    """
+
+    def __init__(self, model, half_life_days=PROFILE_HALF_LIFE_DAYS, action_weights=None):
+        self.model = model
+        self.half_life = half_life_days * 86400 if half_life_days else None
+        self.action_weights = action_weights or ACTION_WEIGHTS
+        self.profiles = {}
+        self.version = 0
+        self._ref_time = {}
+        # Interactions with articles the model did not know yet, retried when it grows
+        self._pending = deque(maxlen=MAX_PENDING)
+        self._n_articles = model.counts.shape[0]
+        self._lock = threading.Lock()
+
+    def _decay_weight(self, user_id, timestamp):
+        if self.half_life is None:
+            return 1.0
+        t = _parse_time(timestamp)
+        if t is None:
+            return 1.0
+        ref = self._ref_time.setdefault(user_id, t)
+        exponent = (t - ref) / self.half_life
+        if exponent > MAX_EXPONENT:
+            # Rebase before the weights overflow
+            scale = 2.0 ** -exponent
+            profile = self.profiles.get(user_id, {})
+            for term in profile:
+                profile[term] *= scale
+            self._ref_time[user_id] = t
+            exponent = 0.0
+        return 2.0 ** exponent
+
+    def apply(self, user_id, news_id, action, timestamp=None):
+        """Fold a single interaction into the user's profile."""
+        weight = self.action_weights.get(action, 0.0)
+        if weight == 0:
+            return
+        pos = self.model.positions([int(news_id)])[0]
+        if pos < 0:
+            with self._lock:
+                self._pending.append((user_id, news_id, action, timestamp))
+            return
+        with self._lock:
+            weight *= self._decay_weight(user_id, timestamp)
+            profile = self.profiles.setdefault(user_id, {})
+            counts = self.model.counts
+            start, end = counts.indptr[pos], counts.indptr[pos + 1]
+            for term, count in zip(counts.indices[start:end], counts.data[start:end]):
+                profile[term] = profile.get(term, 0.0) + weight * count
+
+    def apply_logs(self, logs):
+        """
+        Fold many interactions at once: article positions are looked up for the
+        whole chunk and each user's contribution is one row of a sparse
+        (users x articles) @ (articles x terms) product.
+        """
+        if logs.empty:
+            return
+        actions = logs['action'].astype(str)
+        weights = actions.map(self.action_weights).fillna(0.0).to_numpy(np.float64)
+        rows = logs[weights != 0]
+        weights = weights[weights != 0]
+        news_ids = pd.to_numeric(rows['news_id'], errors='coerce').fillna(-1).astype('int64')
+        positions = self.model.positions(news_ids)
+        unknown = positions < 0
+        if unknown.any():
+            with self._lock:
+                self._pending.extend(rows.loc[unknown, ['user_id', 'news_id', 'action', 'timestamp']]
+                                     .itertuples(index=False, name=None))
+        rows, weights, positions = rows[~unknown], weights[~unknown], positions[~unknown]
+        codes, users = pd.factorize(rows['user_id'])
+        with self._lock:
+            if self.half_life is not None and len(rows):
+                weights = weights * self._chunk_decay(codes, users, rows['timestamp'])
+                # Users whose weights would overflow are replayed row by row, which rebases them
+                rebase = np.isnan(weights)
+                replay = rows[rebase]
+                codes, weights, positions = codes[~rebase], weights[~rebase], positions[~rebase]
+            else:
+                replay = rows.iloc[:0]
+            contributions = sp.csr_matrix(
+                (weights, (codes, positions)), shape=(len(users), self.model.counts.shape[0])
+            ) @ self.model.counts
+            for code in np.flatnonzero(np.diff(contributions.indptr)):
+                profile = self.profiles.setdefault(users[code], {})
+                start, end = contributions.indptr[code], contributions.indptr[code + 1]
+                for term, value in zip(contributions.indices[start:end].tolist(), contributions.data[start:end].tolist()):
+                    profile[term] = profile.get(term, 0.0) + value
+        for row in replay[['user_id', 'news_id', 'action', 'timestamp']].itertuples(index=False, name=None):
+            self.apply(*row)
+        if 'id' in logs.columns:
+            self.version = max(self.version, int(logs['id'].max()))
+
+    def _chunk_decay(self, codes, users, timestamps):
+        """Decay weights of a chunk's rows (1 when undated), NaN for users that need a rebase."""
+        seconds = parse_dates(timestamps, utc=True)
+        dated = seconds.notna().to_numpy()
+        t = np.where(dated, seconds.to_numpy('datetime64[ns]').view('int64') / 1e9, np.nan)
+        refs = np.array([self._ref_time.get(user, np.nan) for user in users], dtype=np.float64)
+        # Users seen for the first time start from their first dated interaction
+        first = pd.Series(t[dated]).groupby(codes[dated]).first()
+        new = np.isnan(refs[first.index.to_numpy()])
+        refs[first.index.to_numpy()[new]] = first.to_numpy()[new]
+        for code in first.index.to_numpy()[new]:
+            self._ref_time[users[code]] = refs[code]
+        exponents = (t - refs[codes]) / self.half_life
+        overflow = np.zeros(len(users), dtype=bool)
+        overflow[codes[dated & (exponents > MAX_EXPONENT)]] = True
+        weights = np.where(dated, 2.0 ** np.where(dated, np.minimum(exponents, MAX_EXPONENT), 0.0), 1.0)
+        weights[overflow[codes]] = np.nan
+        return weights
+
+    def _retry_pending(self):
+        """Apply pending interactions whose articles the model has learned since (see get_article_model)."""
+        with self._lock:
+            if self.model.counts.shape[0] == self._n_articles:
+                return
+            self._n_articles = self.model.counts.shape[0]
+            pending = list(self._pending)
+            self._pending.clear()
+        for row in pending:
+            self.apply(*row)
+
+    def refresh(self, store):
+        """Apply log rows written since this store's version, and pending ones the model now covers."""
+        self._retry_pending()
+        for new_rows in store.iter_since(self.version):
+            self.apply_logs(new_rows)
+
+    def save(self, path=USER_PROFILES_PATH):
+        """Snapshot the profiles, keyed on the log version and the model's feature space."""
+        with self._lock:
+            users = list(self.profiles)
+            sizes = [len(self.profiles[user]) for user in users]
+            indptr = np.r_[0, np.cumsum(sizes)].astype(np.int64)
+            indices = np.fromiter((term for user in users for term in self.profiles[user]), dtype=np.int64,
+                                  count=indptr[-1])
+            data = np.fromiter((value for user in users for value in self.profiles[user].values()),
+                               dtype=np.float64, count=indptr[-1])
+            pending = np.empty(len(self._pending), dtype=object)
+            for i, row in enumerate(self._pending):
+                pending[i] = row
+            tmp_path = path + '.tmp.npz'
+            np.savez(
+                tmp_path,
+                user_ids=np.array(users, dtype=object),
+                indptr=indptr,
+                indices=indices,
+                data=data,
+                ref_times=np.array([self._ref_time.get(user, np.nan) for user in users], dtype=np.float64),
+                pending=pending,
+                half_life=np.array(self.half_life or 0.0),
+                vocabulary=np.array(vocabulary_key(self.model)),
+                version=np.array(self.version),
+            )
+            os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, model, path=USER_PROFILES_PATH, half_life_days=PROFILE_HALF_LIFE_DAYS):
+        """Profiles saved for this model's feature space and half-life, or None."""
+        profiles = cls(model, half_life_days)
+        with np.load(path, allow_pickle=True) as snapshot:
+            if str(snapshot['vocabulary']) != vocabulary_key(model) or float(snapshot['half_life']) != (profiles.half_life or 0.0):
+                return None
+            indptr, indices, data = snapshot['indptr'], snapshot['indices'].tolist(), snapshot['data'].tolist()
+            for i, (user, ref) in enumerate(zip(snapshot['user_ids'].tolist(), snapshot['ref_times'].tolist())):
+                profiles.profiles[user] = dict(zip(indices[indptr[i]:indptr[i + 1]], data[indptr[i]:indptr[i + 1]]))
+                if not np.isnan(ref):
+                    profiles._ref_time[user] = ref
+            profiles._pending.extend(tuple(row) for row in snapshot['pending'].tolist())
+            profiles.version = int(snapshot['version'])
+        # Pending rows may belong to articles the model has learned since the snapshot
+        profiles._n_articles = -1
+        return profiles
+
+    def vector(self, user_id):
+        """L2-normalised TF-IDF profile (1 x n_features, sparse); all zeros without likes."""
+        from sklearn.preprocessing import normalize
+        profile = self.profiles.get(user_id, {})
+        n_features = len(self.model.idf)
+        if not profile:
+            return sp.csr_matrix((1, n_features))
+        terms = np.fromiter(profile.keys(), dtype=np.int64, count=len(profile))
+        weights = np.fromiter(profile.values(), dtype=np.float64, count=len(profile))
+        vec = sp.csr_matrix((weights * self.model.idf[terms], (np.zeros(len(terms), dtype=np.int64), terms)), shape=(1, n_features))
+        return normalize(vec)
+
+    @span('user_profiles.scores')
+    def scores(self, user_id):
+        """Cosine similarity of the user's profile with every article."""
+        return (self.model.matrix @ self.vector(user_id).T).toarray().ravel()
+
+
+_profiles = None
+_saved_version = 0
+_profiles_lock = threading.Lock()
+
+
+@span('user_profiles.get')
+def get_user_profiles(model, store):
+    """
+    Return the process-wide profile store, caught up with the log store.
+    The first call for a model starts from the on-disk snapshot when it was
+    saved for the same feature space and log; otherwise profiles are rebuilt
+    from the full log, which after log retention is the retained history
+    (see utils/rollups.py).
+    """
+    global _profiles, _saved_version
+    with _profiles_lock:
+        if _profiles is None or _profiles.model is not model:
+            profiles = None
+            if os.path.exists(USER_PROFILES_PATH):
+                try:
+                    profiles = UserProfileStore.load(model)
+                except (OSError, ValueError, KeyError):
+                    profiles = None
+            # A snapshot ahead of the store belongs to a different log; start over
+            if profiles is None or profiles.version > store.version():
+                profiles = UserProfileStore(model)
+            _profiles = profiles
+            _saved_version = profiles.version
+        _profiles.refresh(store)
+        if _profiles.version - _saved_version >= SNAPSHOT_EVERY or (_saved_version == 0 and _profiles.version > 0):
+            _profiles.save(USER_PROFILES_PATH)
+            _saved_version = _profiles.version
+        return _profiles
+
+
+@span('user_profiles.refresh')
+def refresh_user_profiles(store):
+    """Fold new log rows into the profiles if this process has them loaded."""
+    if _profiles is not None:
+        with _profiles_lock:
+            _profiles.refresh(store)
@@ -1,8 +1,22 @@
-import matplotlib.pyplot as plt
-import seaborn as sns
-import plotly.express as px
-from wordcloud import WordCloud
-import pandas as pd
+import hashlib
+import io
+import threading
+from collections import OrderedDict
+from utils.instrument import registry, span
+
+# matplotlib, seaborn, plotly and wordcloud are imported inside the plotting
+# functions, so importing this module stays cheap until a chart is drawn.
+
+# Rendered charts kept in memory (least recently used are evicted first)
+CHART_CACHE_SIZE = 64
+
+# Import the plotting libraries ahead of the first chart (used by the warm-up hook)
+
+def preload():
+    import matplotlib.pyplot  # noqa: F401
+    import seaborn  # noqa: F401
+    import plotly.express  # noqa: F401
+    import wordcloud  # noqa: F401
 
 # Bar chart using seaborn
 
@@ -19,6 +33,7 @@ def plot_category_bar(data):
 
 def plot_category_pie(data):
     """Plot a pie chart of news by category."""
+    import plotly.express as px
     fig = px.pie(data, names='category', title='News Distribution by Category')
     return fig
 
@@ -56,4 +71,98 @@ def plot_topic_wordcloud(data):
     plt.imshow(wc, interpolation='bilinear')
     plt.axis('off')
     plt.title('Topic Word Cloud')
-    return fig
\ No newline at end of file
+    return fig
+
+# --- Cached rendering from pre-aggregated counts ---
+# The functions below take counts (e.g. UserAggregates.category_counts, summed
+# from the rollups for a date range) instead of the raw frame and render each
+# distinct input once; figures are closed
+# after rendering so nothing accumulates in matplotlib's figure registry.
+
+_chart_cache = OrderedDict()
+_chart_lock = threading.Lock()
+# pyplot keeps global state, so concurrent sessions render one chart at a time
+_render_lock = threading.Lock()
+
+
+def _counts_key(kind, counts, fmt):
+    digest = hashlib.sha1(repr([(str(k), int(v)) for k, v in counts.items()]).encode('utf-8')).hexdigest()
+    return (kind, fmt, digest)
+
+
+def _cached(key, render):
+    with _chart_lock:
+        if key in _chart_cache:
+            _chart_cache.move_to_end(key)
+            registry.incr('chart.cache_hit')
+            return _chart_cache[key]
+    registry.incr('chart.cache_miss')
+    with _render_lock, span(f'chart.render.{key[0]}'):
+        value = render()
+    with _chart_lock:
+        _chart_cache[key] = value
+        while len(_chart_cache) > CHART_CACHE_SIZE:
+            _chart_cache.popitem(last=False)
+    return value
+
+
+def _to_bytes(fig, fmt):
+    import matplotlib.pyplot as plt
+    buf = io.BytesIO()
+    try:
+        fig.savefig(buf, format=fmt, bbox_inches='tight')
+    finally:
+        plt.close(fig)
+    return buf.getvalue()
+
+
+def category_bar_image(category_counts, fmt='png'):
+    """Bar chart of liked articles per category, as PNG/SVG bytes."""
+    def render():
+        import matplotlib.pyplot as plt
+        import seaborn as sns
+        fig, ax = plt.subplots()
+        sns.barplot(x=category_counts.to_numpy(), y=category_counts.index.astype(str), orient='h', ax=ax)
+        ax.set_xlabel('count')
+        ax.set_ylabel('category')
+        ax.set_title('News Count by Category')
+        return _to_bytes(fig, fmt)
+    return _cached(_counts_key('bar', category_counts, fmt), render)
+
+
+def category_pie_figure(category_counts):
+    """Plotly pie chart of liked articles per category (shared figure, do not modify)."""
+    def render():
+        import plotly.express as px
+        return px.pie(names=category_counts.index.astype(str), values=category_counts.to_numpy(),
+                      title='News Distribution by Category')
+    return _cached(_counts_key('pie', category_counts, 'plotly'), render)
+
+
+def topic_wordcloud_image(topic_counts, fmt='png'):
+    """Word cloud of topic frequencies, as PNG/SVG bytes."""
+    def render():
+        import matplotlib.pyplot as plt
+        from wordcloud import WordCloud
+        # Same text the frame-based word cloud joins together: each topic once per like
+        text = ' '.join(' '.join([str(topic)] * int(count)) for topic, count in topic_counts.items())
+        if not text.split():
+            text = 'No topics available'
+        fig, ax = plt.subplots(figsize=(10, 5))
+        wc = WordCloud(width=800, height=400, background_color='white').generate(text)
+        ax.imshow(wc, interpolation='bilinear')
+        ax.axis('off')
+        ax.set_title('Topic Word Cloud')
+        return _to_bytes(fig, fmt)
+    return _cached(_counts_key('wordcloud', topic_counts, fmt), render)
+
+
+def activity_figure(timeline):
+    """Plotly bar chart of likes, discards and new articles per bucket of a rollup timeline (shared figure)."""
+    def render():
+        import plotly.express as px
+        frame = timeline.rename(columns={'like': 'liked', 'discard': 'discarded', 'new': 'new articles'})
+        return px.bar(frame, x=frame.index.astype(str), y=list(frame.columns), barmode='group',
+                      labels={'x': 'period', 'value': 'count', 'variable': ''}, title='Your Activity Over Time')
+    digest = hashlib.sha1(timeline.to_csv().encode('utf-8')).hexdigest()
+    return _cached(('activity', 'plotly', digest), render)